@@ -6,7 +6,16 @@
     @brief Basic ADC control for common ADC modules
 
 """
-import spidev
+from SPIBus import SPIBus, SPIMessage
+from utils import Delay
+import threading
+import time
+from array import array
+
+try:
+    import numpy  # only needed by ADCPipeline
+except ImportError:
+    numpy = None
 
 
 class MCP3008(object):
@@ -20,6 +29,7 @@ class MCP3008(object):
             adc = MCP3008()  # all defaults
             adc.read(MCP3008.CH0)  # reads the value on channel 0 w.r.t VRef
             adc.read(MCP3008.CH0_POS_CH1_NEG)  # reads the value difference between CH0+ and CH1-
+            adc.scan()  # reads all 8 single ended channels into an array('H')
 
         @endcode
     """
@@ -41,17 +51,67 @@ class MCP3008(object):
     CH6_POS_CH7_NEG = 14
     CH7_POS_CH6_NEG = 15
 
-    def __init__(self, bus_select=0, chip_select=0, freq=500000):
+    SINGLE_ENDED = (CH0, CH1, CH2, CH3, CH4, CH5, CH6, CH7)
+    DIFFERENTIAL = (CH0_POS_CH1_NEG, CH1_POS_CH0_NEG, CH2_POS_CH3_NEG, CH3_POS_CH2_NEG,
+                    CH4_POS_CH5_NEG, CH5_POS_CH4_NEG, CH6_POS_CH7_NEG, CH7_POS_CH6_NEG)
+
+    def __init__(self, bus_select=0, chip_select=0, freq=500000, _spi=None):
         """
         MCP3008 ADC chip SPI interface
 
         @param bus_select select the SPI bus
         @param chip_select select the chip to drive
         @param freq max frequency of the SPI interface
+        @param _spi the SPIBus.SPIBus to use if not opening bus_select/chip_select, it is not closed with the ADC
+        """
+        self._owns_spi = _spi is None
+        if _spi is None:
+            _spi = SPIBus(bus_select, chip_select, max_speed_hz=freq)
+        self._spi = _spi
+        self._bus_select = _spi.bus()
+        self._chip_select = _spi.port()
+        self._command_cache = dict()  # channel tuple -> prebuilt SPIMessage of conversion requests
+
+    @staticmethod
+    def _command(channel_mode):
+        """
+        builds the 3 byte conversion request for channel_mode
+
+        a little explanation here
+        we're sending 3 bytes
+        the first is 00000001, the start bit
+        the second is the SGL/DIFF bit then the channel bitshifted left 4
+            i.e single channel mode channel 0 makes the second byte
+            1000 + 0 << 4 = 10000000
+            and diff channel mode channel 0+ channel 1- makes the second byte
+            0000 + 0 << 4 = 00000000
+        the third byte is all 0
+        """
+        if channel_mode > 7 and channel_mode < 16:
+            return [1, (channel_mode-8) << 4, 0]
+        elif channel_mode < 8 and channel_mode > -1:
+            return [1, (8+channel_mode) << 4, 0]
+        return None
+
+    @staticmethod
+    def _decode(result):
+        """
+        we get back 3 bytes, and since there is 10 bit resolution on
+        this chip, we need the low two bits of the second byte and the full third byte
+        """
+        return ((result[1] & 0x03) << 8) | result[2]
+
+    def _transfer_many(self, commands):
+        """
+        runs one conversion per command, the chip needs chip select
+        released between conversions so each is its own segment of
+        one batched SPI message
+        @param commands: a list of 3 byte conversion requests, or an SPIMessage of them
+        @return: a list of 3 byte responses
         """
-        self._spi = spidev.SpiDev()
-        self._spi.open(bus_select, chip_select)
-        self._spi.max_speed_hz = freq
+        if isinstance(commands, SPIMessage):
+            return commands.submit()
+        return self._spi.xfer_many(commands)
 
     def read(self, channel_mode):
         """
@@ -60,51 +120,551 @@ class MCP3008(object):
                 defines the mode and pins used for this read
         @return int the 10 bit value from [0,1023]
         """
-        if channel_mode > 7 and channel_mode < 16:
-             #  a little explanation here
-            #  we're sending 3 bytes
-            #  the first is 00000001
-            #  the second is 0 + channel bitshifted left 4
-            #     i.e diff channel mode channel 0+ channel 1- makes the second byte
-            #     0000 + 0 << 4 = 00000000
-            #  the third byte is all 0
-            #  we will get back 3 bytes, and since there is 10 bit
-            #  resolution on this chip, we need to get two bits from the
-            #  second part of the result and the full byte of the last
-            result = self._spi.xfer([1, (channel_mode-8) << 4, 0])
-            byte1 = hex(result[1])[2:]  # stripping the 0x from the front
-            byte2 = hex(result[2])[2:]
-
-            return int((byte1+byte2), 16)  # return a base-10 repr of the hex value
+        command = MCP3008._command(channel_mode)
+        if command is None:
+            print "Unknown channel selection %s" % (channel_mode)
+            return None
+        return MCP3008._decode(self._spi.xfer(command))
 
-        elif channel_mode < 8 and channel_mode > -1:
-            #  a little explanation here
-            #  we're sending 3 bytes
-            #  the first is 00000001
-            #  the second is 1000 + channel bitshifted left 4
-            #     i.e single channel mode channel 0 makes the second byte
-            #     1000 + 0 << 4 = 1000000
-            #  the third byte is all 0
-            #  we will get back 3 bytes, and since there is 10 bit
-            #  resolution on this chip, we need to get two bits from the
-            #  second part of the result and the full byte of the last
-
-            result = self._spi.xfer([1, (8+channel_mode) << 4, 0])
-            byte1 = hex(result[1])[2:]  # stripping the 0x from the front
-            byte2 = hex(result[2])[2:]
-
-            return int((byte1+byte2), 16)  # return a base-10 repr of the hex value
+    def read_many(self, channels, out=None, offset=0):
+        """
+        reads several channels in one batch
 
-        else:
-            print "Unknown channel selection %s" % (channel_mode)
+        @param channels a sequence of MCP3008.CHx or MCP3008.CHx_POS_CHy_NEG values
+        @param out an optional preallocated array('H') (or anything indexable) of at least len(channels)
+        @param offset where in out to put the first value
+        @return array('H') of 10 bit values, in the order of channels
+        """
+        channels = tuple(channels)
+        commands = self._command_cache.get(channels)
+        if commands is None:
+            commands = list()
+            for channel_mode in channels:
+                command = MCP3008._command(channel_mode)
+                if command is None:
+                    raise ValueError("Unknown channel selection %s" % (channel_mode))
+                commands.append(command)
+            commands = self._spi.message(commands)
+            self._command_cache[channels] = commands
+        if out is None:
+            out = array('H', [0]) * len(commands)
+
+        i = offset
+        for result in self._transfer_many(commands):
+            out[i] = ((result[1] & 0x03) << 8) | result[2]  # _decode() inlined
+            i += 1
+        return out
+
+    def scan(self, differential=False, out=None):
+        """
+        reads all 8 channels in one batch
+
+        @param differential read the 8 differential pairs instead of the single ended inputs
+        @param out an optional preallocated array('H') of at least 8 entries
+        @return array('H') of 10 bit values indexed by channel (or by pair, CH0_POS_CH1_NEG first)
+        """
+        if differential:
+            return self.read_many(MCP3008.DIFFERENTIAL, out)
+        return self.read_many(MCP3008.SINGLE_ENDED, out)
+
+    def bus_select(self):
+        """
+        gets the SPI bus this chip is on
+        """
+        return self._bus_select
+
+    def chip_select(self):
+        """
+        gets the chip select this chip is on
+        """
+        return self._chip_select
+
+    def start_acquisition(self, channels, rate_hz, capacity=1024, spin=True):
+        """
+        starts sampling channels at rate_hz on a dedicated thread
+
+        @param channels a sequence of MCP3008.CHx or MCP3008.CHx_POS_CHy_NEG values read every tick
+        @param rate_hz the target number of frames per second
+        @param capacity the number of frames the ring buffer holds
+        @param spin busy-wait the end of each tick for lower jitter, see ADCAcquisition
+        @return the running ADCAcquisition
+        """
+        acquisition = ADCAcquisition(self, channels, rate_hz, capacity, spin)
+        acquisition.start()
+        return acquisition
 
     def __del__(self):
-        self._spi.close()
+        if self._owns_spi:
+            self._spi.close()
+
+
+def _view(arr, start, stop):
+    """
+    a zero-copy view of arr[start:stop]
+    """
+    try:
+        return memoryview(arr)[start:stop]
+    except TypeError:
+        # python 2 arrays only have the old buffer interface
+        return buffer(arr, start * arr.itemsize, (stop - start) * arr.itemsize)
+
+
+class ADCAcquisition(object):
+    """
+        Samples a set of MCP3008 channels at a fixed rate on its own thread
+        into a preallocated, timestamped ring buffer. Nothing is allocated
+        per sample; when the consumer falls behind new frames are dropped
+        and counted as overruns rather than overwriting unread ones.
+        Ticks are scheduled on the monotonic clock, timestamps are wall
+        clock seconds. If a read fails the thread stops and the exception
+        is raised by read_block() once the frames before it are consumed.
+
+        By default each tick is waited for with Delay.sleep_until(), which
+        busy-waits the last Delay.spin_threshold_ns() before it. That keeps
+        the jitter in the tens of microseconds, but once the period is
+        near the threshold (around 1kHz and up) the thread keeps a CPU core
+        busy. spin=False sleeps the whole wait instead, for a few percent
+        CPU at the cost of the scheduler's wakeup latency in jitter.
+
+        Examples
+        @code
+            acq = adc.start_acquisition([MCP3008.CH0, MCP3008.CH1], 1000)
+            timestamps, samples, count = acq.read_block()
+            ...  # samples holds count frames of 2 values each
+            acq.release(count)
+            acq.stop()
+        @endcode
+    """
+
+    def __init__(self, adc, channels, rate_hz, capacity=1024, spin=True):
+        """
+        @param adc the MCP3008 to sample
+        @param channels a sequence of MCP3008.CHx or MCP3008.CHx_POS_CHy_NEG values read every tick
+        @param rate_hz the target number of frames per second
+        @param capacity the number of frames the ring buffer holds
+        @param spin busy-wait the end of each tick for lower jitter, False sleeps the whole wait
+        """
+        if rate_hz <= 0:
+            raise ValueError("Rate must be greater than 0.")
+        self._adc = adc
+        self._channels = tuple(channels)
+        self._width = len(self._channels)
+        self._period = int(10**9 / rate_hz)  # nanoseconds
+        self._capacity = capacity
+        self._spin = spin
+        self._timestamps = array('d', [0.0]) * capacity
+        self._samples = array('H', [0]) * (capacity * self._width)
+        self._head = 0  # frames written, ever
+        self._tail = 0  # frames released, ever
+        self._overruns = 0
+        self._missed_ticks = 0
+        self._jitter_max = 0.0
+        self._jitter_sum = 0.0
+        self._ticks = 0
+        self._error = None  # the exception that stopped the sampling thread
+        self._running = False
+        self._thread = None
+        adc.read_many(self._channels)  # validates the channels and warms the command cache
+
+    def start(self):
+        """
+        starts the sampling thread
+        """
+        if self._running:
+            return
+        if self._thread is not None:
+            self._thread.join()  # stopped itself after an error
+        self._error = None
+        self._running = True
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        stops the sampling thread, unread frames stay readable
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        read_many = self._adc.read_many
+        channels = self._channels
+        width = self._width
+        period = self._period
+        spin = self._spin
+        # timestamps are wall clock, derived from the monotonic tick so a clock step does not upset the schedule
+        wall_base = time.time()
+        next_tick = mono_base = Delay.monotonic_ns()
+        while self._running:
+            if spin:
+                now = next_tick + Delay.sleep_until(next_tick)
+            else:
+                remaining = next_tick - Delay.monotonic_ns()
+                if remaining > 0:
+                    time.sleep(remaining * 10**-9)
+                now = max(next_tick, Delay.monotonic_ns())
+            jitter = (now - next_tick) * 10**-9
+            self._ticks += 1
+            self._jitter_sum += jitter
+            if jitter > self._jitter_max:
+                self._jitter_max = jitter
+
+            if self._head - self._tail >= self._capacity:
+                self._overruns += 1
+            else:
+                slot = self._head % self._capacity
+                self._timestamps[slot] = wall_base + (now - mono_base) * 10**-9
+                try:
+                    read_many(channels, self._samples, slot * width)
+                except Exception as e:
+                    self._error = e
+                    self._running = False
+                    return
+                self._head += 1
+
+            next_tick += period
+            if now - next_tick > period:
+                # fell more than a tick behind, skip ahead instead of bursting to catch up
+                missed = (now - next_tick) // period
+                self._missed_ticks += missed
+                next_tick += missed * period
 
+    def available(self):
+        """
+        gets the number of frames waiting to be read
+        """
+        return self._head - self._tail
+
+    def read_block(self, max_frames=None):
+        """
+        gets the oldest unread frames without copying them, they stay valid until release()
+        a block stops at the end of the ring, the next call picks up the rest
+
+        @param max_frames the most frames to return, None for all that are contiguous
+        @return (timestamps, samples, count), zero-copy views of count timestamps and count*len(channels) samples
+        @raise the exception that stopped the sampling thread, once no frames are left
+        """
+        count = self._head - self._tail
+        if count == 0 and self._error is not None:
+            raise self._error
+        slot = self._tail % self._capacity
+        count = min(count, self._capacity - slot)
+        if max_frames is not None:
+            count = min(count, max_frames)
+        return (_view(self._timestamps, slot, slot + count),
+                _view(self._samples, slot * self._width, (slot + count) * self._width),
+                count)
+
+    def release(self, count):
+        """
+        hands frames returned by read_block() back to the ring
+        @param count the number of frames consumed
+        """
+        self._tail += min(count, self._head - self._tail)
 
+    def stats(self):
+        """
+        gets the acquisition counters
+        @return a dict of frames, overruns, missed ticks, tick jitter (seconds) figures, whether the
+                thread is running and the exception that stopped it, if any
+        """
+        ticks = self._ticks
+        return dict(frames=self._head,
+                    running=self._running,
+                    error=self._error,
+                    overruns=self._overruns,
+                    missed_ticks=self._missed_ticks,
+                    jitter_max=self._jitter_max,
+                    jitter_mean=self._jitter_sum / ticks if ticks else 0.0)
 
 
+class MCP3008Array(object):
+    """
+        Reads several MCP3008s spread over SPI buses and chip selects as one
+        device. Each tick reads the same channels from every chip and merges
+        them into one timestamped frame. Chips sharing a bus are read in
+        round-robin order; with SCHEDULE_THREAD_PER_BUS each bus gets its own
+        worker so the buses convert in parallel and a tick takes about as
+        long as the busiest bus rather than the sum of all chips.
 
+        Examples
+        @code
+            chips = [MCP3008(0, 0), MCP3008(0, 1), MCP3008(1, 0)]
+            adcs = MCP3008Array(chips, schedule=MCP3008Array.SCHEDULE_THREAD_PER_BUS)
+            timestamp, values = adcs.read_frame()  # values[i*8 + ch] is channel ch of chips[i]
+            adcs.close()
+        @endcode
+    """
+
+    SCHEDULE_ROUND_ROBIN = 0
+    SCHEDULE_THREAD_PER_BUS = 1
+
+    def __init__(self, chips, channels=MCP3008.SINGLE_ENDED, schedule=SCHEDULE_ROUND_ROBIN):
+        """
+        @param chips a list of MCP3008 instances
+        @param channels the MCP3008.CHx or MCP3008.CHx_POS_CHy_NEG values read from every chip each tick
+        @param schedule MCP3008Array.SCHEDULE_ROUND_ROBIN or MCP3008Array.SCHEDULE_THREAD_PER_BUS
+        """
+        self._chips = list(chips)
+        self._channels = tuple(channels)
+        for channel_mode in self._channels:
+            if MCP3008._command(channel_mode) is None:
+                raise ValueError("Unknown channel selection %s" % (channel_mode))
+        self._width = len(self._channels)
+        self._schedule = schedule
+        self._latency_last = array('d', [0.0]) * len(self._chips)
+        self._latency_max = array('d', [0.0]) * len(self._chips)
+        self._latency_sum = array('d', [0.0]) * len(self._chips)
+        self._frames = 0
+
+        # chip indexes grouped by bus, in the order given
+        self._buses = list()
+        bus_index = dict()
+        for i, chip in enumerate(self._chips):
+            if chip.bus_select() not in bus_index:
+                bus_index[chip.bus_select()] = len(self._buses)
+                self._buses.append(list())
+            self._buses[bus_index[chip.bus_select()]].append(i)
+
+        self._workers = list()
+        if schedule == MCP3008Array.SCHEDULE_THREAD_PER_BUS:
+            self._cond = threading.Condition()
+            self._tick = 0
+            self._outstanding = 0
+            self._out = None
+            self._error = None  # the first exception a worker hit this tick, raised by read_frame()
+            self._running = True
+            for indexes in self._buses:
+                worker = threading.Thread(target=self._run_bus, args=(indexes,))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def _read_chips(self, indexes, out):
+        width = self._width
+        channels = self._channels
+        for i in indexes:
+            start = Delay.monotonic_ns()
+            self._chips[i].read_many(channels, out, i * width)
+            latency = (Delay.monotonic_ns() - start) * 10**-9
+            self._latency_last[i] = latency
+            self._latency_sum[i] += latency
+            if latency > self._latency_max[i]:
+                self._latency_max[i] = latency
+
+    def _run_bus(self, indexes):
+        seen = 0
+        while True:
+            with self._cond:
+                while self._running and self._tick == seen:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                seen = self._tick
+                out = self._out
+            error = None
+            try:
+                self._read_chips(indexes, out)
+            except Exception as e:
+                error = e
+            finally:
+                with self._cond:
+                    if error is not None and self._error is None:
+                        self._error = error
+                    self._outstanding -= 1
+                    if self._outstanding == 0:
+                        self._cond.notify_all()
+
+    def read_frame(self, out=None):
+        """
+        reads every channel of every chip
+        @param out an optional preallocated array('H') of at least len(chips) * len(channels)
+        @return (timestamp, values) where values[i * len(channels) + n] is channel n of chip i
+        @raise the exception a per bus worker hit reading its chips, such as an IOError from spidev
+        """
+        if out is None:
+            out = array('H', [0]) * (len(self._chips) * self._width)
+        timestamp = time.time()
+        if self._workers:
+            with self._cond:
+                self._out = out
+                self._outstanding = len(self._workers)
+                self._tick += 1
+                self._cond.notify_all()
+                while self._outstanding:
+                    self._cond.wait()
+                error, self._error = self._error, None
+            if error is not None:
+                raise error
+        else:
+            for indexes in self._buses:
+                self._read_chips(indexes, out)
+        self._frames += 1
+        return timestamp, out
+
+    def latency(self):
+        """
+        gets the per chip read latency in seconds
+        @return a list of dicts of last, max and mean latency, in the order the chips were given
+        """
+        frames = self._frames
+        return [dict(last=self._latency_last[i],
+                     max=self._latency_max[i],
+                     mean=self._latency_sum[i] / frames if frames else 0.0)
+                for i in range(len(self._chips))]
 
+    def close(self):
+        """
+        stops the per bus workers
+        """
+        if self._workers:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+            for worker in self._workers:
+                worker.join()
+            self._workers = list()
+
+
+class ADCPipeline(object):
+    """
+        Turns blocks of raw 10 bit MCP3008 readings into calibrated values,
+        vectorized over the whole block with NumPy. The stages run in order:
+        per channel gain/offset (in counts), conversion to volts against
+        VRef, an optional filter and decimation. Filter and decimation state
+        carries over between blocks so a stream can be fed in pieces.
+
+        Examples
+        @code
+            acq = adc.start_acquisition([MCP3008.CH0, MCP3008.CH1], 1000)
+            pipe = ADCPipeline(2, vref=3.3, filter_mode=ADCPipeline.FILTER_MEAN, window=8, decimation=10)
+            timestamps, samples, count = acq.read_block()
+            volts = pipe.process(samples)  # (count / 10) x 2 array
+            acq.release(count)
+        @endcode
+    """
+
+    FILTER_NONE = 0
+    FILTER_MEAN = 1
+    FILTER_MEDIAN = 2
+    FILTER_IIR = 3
+
+    FULL_SCALE = 1024.0  # code = 1024 * Vin / VRef
+
+    def __init__(self, num_channels, gain=None, offset=None, vref=None, filter_mode=FILTER_NONE, window=4, alpha=0.1, decimation=1):
+        """
+        @param num_channels the number of values per frame
+        @param gain a per channel multiplier (or one for all), applied to the raw counts
+        @param offset a per channel offset in counts (or one for all), added after the gain
+        @param vref the reference voltage, when given the output is in volts
+        @param filter_mode one of ADCPipeline.FILTER_*
+        @param window the moving average/median window in frames
+        @param alpha the single pole IIR coefficient in (0, 1], higher follows the input faster
+        @param decimation keep every Nth frame after filtering
+        """
+        if numpy is None:
+            raise ImportError("ADCPipeline needs numpy.")
+        if window < 1 or decimation < 1:
+            raise ValueError("Window and decimation must be at least 1.")
+        if filter_mode == ADCPipeline.FILTER_IIR and not 0 < alpha <= 1:
+            raise ValueError("Alpha must be in range (0, 1].")
+        self._width = num_channels
+        self._gain = numpy.ones(num_channels) if gain is None else numpy.asarray(gain, dtype=numpy.float64)
+        self._offset = numpy.zeros(num_channels) if offset is None else numpy.asarray(offset, dtype=numpy.float64)
+        self._scale = None if vref is None else vref / ADCPipeline.FULL_SCALE
+        self._filter = filter_mode
+        self._window = window
+        self._alpha = alpha
+        self._decimation = decimation
+        self.reset()
+
+    def reset(self):
+        """
+        drops the filter history and decimation phase
+        """
+        self._history = None  # last window-1 frames for the mean/median filters
+        self._iir_state = None
+        self._phase = 0
+
+    def _frames(self, block):
+        """
+        views block as an (n, num_channels) float array, a flat buffer of uint16 is reinterpreted without copying
+        """
+        if isinstance(block, numpy.ndarray):
+            raw = block
+        elif isinstance(block, array):
+            raw = numpy.frombuffer(block, dtype=numpy.uint16) if block.itemsize == 2 else numpy.asarray(block)
+        else:
+            raw = numpy.frombuffer(block, dtype=numpy.uint16)
+        return raw.reshape(-1, self._width).astype(numpy.float64)
+
+    def _with_history(self, x):
+        if self._history is None:
+            self._history = numpy.repeat(x[:1], self._window - 1, axis=0)
+        ext = numpy.concatenate((self._history, x))
+        self._history = ext[len(ext) - (self._window - 1):]
+        return ext
+
+    def _mean(self, x):
+        ext = self._with_history(x)
+        c = numpy.cumsum(numpy.concatenate((numpy.zeros((1, self._width)), ext)), axis=0)
+        return (c[self._window:] - c[:-self._window]) / self._window
+
+    def _median(self, x):
+        ext = self._with_history(x)
+        rows, cols = ext.strides
+        windows = numpy.lib.stride_tricks.as_strided(ext, shape=(len(x), self._window, self._width),
+                                                     strides=(rows, rows, cols), writeable=False)
+        return numpy.median(windows, axis=1)
+
+    def _iir(self, x):
+        # y[n] = y[n-1] + a(x[n] - y[n-1]) unrolled as
+        # y[n] = d^n (y[-1] + a * sum(x[k] / d^k)), d = 1 - a, evaluated in
+        # segments short enough that d^-n stays well inside float range
+        a = self._alpha
+        d = 1.0 - a
+        if self._iir_state is None:
+            self._iir_state = x[0].copy()
+        if d == 0.0:
+            self._iir_state = x[-1].copy()
+            return x.copy()
+        seg = max(1, int(150 / -numpy.log10(d)))
+        y = numpy.empty_like(x)
+        for start in range(0, len(x), seg):
+            chunk = x[start:start+seg]
+            powers = d ** numpy.arange(1, len(chunk) + 1)[:, None]
+            acc = numpy.cumsum(chunk / powers, axis=0)
+            y[start:start+len(chunk)] = powers * (self._iir_state + a * acc)
+            self._iir_state = y[start+len(chunk)-1].copy()
+        return y
+
+    def process(self, block):
+        """
+        runs a block through the pipeline
+
+        @param block raw readings, an (n, num_channels) array or a flat buffer/array('H') of n * num_channels values
+        @return a numpy float64 array of (frames kept, num_channels)
+        """
+        x = self._frames(block)
+        if len(x) == 0:
+            return x
+        x *= self._gain
+        x += self._offset
+        if self._scale is not None:
+            x *= self._scale
 
+        if self._filter == ADCPipeline.FILTER_MEAN:
+            x = self._mean(x)
+        elif self._filter == ADCPipeline.FILTER_MEDIAN:
+            x = self._median(x)
+        elif self._filter == ADCPipeline.FILTER_IIR:
+            x = self._iir(x)
 
+        if self._decimation > 1:
+            kept = x[self._phase::self._decimation]
+            self._phase = (self._phase - len(x)) % self._decimation
+            x = kept
+        return x
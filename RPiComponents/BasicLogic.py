@@ -8,7 +8,9 @@
     This module contains several basic logic control objects
     for reading or writing to a pin in a object-oriented style.
 """
+import threading
 import RPi.GPIO as gpio
+from utils import Delay
 
 
 class BasicToggleOutput(object):
@@ -24,18 +26,29 @@ class BasicToggleOutput(object):
         self._gpio = _gpio
         self._gpio.setmode(numbering)
         self._gpio.setup(self._pin, self._gpio.OUT)
+        self._level = None  # last level written, None until the first write
+        self._writes = 0
+        self._elided_writes = 0
+
+    def _write(self, level):
+        if level == self._level:
+            self._elided_writes += 1
+            return
+        self._gpio.output(self._pin, level)
+        self._level = level
+        self._writes += 1
 
     def high(self):
         """
-        sets the pin to the logic HIGH state
+        sets the pin to the logic HIGH state, skipped if it was last set HIGH
         """
-        self._gpio.output(self._pin, self._gpio.HIGH)
+        self._write(self._gpio.HIGH)
 
     def low(self):
         """
-        sets the pin to the logic LOW state
+        sets the pin to the logic LOW state, skipped if it was last set LOW
         """
-        self._gpio.output(self._pin, self._gpio.LOW)
+        self._write(self._gpio.LOW)
 
     def hi(self):
         """
@@ -51,11 +64,175 @@ class BasicToggleOutput(object):
 
     def value(self):
         """
-        gets the current value (hi/lo) of the pin
+        gets the current value (hi/lo) of the pin, from the last write if there was one
         @return a value T/F or 1/0 indicating the state of the pin
         """
+        if self._level is not None:
+            return self._level
         return self._gpio.input(self._pin)
 
+    def invalidate(self):
+        """
+        forgets the cached level, call it if something else drives the pin,
+        the next high()/low() is written and value() reads the pin
+        """
+        self._level = None
+
+    def elided_writes(self):
+        """
+        gets the number of high()/low() calls skipped as the pin was already at that level
+        """
+        return self._elided_writes
+
+    def stats(self):
+        """
+        gets the pin's output counters, with the same keys as PinBank.stats()
+        @return a dict of output_calls, pin_writes, elided_pins and elided_updates
+        """
+        return {
+            "output_calls": self._writes,
+            "pin_writes": self._writes,
+            "elided_pins": self._elided_writes,
+            "elided_updates": self._elided_writes,
+        }
+
+
+def output_stats(outputs):
+    """
+    adds up the stats() of several BasicToggleOutput or PinBank objects
+    @param outputs the output objects
+    @return a dict of the summed counters
+    """
+    totals = dict.fromkeys(("output_calls", "pin_writes", "elided_pins", "elided_updates"), 0)
+    for output in outputs:
+        for key, count in output.stats().items():
+            totals[key] += count
+    return totals
+
+
+class PinBank(object):
+    """
+        A group of output pins updated together. Each pin is one bit of a
+        mask, bit 0 being the first pin given, and write() sends only the
+        pins whose level changed, all in one list-form gpio.output() call.
+
+        Examples
+        @code
+            data = PinBank([4, 17, 27, 22])
+            data.write(0x5)  # 4 and 27 high, one output() call
+            data.set(0x2)  # 17 high too, only 17 is written
+            data.write(0x7)  # nothing changed, no call at all
+        @endcode
+    """
+
+    def __init__(self, pins, initial=0, numbering=gpio.BCM, _gpio=gpio):
+        """
+        PinBank constructor
+        @param pins the GPIO pin numbers, in bit order
+        @param initial the mask the pins are set up with
+        @param numbering the pin numbering system (RPi.GPIO.BOARD or RPi.GPIO.BCM)
+        @param _gpio the gpio object if using a different than the default
+        """
+        if not pins:
+            raise ValueError("A PinBank needs at least one pin.")
+        if len(set(pins)) != len(pins):
+            raise ValueError("Pins in a PinBank must be unique.")
+        self._pins = tuple(pins)
+        self._gpio = _gpio
+        self._gpio.setmode(numbering)
+        self._full_mask = (1 << len(self._pins)) - 1
+        self._state = initial & self._full_mask
+        self._list_output = True  # RPi.GPIO before 0.5.8 takes one channel per output() call
+        for i, pin in enumerate(self._pins):
+            self._gpio.setup(pin, self._gpio.OUT, initial=(self._state >> i) & 1)
+        self.reset_stats()
+
+    def pins(self):
+        """
+        @return the pin numbers, in bit order
+        """
+        return self._pins
+
+    def state(self):
+        """
+        @return the mask last written to the pins
+        """
+        return self._state
+
+    def write(self, mask, force=False):
+        """
+        sets every pin in the bank, pins already at their level are not written
+        @param mask the new levels, bit i for the i-th pin
+        @param force write every pin even if its cached level matches
+        """
+        mask &= self._full_mask
+        changed = self._full_mask if force else mask ^ self._state
+        self._state = mask
+        if not changed:
+            self._elided_updates += 1
+            self._elided_pins += len(self._pins)
+            return
+        channels = list()
+        values = list()
+        for i, pin in enumerate(self._pins):
+            if (changed >> i) & 1:
+                channels.append(pin)
+                values.append((mask >> i) & 1)
+        self._output(channels, values)
+        self._pin_writes += len(channels)
+        self._elided_pins += len(self._pins) - len(channels)
+
+    def set(self, mask):
+        """
+        drives the pins in mask HIGH, leaving the others as they are
+        @param mask the pins to set, bit i for the i-th pin
+        """
+        self.write(self._state | mask)
+
+    def clear(self, mask):
+        """
+        drives the pins in mask LOW, leaving the others as they are
+        @param mask the pins to clear, bit i for the i-th pin
+        """
+        self.write(self._state & ~mask)
+
+    def _output(self, channels, values):
+        if len(channels) > 1 and self._list_output:
+            try:
+                self._gpio.output(channels, values)
+                self._output_calls += 1
+                return
+            except (TypeError, ValueError):
+                self._list_output = False
+        for pin, value in zip(channels, values):
+            self._gpio.output(pin, value)
+            self._output_calls += 1
+
+    def reset_stats(self):
+        """
+        zeroes the counters stats() reports
+        """
+        self._output_calls = 0
+        self._pin_writes = 0
+        self._elided_pins = 0
+        self._elided_updates = 0
+
+    def stats(self):
+        """
+        gets the bank's output counters
+        @return a dict of output_calls (gpio.output() calls made), pin_writes (pins written),
+                elided_pins (pins skipped as unchanged) and elided_updates (writes that changed nothing)
+        """
+        return {
+            "output_calls": self._output_calls,
+            "pin_writes": self._pin_writes,
+            "elided_pins": self._elided_pins,
+            "elided_updates": self._elided_updates,
+        }
+
+
+OutputGroup = PinBank
+
 
 class BasicSoftPWM(object):
 
@@ -159,6 +336,8 @@ class BasicToggleInputOutput(object):
         self._gpio = _gpio
         self._gpio.setmode(numbering)
         self._pud = pud
+        self._level = None  # last level written while an output, None when unknown
+        self._elided_writes = 0
         if mode == BasicToggleInputOutput.MODE_IN:
             self.set_input()
         else:
@@ -169,24 +348,33 @@ class BasicToggleInputOutput(object):
 
     def set_output(self):
         self._gpio.setup(self._pin, self._gpio.OUT)
+        self._level = None
 
     def set_input(self):
+        self._level = None
         if self._pud:
                 self._gpio.setup(self._pin, self._gpio.IN, pull_up_down=self._pud)  # using internal pud resistor
         else:
                 self._gpio.setup(self._pin, self._gpio.IN)  # external pud
 
+    def _write(self, level):
+        if level == self._level:
+            self._elided_writes += 1
+            return
+        self._gpio.output(self._pin, level)
+        self._level = level
+
     def high(self):
         """
-        sets the pin to the logic HIGH state
+        sets the pin to the logic HIGH state, skipped if it was last set HIGH
         """
-        self._gpio.output(self._pin, self._gpio.HIGH)
+        self._write(self._gpio.HIGH)
 
     def low(self):
         """
-        sets the pin to the logic LOW state
+        sets the pin to the logic LOW state, skipped if it was last set LOW
         """
-        self._gpio.output(self._pin, self._gpio.LOW)
+        self._write(self._gpio.LOW)
 
     def hi(self):
         """
@@ -202,34 +390,240 @@ class BasicToggleInputOutput(object):
 
     def value(self):
         """
-        gets the current value (hi/lo) of the pin
+        gets the current value (hi/lo) of the pin, from the last write while it is an output
         @return a value T/F or 1/0 indicating the state of the pin
         """
+        if self._level is not None:
+            return self._level
         return self._gpio.input(self._pin)
 
+    def elided_writes(self):
+        """
+        gets the number of high()/low() calls skipped as the pin was already at that level
+        """
+        return self._elided_writes
+
 
 class ToggleInputCallback(BasicToggleInput):
+    """
+        Runs a callback on the edges of an input pin.
+
+        By default callback(pin) runs on the RPi.GPIO callback thread, one
+        edge at a time, and RPi.GPIO's bouncetime does the debounce. With
+        queue_size set the GPIO thread only timestamps each edge into a
+        preallocated ring, and dispatcher threads hand them on in batches as
+        callback(pin, events), events being a list of (timestamp_ns, level)
+        in the order they happened (with one worker). The debounce is then
+        done against those timestamps, and a slow callback backs up the ring
+        rather than losing edges.
+
+        Examples
+        @code
+            def on_edges(pin, events):
+                for timestamp_ns, level in events:
+                    log(pin, timestamp_ns, level)
+
+            switch = ToggleInputCallback(6, on_edges, edge=gpio.BOTH, queue_size=256)
+            switch.stats()  # {'captured': 12, 'dropped': 3, 'overruns': 0, ...}
+        @endcode
+    """
 
     DEBOUNCE_DELAY_MS = 2
     INST_COUNT = 0
+    BATCH_SIZE = 32
 
-    def __init__(self, pin, callback=None, debounce_delay=DEBOUNCE_DELAY_MS, edge=gpio.RISING, pud=None, numbering=gpio.BCM, _gpio=gpio):
+    def __init__(self, pin, callback=None, debounce_delay=DEBOUNCE_DELAY_MS, edge=gpio.RISING, pud=None, numbering=gpio.BCM, _gpio=gpio,
+                 queue_size=0, batch_size=BATCH_SIZE, workers=1):
         """
         ThreadedCallbackSwitch constructor
         @param pin the GPIO pin number to be used
         @param callback the callback to be fired when the switch is activated
         @param callback_args the arguments to be passed to the callback
+        @param debounce_delay milliseconds edges are ignored for after one fires, 0 for none
         @param edge RISING, FALLING, or BOTH
         @param numbering the pin numbering system (RPi.GPIO.BOARD or RPi.GPIO.BCM)
         @param _gpio the gpio object if using a different than the default
+        @param queue_size the number of edges the ring holds, 0 calls the callback directly on the GPIO thread
+        @param batch_size the most edges handed to one callback(pin, events) call
+        @param workers the number of dispatcher threads, events stay in order only with one
         """
-        BasicToggleInput.__init__(self, pin, pud=pud, numbering=numbering, _gpio=gpio)
+        BasicToggleInput.__init__(self, pin, pud=pud, numbering=numbering, _gpio=_gpio)
         self._callback = callback
-        if callback is None:
-            self._callback = self.default_callback
         self._inst_id = ToggleInputCallback.INST_COUNT+1
         ToggleInputCallback.INST_COUNT += 1
-        self._gpio.add_event_detect(self._pin, edge, self._callback, debounce_delay)
+        self._queue_size = queue_size
+        self._dispatchers = list()
+        if not queue_size:
+            if callback is None:
+                self._callback = self.default_callback
+            if debounce_delay:
+                self._gpio.add_event_detect(self._pin, edge, self._callback, debounce_delay)
+            else:
+                self._gpio.add_event_detect(self._pin, edge, self._callback)  # RPi.GPIO rejects a bouncetime of 0
+            return
+
+        if queue_size < 0 or batch_size < 1 or workers < 1:
+            raise ValueError("queue_size, batch_size and workers must be positive.")
+        if callback is None:
+            self._callback = self.default_events_callback
+        self._edge = edge
+        self._debounce_ns = int(debounce_delay * 10**6)
+        self._batch_size = batch_size
+        self._timestamps = [0] * queue_size
+        self._levels = [0] * queue_size
+        self._head = 0  # edges written, ever
+        self._tail = 0  # edges taken by a dispatcher, ever
+        self._in_flight = 0  # batches being run by a callback
+        self._last_edge = None  # timestamp of the last edge accepted
+        self._cond = threading.Condition()
+        self._closing = False
+        self.reset_stats()
+        for i in range(workers):
+            dispatcher = threading.Thread(target=self._dispatch)
+            dispatcher.daemon = True
+            dispatcher.start()
+            self._dispatchers.append(dispatcher)
+        self._gpio.add_event_detect(self._pin, edge, self._capture)  # no bouncetime, the debounce is done in _capture
+
+    def _capture(self, pin):
+        timestamp = Delay.monotonic_ns()
+        if self._edge == self._gpio.RISING:
+            level = 1
+        elif self._edge == self._gpio.FALLING:
+            level = 0
+        else:
+            level = 1 if self._gpio.input(pin) else 0
+        with self._cond:
+            if self._last_edge is not None and timestamp - self._last_edge < self._debounce_ns:
+                self._dropped += 1
+                return
+            self._last_edge = timestamp
+            if self._head - self._tail >= self._queue_size:
+                self._overruns += 1
+                return
+            slot = self._head % self._queue_size
+            self._timestamps[slot] = timestamp
+            self._levels[slot] = level
+            self._head += 1
+            self._captured += 1
+            if self._head - self._tail > self._high_water:
+                self._high_water = self._head - self._tail
+            self._cond.notify()
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while self._head == self._tail and not self._closing:
+                    self._cond.wait()
+                if self._head == self._tail:
+                    return
+                events = list()
+                while self._tail < self._head and len(events) < self._batch_size:
+                    slot = self._tail % self._queue_size
+                    events.append((self._timestamps[slot], self._levels[slot]))
+                    self._tail += 1
+                self._in_flight += 1
+
+            latency = Delay.monotonic_ns() - events[0][0]
+            error = False
+            try:
+                self._callback(self._pin, events)
+            except Exception:
+                error = True
+
+            with self._cond:
+                self._in_flight -= 1
+                self._batches += 1
+                self._dispatched += len(events)
+                if error:
+                    self._callback_errors += 1
+                if latency > self._max_latency:
+                    self._max_latency = latency
+                self._cond.notify_all()
+
+    def pending(self):
+        """
+        gets the number of edges waiting in the ring
+        """
+        if not self._queue_size:
+            return 0
+        with self._cond:
+            return self._head - self._tail
+
+    def wait_idle(self, timeout=None):
+        """
+        waits until every captured edge has been through the callback
+        @param timeout seconds to wait for, None for no limit
+        @return True if idle, False on timeout
+        """
+        if not self._queue_size:
+            return True
+        deadline = None if timeout is None else Delay.monotonic_ns() + int(timeout * 10**9)
+        with self._cond:
+            while self._head != self._tail or self._in_flight:
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = (deadline - Delay.monotonic_ns()) * 10**-9
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            return True
+
+    def reset_stats(self):
+        """
+        zeroes the counters stats() reports, queue mode only
+        """
+        if not self._queue_size:
+            return
+        with self._cond:
+            self._captured = 0
+            self._dropped = 0
+            self._overruns = 0
+            self._dispatched = 0
+            self._batches = 0
+            self._callback_errors = 0
+            self._high_water = self._head - self._tail
+            self._max_latency = 0
+
+    def stats(self):
+        """
+        gets the event queue counters, empty without queue_size
+        @return a dict of captured (edges queued), dropped (edges inside the debounce window),
+                overruns (edges lost to a full ring), dispatched, batches, callback_errors,
+                high_water (most edges waiting at once) and max_latency_us (edge to its callback)
+        """
+        if not self._queue_size:
+            return dict()
+        with self._cond:
+            return {
+                "captured": self._captured,
+                "dropped": self._dropped,
+                "overruns": self._overruns,
+                "dispatched": self._dispatched,
+                "batches": self._batches,
+                "callback_errors": self._callback_errors,
+                "high_water": self._high_water,
+                "max_latency_us": self._max_latency // 1000,
+            }
+
+    def close(self):
+        """
+        stops edge detection, the dispatchers finish the queued edges and exit
+        """
+        self._gpio.remove_event_detect(self._pin)
+        if not self._queue_size:
+            return
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        for dispatcher in self._dispatchers:
+            if dispatcher is not threading.current_thread():
+                dispatcher.join()
+        self._dispatchers = list()
 
     def default_callback(self, pin):
-        print "Callback happened on ToggleInputCallback instance # %d @ pin %d" % (self._inst_id, pin)
\ No newline at end of file
+        print "Callback happened on ToggleInputCallback instance # %d @ pin %d" % (self._inst_id, pin)
+
+    def default_events_callback(self, pin, events):
+        print "%d edges on ToggleInputCallback instance # %d @ pin %d" % (len(events), self._inst_id, pin)
@@ -10,6 +10,74 @@
 """
 import smbus
 import time
+import os
+import fcntl
+import mmap
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+try:
+    from smbus2 import i2c_msg  # optional, allows full page transactions
+except ImportError:
+    i2c_msg = None
+
+
+class RawI2C(object):
+    """
+        Plain read() and write() on /dev/i2c-N after selecting the device
+        with the I2C_SLAVE ioctl. Each call is one I2C transaction of any
+        length, so a whole page goes out at once without the 32 byte SMBus
+        block limit. BasicEEPROM uses it when smbus2 is not installed.
+    """
+    I2C_SLAVE = 0x0703  # from <linux/i2c-dev.h>
+
+    def __init__(self, i2c_bus_num):
+        """
+        @param i2c_bus_num: the I2C bus number, corresponds to /dev/i2c-X
+        """
+        self._fd = None
+        self._addr = None
+        self._fd = os.open("/dev/i2c-%d" % (i2c_bus_num), os.O_RDWR)
+
+    def _select(self, addr):
+        if addr != self._addr:
+            fcntl.ioctl(self._fd, RawI2C.I2C_SLAVE, addr)
+            self._addr = addr
+
+    def write_raw(self, addr, data):
+        """
+        one write transaction
+        @param addr: the I2C address of the device
+        @param data: a list of bytes or a bytearray
+        """
+        try:
+            self._select(addr)
+            os.write(self._fd, bytes(bytearray(data)))
+        except OSError as e:
+            raise IOError(e.errno, e.strerror)  # smbus reports bus errors as IOError
+
+    def read_raw(self, addr, length):
+        """
+        one read transaction
+        @param addr: the I2C address of the device
+        @param length: the number of bytes to read
+        @return: a bytearray
+        """
+        try:
+            self._select(addr)
+            return bytearray(os.read(self._fd, length))
+        except OSError as e:
+            raise IOError(e.errno, e.strerror)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
 
 
 class BasicEEPROM(object):
@@ -18,21 +86,86 @@ class BasicEEPROM(object):
                             these typically have a selectable range of [0, 32768]
         ADDRESS_MODE_8BIT: the EEPROM storage address mode for devices that support 8 bits of storage selection
                             these typically have a selectable range of [0, 16383]
+
+        VARIANTS holds (capacity in bytes, page size in bytes, address mode) for the
+        common parts of the 24CXX family, for use with BasicEEPROM.from_variant()
     """
     ADDRESS_MODE_16BIT = 0
     ADDRESS_MODE_8BIT = 1
 
-    def __init__(self, base_address, address_mode, i2c_bus_num):
+    VARIANTS = dict()
+    VARIANTS["24C01"] = (128, 8, ADDRESS_MODE_8BIT)
+    VARIANTS["24C02"] = (256, 8, ADDRESS_MODE_8BIT)
+    VARIANTS["24C04"] = (512, 16, ADDRESS_MODE_8BIT)
+    VARIANTS["24C08"] = (1024, 16, ADDRESS_MODE_8BIT)
+    VARIANTS["24C16"] = (2048, 16, ADDRESS_MODE_8BIT)
+    VARIANTS["24C32"] = (4096, 32, ADDRESS_MODE_16BIT)
+    VARIANTS["24C64"] = (8192, 32, ADDRESS_MODE_16BIT)
+    VARIANTS["24C128"] = (16384, 64, ADDRESS_MODE_16BIT)
+    VARIANTS["24C256"] = (32768, 64, ADDRESS_MODE_16BIT)
+    VARIANTS["24C512"] = (65536, 128, ADDRESS_MODE_16BIT)
+
+    DEFAULT_PAGE_SIZE = 8  # the smallest page in the family, safe for every part
+    I2C_BLOCK_MAX = 32  # SMBus block transfers are limited to 32 bytes including the address
+    WRITE_CYCLE_TIMEOUT_MS = 25  # datasheets give 5-10ms max, leave some slack
+    RDWR_READ_CHUNK = 256  # bytes per read transaction when smbus2 or the raw device is available
+
+    def __init__(self, base_address, address_mode, i2c_bus_num, page_size=DEFAULT_PAGE_SIZE, capacity=None, _bus=None):
         """
 
         @param base_address:  the base address of the I2C device for which your using (usually 0x50)
         @param address_mode:  either BasicEEPROM.ADDRESS_MODE_16BIT or BasicEEPROM.ADDRESS_MODE_8BIT
         @param i2c_bus_num:   the I2C bus number you're using. corresponds to /dev/i2c-X X is the number you'd use
+        @param page_size:     the page write buffer size of the part, see BasicEEPROM.VARIANTS
+        @param capacity:      the storage size in bytes, if known
+        @param _bus:          the smbus object if using a different than the default
         """
         self._bus_num = i2c_bus_num
         self._base_addr = base_address
         self._addr_mode = address_mode
-        self._bus = smbus.SMBus(self._bus_num)
+        self._page_size = page_size
+        self._capacity = capacity
+        self._bus = _bus
+        if self._bus is None:
+            self._bus = smbus.SMBus(self._bus_num)
+        self._use_rdwr = i2c_msg is not None and hasattr(self._bus, "i2c_rdwr")
+        self._raw = None  # plain transactions of any length, for when smbus2 is not installed
+        if not self._use_rdwr:
+            if hasattr(self._bus, "write_raw"):
+                self._raw = self._bus  # a bus with its own, like sim.i2c.SMBus
+            elif _bus is None:
+                try:
+                    self._raw = RawI2C(self._bus_num)
+                except (OSError, IOError):
+                    pass  # fall back to SMBus block transfers
+        self._lock = threading.RLock()  # keeps multi step transactions whole when shared between threads
+
+    @classmethod
+    def from_variant(cls, variant, base_address, i2c_bus_num, _bus=None):
+        """
+        build an EEPROM control for one of the parts listed in BasicEEPROM.VARIANTS
+        @param variant: the part name i.e. "24C256"
+        @param base_address: the base address of the I2C device (usually 0x50)
+        @param i2c_bus_num: the I2C bus number you're using
+        @param _bus: the smbus object if using a different than the default
+        @return: a BasicEEPROM configured for the part
+        """
+        if variant not in cls.VARIANTS:
+            raise ValueError("Unknown 24CXX variant %s." % (variant))
+        capacity, page_size, address_mode = cls.VARIANTS[variant]
+        return cls(base_address, address_mode, i2c_bus_num, page_size=page_size, capacity=capacity, _bus=_bus)
+
+    def page_size(self):
+        """
+        gets the page write buffer size
+        """
+        return self._page_size
+
+    def capacity(self):
+        """
+        gets the storage size in bytes, None if it was not given
+        """
+        return self._capacity
 
     @staticmethod
     def usleep(us):
@@ -42,44 +175,166 @@ class BasicEEPROM(object):
         """
         time.sleep(us * 10**(-6))
 
-    def _write_one_byte(self, byte):
+    def _device_address(self, addr):
+        """
+        8 bit parts larger than 256 bytes use the low device address bits as a block select
+        """
+        if self._addr_mode == BasicEEPROM.ADDRESS_MODE_8BIT:
+            return self._base_addr | ((addr >> 8) & 0x07)
+        return self._base_addr
 
-        result = self._bus.write_byte(self._base_addr, byte)
+    def _write_one_byte(self, byte, dev_addr=None):
+        if dev_addr is None:
+            dev_addr = self._base_addr
+        result = self._bus.write_byte(dev_addr, byte)
         if result is not None and result < 0:
             print "BasicEEPROM error in _write_one_byte()"
-        BasicEEPROM.usleep(10000)
         return result
 
-    def _write_three_bytes(self, bytes_lst):
-        result = self._bus.write_word_data(self._base_addr, bytes_lst[0], (bytes_lst[2] << 8) | bytes_lst[1])
+    def _write_three_bytes(self, bytes_lst, dev_addr=None):
+        if dev_addr is None:
+            dev_addr = self._base_addr
+        result = self._bus.write_word_data(dev_addr, bytes_lst[0], (bytes_lst[2] << 8) | bytes_lst[1])
         if result is not None and result < 0:
             print "BasicEEPROM error in _write_three_bytes()"
-        BasicEEPROM.usleep(10000)
         return result
 
-    def _write_two_bytes(self, bytes_lst):
-        result = self._bus.write_byte_data(self._base_addr, bytes_lst[0], bytes_lst[1])
+    def _write_two_bytes(self, bytes_lst, dev_addr=None):
+        if dev_addr is None:
+            dev_addr = self._base_addr
+        result = self._bus.write_byte_data(dev_addr, bytes_lst[0], bytes_lst[1])
         if result is not None and result < 0:
             print "BasicEEPROM error in _write_two_bytes()"
-        BasicEEPROM.usleep(10000)
         return result
 
+    def _wait_write_cycle(self, dev_addr):
+        """
+        ACK polling, the part will not acknowledge its address until
+        the internal write cycle has finished
+        @param dev_addr: the I2C address the write went to
+        @return: True when the part is ready, False on timeout
+        """
+        deadline = time.time() + BasicEEPROM.WRITE_CYCLE_TIMEOUT_MS * 10**(-3)
+        while True:
+            try:
+                self._bus.read_byte(dev_addr)
+                return True
+            except IOError:
+                if time.time() > deadline:
+                    print "BasicEEPROM error in _wait_write_cycle()"
+                    return False
+
+    def _max_block(self):
+        """
+        the largest number of data bytes that fits in one write transaction
+        """
+        if self._use_rdwr or self._raw is not None:
+            return self._page_size
+        if self._addr_mode == BasicEEPROM.ADDRESS_MODE_16BIT:
+            return min(self._page_size, BasicEEPROM.I2C_BLOCK_MAX - 1)
+        return min(self._page_size, BasicEEPROM.I2C_BLOCK_MAX)
+
+    def _write_block(self, addr, data):
+        """
+        write data starting at addr in a single transaction, data must not cross a page boundary
+        @param addr: the EEPROM storage address
+        @param data: a bytearray of at most _max_block() bytes
+        """
+        with self._lock:
+            dev_addr = self._device_address(addr)
+            if self._addr_mode == BasicEEPROM.ADDRESS_MODE_8BIT:
+                addr_lst = [addr & 0x0ff]
+            else:
+                addr_lst = [(addr >> 8) & 0x0ff, addr & 0x0ff]
+
+            if self._use_rdwr:
+                result = self._bus.i2c_rdwr(i2c_msg.write(dev_addr, addr_lst + list(data)))
+            elif self._raw is not None:
+                result = self._raw.write_raw(dev_addr, addr_lst + list(data))
+            else:
+                result = self._bus.write_i2c_block_data(dev_addr, addr_lst[0], addr_lst[1:] + list(data))
+            if result is not None and result < 0:
+                print "BasicEEPROM error in _write_block()"
+            self._wait_write_cycle(dev_addr)
+            return result
+
     def write_byte(self, addr, byte):
         """
         write one byte to the EEPROM at the specified address
         @param addr: the EEPROM storage address
         @param byte: the byte value
         """
+        with self._lock:
+            result = 0
+            dev_addr = self._device_address(addr)
+            if self._addr_mode == BasicEEPROM.ADDRESS_MODE_8BIT:
+                bytes_lst =[addr & 0x0ff, byte]
+                result = self._write_two_bytes(bytes_lst, dev_addr)
+            elif self._addr_mode == BasicEEPROM.ADDRESS_MODE_16BIT:
+                bytes_lst = [(addr >> 8) & 0x0ff, addr & 0x0ff, byte]
+                result = self._write_three_bytes(bytes_lst, dev_addr)
+            if result is not None and result < 0:
+                print "BasicEEPROM error in write_byte()"
+            self._wait_write_cycle(dev_addr)
+            return result
+
+    def _set_address(self, addr):
+        """
+        dummy write that loads the part's address pointer without starting a write cycle
+        @param addr: the EEPROM storage address
+        @return: the I2C address of the part holding addr
+        """
         result = 0
+        dev_addr = self._device_address(addr)
         if self._addr_mode == BasicEEPROM.ADDRESS_MODE_8BIT:
-            bytes_lst =[addr & 0x0ff, byte]
-            result = self._write_two_bytes(bytes_lst)
+            result = self._write_one_byte(addr & 0xff, dev_addr)
         elif self._addr_mode == BasicEEPROM.ADDRESS_MODE_16BIT:
-            bytes_lst = [(addr >> 8) & 0x0ff, addr & 0x0ff, byte]
-            result = self._write_three_bytes(bytes_lst)
+            addr_lst = [(addr >> 8) & 0x0ff, addr & 0x0ff]
+            result = self._write_two_bytes(addr_lst, dev_addr)
         if result is not None and result < 0:
-            print "BasicEEPROM error in write_byte()"
-        return result
+            print "BasicEEPROM error in _set_address()"
+        return dev_addr
+
+    def _max_read_chunk(self):
+        """
+        the largest number of bytes fetched by one _read_block() call
+        """
+        if self._use_rdwr or self._raw is not None:
+            return BasicEEPROM.RDWR_READ_CHUNK
+        return BasicEEPROM.I2C_BLOCK_MAX
+
+    def _read_block(self, addr, length):
+        """
+        sequential read of length bytes starting at addr, setting the address pointer once
+        @param addr: the EEPROM storage address
+        @param length: at most _max_read_chunk() bytes, not crossing a 256 byte block on 8 bit parts
+        @return: a bytearray
+        """
+        with self._lock:
+            dev_addr = self._device_address(addr)
+            if self._addr_mode == BasicEEPROM.ADDRESS_MODE_8BIT:
+                addr_lst = [addr & 0x0ff]
+            else:
+                addr_lst = [(addr >> 8) & 0x0ff, addr & 0x0ff]
+            if self._use_rdwr:
+                read = i2c_msg.read(dev_addr, length)
+                self._bus.i2c_rdwr(i2c_msg.write(dev_addr, addr_lst), read)
+                return bytearray(list(read))
+            if self._raw is not None:
+                # the address write and the sequential read are separate transactions,
+                # the part keeps its pointer across the stop in between
+                self._raw.write_raw(dev_addr, addr_lst)
+                return self._raw.read_raw(dev_addr, length)
+            if self._addr_mode == BasicEEPROM.ADDRESS_MODE_8BIT:
+                return bytearray(self._bus.read_i2c_block_data(dev_addr, addr & 0x0ff, length))
+
+            # SMBus has no block read taking a two byte address, so set the
+            # pointer once and let the part auto-increment on current address reads
+            self._set_address(addr)
+            data = bytearray(length)
+            for i in range(length):
+                data[i] = self._bus.read_byte(dev_addr)
+            return data
 
     def read_byte(self, addr):
         """
@@ -87,56 +342,88 @@ class BasicEEPROM(object):
         @param addr: the EEPROM storage address to read from
         @return: the value at the specified EEPROM storage address
         """
-        result = 0
-        if self._addr_mode == BasicEEPROM.ADDRESS_MODE_8BIT:
-            addr &= 0xff
-            result = self._write_one_byte(addr)
-        elif self._addr_mode == BasicEEPROM.ADDRESS_MODE_16BIT:
-            addr_lst = [(addr >> 8) & 0x0ff, addr & 0x0ff]
-            result = self._write_two_bytes(addr_lst)
-        if result is not None and result < 0:
-            print "BasicEEPROM error in read_byte()"
-
-        BasicEEPROM.usleep(10)
-        byte = self._bus.read_byte(self._base_addr)
-        return byte
+        with self._lock:
+            dev_addr = self._set_address(addr)
+            byte = self._bus.read_byte(dev_addr)
+            return byte
 
-    def write_bytes(self, addr_start, bytes_lst):
+    def write_bytes(self, addr_start, bytes_lst, diff=False):
         """
         write N bytes to the EEPROM storage starting at addr_start
+        the buffer is split on page boundaries and each piece is sent
+        as one block transaction
         @param addr_start: the starting address
-        @param bytes_lst: a list() of bytes to be written
+        @param bytes_lst: a list() of bytes, a str or a bytearray to be written
+        @param diff: read the range back first and only write the parts of pages that differ
+        @return: the number of bytes actually written
         """
-        for i in range(len(bytes_lst)):
-            result = self.write_byte(addr_start+i, bytes_lst[i])
-            if result is not None and result < 0:
-                print "BasicEEPROM error in write_bytes()"
+        data = bytearray(bytes_lst)
+        current = None
+        if diff:
+            current = self.read_bytes(addr_start, len(data))
+        max_block = self._max_block()
+        written = 0
+        offset = 0
+        while offset < len(data):
+            addr = addr_start + offset
+            page_end = min(len(data), offset + self._page_size - (addr % self._page_size))
+            lo, hi = offset, page_end
+            if current is not None:
+                while lo < hi and data[lo] == current[lo]:
+                    lo += 1
+                while hi > lo and data[hi-1] == current[hi-1]:
+                    hi -= 1
+            while lo < hi:
+                length = min(hi - lo, max_block)
+                result = self._write_block(addr_start + lo, data[lo:lo+length])
+                if result is not None and result < 0:
+                    print "BasicEEPROM error in write_bytes()"
+                written += length
+                lo += length
+            offset = page_end
+        return written
+
+    def stream_bytes(self, addr_start, length, chunk_size=None):
+        """
+        generator reading length bytes from the EEPROM storage starting with addr_start
+        in sequential chunks, so large dumps are held in bounded memory
+        @param addr_start: the starting address to begin reading
+        @param length: the length of bytes to read
+        @param chunk_size: the most bytes yielded at a time, defaults to the largest bus transfer
+        @return: yields bytearray chunks
+        """
+        max_chunk = self._max_read_chunk()
+        if chunk_size is None or chunk_size > max_chunk:
+            chunk_size = max_chunk
+        offset = 0
+        while offset < length:
+            addr = addr_start + offset
+            n = min(length - offset, chunk_size)
+            if self._addr_mode == BasicEEPROM.ADDRESS_MODE_8BIT:
+                n = min(n, 0x100 - (addr & 0xff))  # the block select lives in the device address
+            yield self._read_block(addr, n)
+            offset += n
 
     def read_bytes(self, addr_start, length):
         """
         read lenght bytes from the EEPROM storage starting with addr_start
         @param addr_start: the starting address to begin reading
         @param length: the length of bytes to read
-        @return: a list of read bytes
+        @return: a bytearray of read bytes
         """
-        bytes_lst = list()
-
-        for i in range(length):
-            bytes_lst.append(self.read_byte(addr_start+i))
-
-        return bytes_lst
+        data = bytearray()
+        for chunk in self.stream_bytes(addr_start, length):
+            data += chunk
+        return data
 
-    def write_string(self, addr_start, string):
+    def write_string(self, addr_start, string, diff=False):
         """
         write an ASCII string to the EEPROM storage starting with addr_start
         @param addr_start: the starting address
         @param string:  the string to write
+        @param diff: only write the pages that differ, see write_bytes()
         """
-        def to_byte(c):
-            c = ord(c)
-            return int(c)
-        bytes_lst = map(to_byte, string)
-        return self.write_bytes(addr_start, bytes_lst)
+        return self.write_bytes(addr_start, bytearray(string), diff=diff)
 
     def read_string(self, addr_start, length):
         """
@@ -145,17 +432,629 @@ class BasicEEPROM(object):
         @param length: the number of bytes to read
         @return: a string
         """
-        bytes_lst = self.read_bytes(addr_start, length)
-        char_lst = map(chr, bytes_lst)
-        return "".join(char_lst)
+        return str(self.read_bytes(addr_start, length))
 
-    def fill_space(self, addr_begin, addr_end, fill_content=0):
+    def fill_space(self, addr_begin, addr_end, fill_content=0, diff=False):
         """
-        fill the space between addr_begin and addr_end with fill_content
+        fill the space between addr_begin and addr_end with fill_content, a page at a time
         @param addr_begin: the starting address
         @param addr_end:  the ending address
         @param fill_content: the fill byte value
+        @param diff: only write the pages that do not already hold fill_content
         """
-        for i in range(addr_begin, addr_end):
-            self.write_byte(i, fill_content)
+        return self.write_bytes(addr_begin, bytearray([fill_content]) * (addr_end - addr_begin), diff=diff)
+
+
+class CachedEEPROM(object):
+    """
+        A write-back page cache in front of a BasicEEPROM. Page sized blocks
+        are held in LRU order, writes only touch the cache and dirty pages
+        are written back (just the changed span, as one page write) on
+        flush() or when they are evicted.
 
+        Examples
+        @code
+            eeprom = BasicEEPROM.from_variant("24C256", 0x50, 1)
+            cache = CachedEEPROM(eeprom, max_pages=8)
+            cache.write_byte(0x10, 42)  # no bus traffic beyond loading the page
+            cache.read_byte(0x10)  # served from the cache
+            cache.flush()  # one page write
+        @endcode
+    """
+
+    def __init__(self, eeprom, max_pages=16):
+        """
+        @param eeprom: the BasicEEPROM to cache
+        @param max_pages: the number of pages held before the least recently used is evicted
+        """
+        if max_pages < 1:
+            raise ValueError("max_pages must be at least 1.")
+        self._eeprom = eeprom
+        self._page_size = eeprom.page_size()
+        self._max_pages = max_pages
+        self._pages = OrderedDict()  # page number -> [data, dirty_lo, dirty_hi]
+        self._hits = 0
+        self._misses = 0
+        self._writebacks = 0
+        self._evictions = 0
+
+    def _insert(self, page_num, entry):
+        self._pages[page_num] = entry
+        while len(self._pages) > self._max_pages:
+            old_num, old_entry = self._pages.popitem(last=False)
+            self._evictions += 1
+            self._write_back(old_num, old_entry)
+
+    def _page(self, page_num):
+        """
+        gets the cache entry for page_num, loading it from the EEPROM on a miss
+        """
+        entry = self._pages.pop(page_num, None)
+        if entry is not None:
+            self._hits += 1
+            self._pages[page_num] = entry  # most recently used goes last
+            return entry
+        self._misses += 1
+        entry = [self._eeprom.read_bytes(page_num * self._page_size, self._page_size), None, None]
+        self._insert(page_num, entry)
+        return entry
+
+    def _write_back(self, page_num, entry):
+        data, lo, hi = entry
+        if lo is None:
+            return
+        self._eeprom.write_bytes(page_num * self._page_size + lo, data[lo:hi])
+        entry[1] = entry[2] = None
+        self._writebacks += 1
+
+    def read_byte(self, addr):
+        """
+        read one byte through the cache
+        @param addr: the EEPROM storage address to read from
+        @return: the value at the specified EEPROM storage address
+        """
+        data = self._page(addr // self._page_size)[0]
+        return data[addr % self._page_size]
+
+    def write_byte(self, addr, byte):
+        """
+        write one byte into the cache
+        @param addr: the EEPROM storage address
+        @param byte: the byte value
+        """
+        self.write_bytes(addr, [byte])
+
+    def read_bytes(self, addr_start, length):
+        """
+        read length bytes through the cache
+        @param addr_start: the starting address to begin reading
+        @param length: the length of bytes to read
+        @return: a bytearray of read bytes
+        """
+        result = bytearray()
+        addr = addr_start
+        end = addr_start + length
+        while addr < end:
+            offset = addr % self._page_size
+            n = min(end - addr, self._page_size - offset)
+            result += self._page(addr // self._page_size)[0][offset:offset+n]
+            addr += n
+        return result
+
+    def write_bytes(self, addr_start, bytes_lst):
+        """
+        write N bytes into the cache, bytes that already hold their value are not marked dirty
+        @param addr_start: the starting address
+        @param bytes_lst: a list() of bytes, a str or a bytearray to be written
+        """
+        data = bytearray(bytes_lst)
+        offset = 0
+        while offset < len(data):
+            addr = addr_start + offset
+            page_num = addr // self._page_size
+            page_offset = addr % self._page_size
+            n = min(len(data) - offset, self._page_size - page_offset)
+            chunk = data[offset:offset+n]
+
+            if n == self._page_size and page_num not in self._pages:
+                # the whole page is replaced, no need to load it first
+                self._insert(page_num, [chunk, 0, n])
+            else:
+                entry = self._page(page_num)
+                page = entry[0]
+                changed = [i for i in range(n) if page[page_offset+i] != chunk[i]]
+                if changed:
+                    lo = page_offset + changed[0]
+                    hi = page_offset + changed[-1] + 1
+                    page[lo:hi] = chunk[lo-page_offset:hi-page_offset]
+                    entry[1] = lo if entry[1] is None else min(entry[1], lo)
+                    entry[2] = hi if entry[2] is None else max(entry[2], hi)
+            offset += n
+
+    def write_string(self, addr_start, string):
+        """
+        write an ASCII string into the cache starting with addr_start
+        @param addr_start: the starting address
+        @param string:  the string to write
+        """
+        return self.write_bytes(addr_start, string)
+
+    def read_string(self, addr_start, length):
+        """
+        read a number of bytes through the cache as a string
+        @param addr_start: the starting address
+        @param length: the number of bytes to read
+        @return: a string
+        """
+        return str(self.read_bytes(addr_start, length))
+
+    def flush(self):
+        """
+        write every dirty page back to the EEPROM, the pages stay cached
+        """
+        for page_num, entry in self._pages.items():
+            self._write_back(page_num, entry)
+
+    def invalidate(self):
+        """
+        flush and then drop every cached page, use when something else has written to the EEPROM
+        """
+        self.flush()
+        self._pages.clear()
+
+    def stats(self):
+        """
+        gets the cache counters
+        @return: a dict of hits, misses, writebacks, evictions and the pages currently cached/dirty
+        """
+        return dict(hits=self._hits,
+                    misses=self._misses,
+                    writebacks=self._writebacks,
+                    evictions=self._evictions,
+                    cached_pages=len(self._pages),
+                    dirty_pages=len([e for e in self._pages.values() if e[1] is not None]))
+
+
+class EEPROMImage(object):
+    """
+        A local image of a BasicEEPROM's storage that loads pages lazily
+        and supports slicing. Slices of loaded regions are zero-copy
+        views that never touch the bus, writes are tracked per page and
+        coalesced into page writes on commit(). The image can optionally
+        be mirrored to an mmap'd file on disk.
+
+        Writes must go through item/slice assignment or pack_into() so
+        they are tracked; writing through a view is not seen by commit().
+
+        Examples
+        @code
+            img = EEPROMImage(BasicEEPROM.from_variant("24C256", 0x50, 1))
+            img[0x100:0x108] = struct.pack("<II", 1, 2)
+            img.pack_into("<HH", 0x200, 3, 4)
+            struct.unpack_from("<II", img[0x100:0x108])  # zero-copy, already loaded
+            img.commit()
+        @endcode
+    """
+
+    def __init__(self, eeprom, size=None, mirror_path=None, trust_mirror=False):
+        """
+        @param eeprom: the BasicEEPROM backing the image
+        @param size: the image size in bytes, defaults to the EEPROM capacity
+        @param mirror_path: a file to mmap the image onto, created if it does not exist
+        @param trust_mirror: treat an existing mirror file of the right size as already loaded
+        """
+        if size is None:
+            size = eeprom.capacity()
+        if size is None:
+            raise ValueError("EEPROMImage needs a size when the EEPROM capacity is not known.")
+        self._eeprom = eeprom
+        self._size = size
+        self._page_size = eeprom.page_size()
+        num_pages = (size + self._page_size - 1) // self._page_size
+        self._loaded = bytearray(num_pages)
+        self._dirty_lo = array('L', [self._page_size]) * num_pages  # lo >= hi means clean
+        self._dirty_hi = array('L', [0]) * num_pages
+        self._file = None
+        if mirror_path is None:
+            self._data = bytearray(size)
+        else:
+            existed = os.path.exists(mirror_path) and os.path.getsize(mirror_path) == size
+            self._file = open(mirror_path, "r+b" if os.path.exists(mirror_path) else "w+b")
+            self._file.truncate(size)
+            self._data = mmap.mmap(self._file.fileno(), size)
+            if existed and trust_mirror:
+                self._loaded[:] = b"\x01" * num_pages
+
+    def __len__(self):
+        return self._size
+
+    def _range(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._size)
+            if step != 1:
+                raise ValueError("EEPROMImage slices must be contiguous.")
+            return start, max(start, stop)
+        if key < 0:
+            key += self._size
+        if key < 0 or key >= self._size:
+            raise IndexError("EEPROMImage index out of range.")
+        return key, key + 1
+
+    def _load(self, start, stop):
+        """
+        read every page of [start, stop) that is not loaded yet, contiguous runs in one sequential read
+        """
+        page = start // self._page_size
+        last = (stop - 1) // self._page_size
+        while page <= last:
+            if self._loaded[page]:
+                page += 1
+                continue
+            run_end = page
+            while run_end + 1 <= last and not self._loaded[run_end + 1]:
+                run_end += 1
+            pos = page * self._page_size
+            end = min(self._size, (run_end + 1) * self._page_size)
+            for chunk in self._eeprom.stream_bytes(pos, end - pos):
+                self._data[pos:pos+len(chunk)] = bytes(chunk)
+                pos += len(chunk)
+            for i in range(page, run_end + 1):
+                self._loaded[i] = 1
+            page = run_end + 1
+
+    def _prepare_write(self, start, stop):
+        """
+        load the partially covered pages at either end of a write, fully covered pages are just marked loaded
+        """
+        if start >= stop:
+            return
+        if start % self._page_size:
+            self._load(start, start + 1)
+        if stop % self._page_size and stop != self._size:
+            self._load(stop - 1, stop)
+        for page in range(start // self._page_size, (stop - 1) // self._page_size + 1):
+            self._loaded[page] = 1
+
+    def _mark_dirty(self, start, stop):
+        addr = start
+        while addr < stop:
+            page = addr // self._page_size
+            offset = addr % self._page_size
+            end = min(stop - page * self._page_size, self._page_size)
+            self._dirty_lo[page] = min(self._dirty_lo[page], offset)
+            self._dirty_hi[page] = max(self._dirty_hi[page], end)
+            addr = page * self._page_size + end
+
+    def _view(self, start, stop):
+        try:
+            return memoryview(self._data)[start:stop]
+        except TypeError:
+            return buffer(self._data, start, stop - start)  # python 2 mmap has no memoryview support
+
+    def __getitem__(self, key):
+        """
+        an int index returns the byte value, a slice returns a zero-copy view of the image
+        """
+        start, stop = self._range(key)
+        if stop > start:
+            self._load(start, stop)
+        if isinstance(key, slice):
+            return self._view(start, stop)
+        return bytearray(self._data[start:stop])[0]
+
+    def __setitem__(self, key, value):
+        start, stop = self._range(key)
+        if isinstance(key, slice):
+            value = bytearray(value)
+            if len(value) != stop - start:
+                raise ValueError("EEPROMImage slice assignment cannot change the image size.")
+        else:
+            value = bytearray([value])
+        self._prepare_write(start, stop)
+        self._data[start:stop] = value if self._file is None else bytes(value)
+        self._mark_dirty(start, stop)
+
+    def view(self, start=0, stop=None):
+        """
+        gets a zero-copy view of [start, stop), loading it first if needed
+        usable anywhere a buffer is, i.e. struct.unpack_from() or file.write()
+        """
+        if stop is None:
+            stop = self._size
+        return self[start:stop]
+
+    def load(self):
+        """
+        load the whole image from the EEPROM
+        """
+        self._load(0, self._size)
+
+    def pack_into(self, fmt, offset, *values):
+        """
+        struct.pack_into() directly onto the image
+        @param fmt: the struct format
+        @param offset: the image offset
+        @param values: the values to pack
+        """
+        stop = offset + struct.calcsize(fmt)
+        self._range(slice(offset, stop))
+        if stop > self._size:
+            raise ValueError("EEPROMImage record would run past the end of the image.")
+        self._prepare_write(offset, stop)
+        struct.pack_into(fmt, self._data, offset, *values)
+        self._mark_dirty(offset, stop)
+
+    def unpack_from(self, fmt, offset=0):
+        """
+        struct.unpack_from() directly from the image
+        @param fmt: the struct format
+        @param offset: the image offset
+        @return: the unpacked tuple
+        """
+        stop = offset + struct.calcsize(fmt)
+        self._load(offset, stop)
+        return struct.unpack_from(fmt, self._data, offset)
+
+    def dirty(self):
+        """
+        gets whether the image has writes that have not been committed
+        """
+        for page in range(len(self._loaded)):
+            if self._dirty_lo[page] < self._dirty_hi[page]:
+                return True
+        return False
+
+    def commit(self):
+        """
+        write the changed spans back to the EEPROM, spans that meet across a
+        page boundary are joined into one write_bytes() call
+        @return: the number of bytes written
+        """
+        written = 0
+        run_start = None
+        run_end = None
+        run_page = None
+        for page in range(len(self._loaded) + 1):
+            lo = hi = None
+            if page < len(self._loaded) and self._dirty_lo[page] < self._dirty_hi[page]:
+                lo = page * self._page_size + self._dirty_lo[page]
+                hi = page * self._page_size + self._dirty_hi[page]
+            if run_start is not None and (lo is None or lo != run_end):
+                written += self._eeprom.write_bytes(run_start, self._data[run_start:run_end])
+                # only marked clean once written, a failed write leaves the run dirty for the next commit()
+                for i in range(run_page, page):
+                    self._dirty_lo[i] = self._page_size
+                    self._dirty_hi[i] = 0
+                run_start = None
+            if lo is not None:
+                if run_start is None:
+                    run_start = lo
+                    run_page = page
+                run_end = hi
+        if self._file is not None:
+            self._data.flush()
+        return written
+
+    def close(self):
+        """
+        release the mirror file, uncommitted writes stay in it but are not sent to the EEPROM
+        """
+        if self._file is not None:
+            self._data.flush()
+            self._data.close()
+            self._file.close()
+            self._file = None
+
+
+class WriteFuture(object):
+    """
+        The result of a write queued on a QueuedEEPROMWriter
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._error = None
+
+    def _finish(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self._event.set()
+
+    def done(self):
+        """
+        gets whether the write has reached the EEPROM (or failed)
+        """
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        block until the write is done
+        @param timeout: seconds to wait, None waits forever
+        @return: True if the write is done
+        """
+        self._event.wait(timeout)
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """
+        block until the write is done
+        @param timeout: seconds to wait, None waits forever
+        @return: the number of bytes this request asked to write
+        """
+        if not self.wait(timeout):
+            raise RuntimeError("EEPROM write did not finish in time.")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class QueuedEEPROMWriter(object):
+    """
+        Runs BasicEEPROM writes on a worker thread so the caller never
+        waits on a write cycle. Requests queued while the worker is busy
+        are merged, adjacent and overlapping ranges become one write with
+        later requests winning, before they go out through the page write
+        engine.
+
+        Examples
+        @code
+            writer = QueuedEEPROMWriter(BasicEEPROM.from_variant("24C256", 0x50, 1))
+            future = writer.write_bytes(0x40, [1, 2, 3])
+            writer.write_bytes(0x43, [4, 5])  # merged with the first write if it is still queued
+            writer.read_bytes(0x40, 5)  # sees the queued data
+            future.wait()
+            writer.close()
+        @endcode
+    """
+
+    def __init__(self, eeprom):
+        """
+        @param eeprom: the BasicEEPROM to write to
+        """
+        self._eeprom = eeprom
+        self._cond = threading.Condition()
+        self._pending = list()  # (addr, bytearray, WriteFuture) in submission order
+        self._in_flight = list()
+        self._closing = False
+        self._requests = 0
+        self._merged_writes = 0
+        self._bytes_written = 0
+        self._worker = threading.Thread(target=self._run)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def write_bytes(self, addr_start, bytes_lst):
+        """
+        queue a write, returns immediately
+        @param addr_start: the starting address
+        @param bytes_lst: a list() of bytes, a str or a bytearray to be written
+        @return: a WriteFuture
+        """
+        future = WriteFuture()
+        data = bytearray(bytes_lst)
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("QueuedEEPROMWriter is closed.")
+            self._pending.append((addr_start, data, future))
+            self._requests += 1
+            self._cond.notify()
+        return future
+
+    def write_byte(self, addr, byte):
+        """
+        queue a one byte write
+        @return: a WriteFuture
+        """
+        return self.write_bytes(addr, [byte])
+
+    def write_string(self, addr_start, string):
+        """
+        queue an ASCII string write
+        @return: a WriteFuture
+        """
+        return self.write_bytes(addr_start, string)
+
+    def read_bytes(self, addr_start, length):
+        """
+        read from the EEPROM with any queued or in flight writes laid over the result
+        @param addr_start: the starting address to begin reading
+        @param length: the length of bytes to read
+        @return: a bytearray of read bytes
+        """
+        # snapshot first, a write that finishes while the chip is read is still laid over it
+        with self._cond:
+            writes = self._in_flight + self._pending
+        data = self._eeprom.read_bytes(addr_start, length)
+        for addr, chunk, future in writes:
+            lo = max(addr, addr_start)
+            hi = min(addr + len(chunk), addr_start + length)
+            if lo < hi:
+                data[lo-addr_start:hi-addr_start] = chunk[lo-addr:hi-addr]
+        return data
+
+    @staticmethod
+    def _merge(requests):
+        """
+        merge requests into non-overlapping extents, later requests win where they overlap
+        @return: a list of (addr, bytearray, [futures])
+        """
+        spans = sorted([(addr, addr + len(data)) for addr, data, future in requests])
+        extents = list()
+        for lo, hi in spans:
+            if extents and lo <= extents[-1][1]:
+                extents[-1][1] = max(extents[-1][1], hi)
+            else:
+                extents.append([lo, hi])
+        merged = [(lo, bytearray(hi - lo), list()) for lo, hi in extents]
+        for addr, data, future in requests:
+            for lo, buf, futures in merged:
+                if lo <= addr and addr + len(data) <= lo + len(buf):
+                    buf[addr-lo:addr-lo+len(data)] = data
+                    futures.append((future, len(data)))
+                    break
+        return merged
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                self._in_flight = self._pending
+                self._pending = list()
+                batch = self._in_flight
+
+            for addr, data, futures in QueuedEEPROMWriter._merge(batch):
+                try:
+                    self._eeprom.write_bytes(addr, data)
+                except Exception as e:
+                    for future, n in futures:
+                        future._finish(error=e)
+                    continue
+                with self._cond:
+                    self._merged_writes += 1
+                    self._bytes_written += len(data)
+                for future, n in futures:
+                    future._finish(result=n)
+
+            with self._cond:
+                self._in_flight = list()
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        block until every queued write has reached the EEPROM
+        @param timeout: seconds to wait, None waits forever
+        @return: True if the queue drained
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        finish the queued writes and stop the worker thread
+        @param timeout: seconds to wait, None waits forever
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+
+    def stats(self):
+        """
+        gets the writer counters
+        @return: a dict of requests queued, merged writes issued, bytes written and requests still queued
+        """
+        with self._cond:
+            return dict(requests=self._requests,
+                        merged_writes=self._merged_writes,
+                        bytes_written=self._bytes_written,
+                        queued=len(self._pending))
@@ -10,7 +10,7 @@
     by a PWM controlled variable speed on/off/fwd/rev control object
 """
 import RPi.GPIO as gpio
-from BasicLogic import BasicToggleOutput
+from BasicLogic import BasicToggleOutput, PinBank, output_stats
 from utils import Delay
 
 class BasicL293DMotor(object):
@@ -174,15 +174,16 @@ class BipolarL293DStepperMotor(object):
 
     STEP_DELAY = 500 # us
 
+    # coil pin masks for each phase, bit 0 = 1a, bit 1 = 1b, bit 2 = 2a, bit 3 = 2b
+    PHASES = {
+        FWD: (0x5, 0x6, 0xA, 0x9),
+        REV: (0x9, 0xA, 0x6, 0x5),
+    }
+
     def __init__(self, enable_pin, pin1a, pin1b, pin2a, pin2b, step_delay=STEP_DELAY, numbering=gpio.BCM, _gpio=gpio):
 
         self._enable = BasicToggleOutput(enable_pin, numbering, _gpio)
-        self._control_pins = [None] * 4
-        self._pin1a = BasicToggleOutput(pin1a, numbering, _gpio)
-        self._pin1b = BasicToggleOutput(pin1b, numbering, _gpio)
-        self._pin2a  = BasicToggleOutput(pin2a, numbering, _gpio)
-        self._pin2b = BasicToggleOutput(pin2b, numbering, _gpio)
-
+        self._coils = PinBank([pin1a, pin1b, pin2a, pin2b], numbering=numbering, _gpio=_gpio)
 
         self._step_delay = step_delay
 
@@ -193,63 +194,18 @@ class BipolarL293DStepperMotor(object):
         self._enable.lo()
 
     def step(self, direction=FWD):
-        if direction == BipolarL293DStepperMotor.FWD:
-            self._pin1a.hi()
-            self._pin2a.hi()
-            self._pin1b.lo()
-            self._pin2b.lo()
-            Delay.sleep_us(self._step_delay)
-
-            self._pin1a.lo()
-            self._pin2a.hi()
-            self._pin1b.hi()
-            self._pin2b.lo()
-            Delay.sleep_us(self._step_delay)
-
-            self._pin1a.lo()
-            self._pin2a.lo()
-            self._pin1b.hi()
-            self._pin2b.hi()
-            Delay.sleep_us(self._step_delay)
-
-            self._pin1a.hi()
-            self._pin2a.lo()
-            self._pin1b.lo()
-            self._pin2b.hi()
-
-        elif direction == BipolarL293DStepperMotor.STOPPED:
+        if direction == BipolarL293DStepperMotor.STOPPED:
             return
-        elif direction == BipolarL293DStepperMotor.REV:
-            self._pin1a.hi()
-            self._pin2a.lo()
-            self._pin1b.lo()
-            self._pin2b.hi()
-            Delay.sleep_us(self._step_delay)
-
-            self._pin1a.lo()
-            self._pin2a.lo()
-            self._pin1b.hi()
-            self._pin2b.hi()
-            Delay.sleep_us(self._step_delay)
-
-            self._pin1a.lo()
-            self._pin2a.hi()
-            self._pin1b.hi()
-            self._pin2b.lo()
-            Delay.sleep_us(self._step_delay)
-
-            self._pin1a.hi()
-            self._pin2a.hi()
-            self._pin1b.lo()
-            self._pin2b.lo()
-
-
-
-
-
-
-
-
-
-
+        phases = BipolarL293DStepperMotor.PHASES.get(direction)
+        if phases is None:
+            raise ValueError("Direction must be one of FWD, STOPPED or REV.")
+        for i, phase in enumerate(phases):
+            if i:
+                Delay.sleep_us(self._step_delay)
+            self._coils.write(phase)
 
+    def stats(self):
+        """
+        gets the output counters of the enable and coil pins, see PinBank.stats()
+        """
+        return output_stats((self._coils, self._enable))
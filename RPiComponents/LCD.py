@@ -22,27 +22,25 @@ class LCD1602A1(object):
         DIRECTION_LEFT = 1
         DIRECTION_RIGHT = 2
 
-    def __init__(self, enable, rw, rs, dbits):
+    RS_BIT = 0x10  # RS is the bit after the 4 data bits on the PinBank
+
+    def __init__(self, enable, rw, rs, dbits, numbering=gpio.BCM, _gpio=gpio):
         """
 
         :param enable: the LCD enable pin number
         :param rw: the LCD read/write pin number
         :param rs: the LCD register/select pin number
         :param dbits: the data bit pin numbers [0-3]
+        :param numbering: the pin numbering system (RPi.GPIO.BOARD or RPi.GPIO.BCM)
+        :param _gpio: the gpio object if using a different than the default
         :return:
         """
-        self._EN = BasicToggleOutput(enable)
+        self._EN = BasicToggleOutput(enable, numbering, _gpio)
         self._EN.lo()
-        self._RW = BasicToggleOutput(rw)
+        self._RW = BasicToggleOutput(rw, numbering, _gpio)
         self._RW.lo()
-        self._RS = BasicToggleOutput(rs)
-        self._RS.lo()
-        self._DATA = [None]*4
-        for i in range(4):
-            self._DATA[i] = (BasicToggleOutput(dbits[i]))
-
-        for databit in self._DATA:
-            databit.lo()
+        # data bits 0-3 then RS, so a nibble and its register select go out in one call
+        self._BUS = PinBank(list(dbits[:4]) + [rs], numbering=numbering, _gpio=_gpio)
 
         self.clear()
 
@@ -55,32 +53,23 @@ class LCD1602A1(object):
         """
         Delay.sleep_ms(10)
 
-        bits = bin(_byte)[2:].zfill(8)
-        if is_char:
-            self._RS.hi()
-        else:
-            self._RS.lo()
-
-        for databit in self._DATA:
-            databit.lo()
-
-        for i in range(4):
-            if bits[i] == "1":
-                self._DATA[::-1][i].high()
+        rs = LCD1602A1.RS_BIT if is_char else 0
 
+        self._BUS.write(rs | ((_byte >> 4) & 0x0F))
         self._EN.hi()
         self._EN.lo()
 
-        for databit in self._DATA:
-            databit.lo()
-
-        for i in range(4, 8):
-            if bits[i] == "1":
-                self._DATA[::-1][i-4].high()
-
+        self._BUS.write(rs | (_byte & 0x0F))
         self._EN.hi()
         self._EN.lo()
 
+    def stats(self):
+        """
+        gets the output counters of every LCD pin, see PinBank.stats()
+        :return: a dict of counters
+        """
+        return output_stats((self._BUS, self._EN, self._RW))
+
     def clear(self):
         """
         series of commands that clear
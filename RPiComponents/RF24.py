@@ -9,7 +9,15 @@
 """
 from BasicLogic import *
 import RPi.GPIO as gpio
-import spidev
+from SPIBus import SPIBus
+import errno
+import fcntl
+import os
+import select
+import threading
+import time
+from array import array
+from collections import deque
 import utils.Delay as delay
 
 
@@ -27,9 +35,9 @@ class Radio(object):
     COMMANDS["R_REGISTER"] = 0x00
     COMMANDS["R_RX_PAYLOAD"] = 0x61
     COMMANDS["W_TX_PAYLOAD"] = 0xA0
-    COMMANDS["FLUSH_TX"] = 0x71
-    COMMANDS["FLUSH_RX"] = 0x72
-    COMMANDS["REUSE_TX_PL"] = 0x73
+    COMMANDS["FLUSH_TX"] = 0xE1
+    COMMANDS["FLUSH_RX"] = 0xE2
+    COMMANDS["REUSE_TX_PL"] = 0xE3
     COMMANDS["R_RX_PL_WID"] = 0x60
     COMMANDS["W_TX_PAYLOAD_NOACK"] = 0xB0
     COMMANDS["NOP"] = 0xFF
@@ -62,6 +70,8 @@ class Radio(object):
     REGISTERS["RX_PW_P4"] = 0x15
     REGISTERS["RX_PW_P5"] = 0x16
     REGISTERS["FIFO_STATUS"] = 0x17
+    REGISTERS["DYNPD"] = 0x1C
+    REGISTERS["FEATURE"] = 0x1D
 
     """
         BIT_MNEMONIC holds the bit number for selected bits
@@ -106,9 +116,38 @@ class Radio(object):
     BIT_MNEMONIC["TX_EMPTY"] = 4
     BIT_MNEMONIC["RX_FULL"] = 1
     BIT_MNEMONIC["RX_EMPTY"] = 0
+    BIT_MNEMONIC["RPD"] = 0
+    BIT_MNEMONIC["DPL_P5"] = 5
+    BIT_MNEMONIC["DPL_P4"] = 4
+    BIT_MNEMONIC["DPL_P3"] = 3
+    BIT_MNEMONIC["DPL_P2"] = 2
+    BIT_MNEMONIC["DPL_P1"] = 1
+    BIT_MNEMONIC["DPL_P0"] = 0
+    BIT_MNEMONIC["EN_DPL"] = 2
+    BIT_MNEMONIC["EN_ACK_PAY"] = 1
+    BIT_MNEMONIC["EN_DYN_ACK"] = 0
 
+    """
+        VOLATILE_REGISTERS change on their own and are always read from the
+        chip, the multi byte address registers are not mirrored either, every
+        other register is kept in the shadow register file
+    """
+    VOLATILE_REGISTERS = (REGISTERS["STATUS"], REGISTERS["OBSERVE_TX"], REGISTERS["RPD"], REGISTERS["FIFO_STATUS"],
+                          REGISTERS["RX_ADDR_P0"], REGISTERS["RX_ADDR_P1"], REGISTERS["TX_ADDDR"])
+
+    PAYLOAD_MAX = 32
+    PIPES = 6
+    RX_ADDR_REGISTERS = (REGISTERS["RX_ADDR_P0"], REGISTERS["RX_ADDR_P1"], REGISTERS["RX_ADDR_P2"],
+                         REGISTERS["RX_ADDR_P3"], REGISTERS["RX_ADDR_P4"], REGISTERS["RX_ADDR_P5"])
+    RX_PW_REGISTERS = (REGISTERS["RX_PW_P0"], REGISTERS["RX_PW_P1"], REGISTERS["RX_PW_P2"],
+                       REGISTERS["RX_PW_P3"], REGISTERS["RX_PW_P4"], REGISTERS["RX_PW_P5"])
+    TX_PIPELINE_DEPTH = 2  # one payload on air, one waiting behind it, see send_many()
+    RX_P_NO_EMPTY = 7  # RX_P_NO value when the RX FIFO is empty
+    CHANNELS = 126
+    RPD_SETTLE_US = 170  # RX settling plus the 40us RPD needs to latch a carrier
+    LATENCY_BUCKETS = 20  # latency histogram bucket i counts [2**(i-1), 2**i) us, the last one everything above
 
-    def __init__(self, bus, port, ce, _int, numbering=gpio.BCM, _gpio=gpio):
+    def __init__(self, bus, port, ce, _int, numbering=gpio.BCM, _gpio=gpio, rx_queue_size=64, _spi=None):
         """
 
         :param bus: the SPI bus number
@@ -117,23 +156,262 @@ class Radio(object):
         :param _int: the chip IRQ pin
         :param numbering: GPIO numbering scheme
         :param _gpio: which gpio to use
+        :param rx_queue_size: the number of received payloads held for recv(), the oldest is dropped when full
+        :param _spi: the SPIBus.SPIBus to use if not opening bus/port
         :return: an instance of this class
 
         radio_1 = RF24.Radio(0, 0, 26, 19)
 
         """
-        self._spi = spidev.SpiDev()
-        self._spi.open(bus, port)
+        self._spi = _spi if _spi is not None else SPIBus(bus, port)
+        self._lock = threading.RLock()  # the IRQ callback runs on its own thread
+        self._shadow = dict()  # register -> last value written to or read from the chip
+        self._payload_size = Radio.PAYLOAD_MAX  # static TX payload width, the same as pipe 0
+        self._rx_widths = [Radio.PAYLOAD_MAX] * Radio.PIPES  # static RX payload width per pipe
+        self._dynamic_pipes = 0  # DYNPD bits, pipes using dynamic payload length
+        self._rx_queue = deque(maxlen=rx_queue_size)  # (pipe, timestamp, payload)
+        self._rx_cond = threading.Condition()
+        self.reset_stats()
+        self._wakeup = None  # (read fd, write fd), created by fileno()
         self._ce = BasicToggleOutput(ce, numbering=numbering, _gpio=_gpio)
-        self._int = ToggleInputCallback(_int, callback=self.interrupted, numbering=numbering, _gpio=_gpio, edge=_gpio.FALLING)
+        # no debounce, an IRQ edge ignored would leave the line low with nothing to drain it
+        self._int = ToggleInputCallback(_int, callback=self.interrupted, debounce_delay=0, numbering=numbering,
+                                        _gpio=_gpio, edge=_gpio.FALLING)
+
+    def _xfer(self, data):
+        """
+        one SPI transaction, the first byte returned is always STATUS
+        :param data: a list of bytes to send
+        :return: the list of bytes received
+        """
+        with self._lock:
+            self._spi_transactions += 1
+            self._spi_bytes += len(data)
+            return self._spi.xfer(data)
+
+    def _xfer_many(self, transfers):
+        """
+        several SPI transactions in one batched message
+        :param transfers: a list of lists of bytes to send
+        :return: a list of the lists of bytes received
+        """
+        with self._lock:
+            self._spi_transactions += len(transfers)
+            self._spi_bytes += sum(len(data) for data in transfers)
+            return self._spi.xfer_many(transfers)
+
+    @staticmethod
+    def _histogram_add(histogram, seconds):
+        us = int(seconds * 10**6)
+        bucket = us.bit_length() if us > 0 else 0
+        histogram[min(bucket, Radio.LATENCY_BUCKETS - 1)] += 1
+
+    def reset_stats(self):
+        """
+        zeroes the counters reported by stats()
+        :return:
+        """
+        with self._lock:
+            self._spi_transactions = 0
+            self._spi_bytes = 0
+            self._rx_packets = 0
+            self._tx_acked = 0
+            self._tx_failed = 0
+            self._tx_ds_count = 0
+            self._max_rt_count = 0
+            self._plos_cnt = 0
+            self._retry_histogram = array('L', [0]) * 16  # ARC_CNT after each send_many() result
+            self._rx_fifo_high_water = 0
+            self._tx_fifo_high_water = 0
+            self._irq_service_histogram = array('L', [0]) * Radio.LATENCY_BUCKETS
+        with self._rx_cond:
+            # the receive queue counters are updated under _rx_cond, not _lock
+            self._rx_dropped = 0
+            self._rx_queue_high_water = 0
+            self._rx_latency_histogram = array('L', [0]) * Radio.LATENCY_BUCKETS
+
+    def stats(self):
+        """
+        gets the radio counters, they are kept as plain increments along paths
+        that run anyway so they can stay on in production, the one read they
+        need, OBSERVE_TX, rides in the batched SPI message that clears STATUS
+        :return: a dict of
+            spi_transactions, spi_bytes: SPI traffic
+            rx_packets, rx_dropped: payloads queued by the IRQ callback, and dropped with the queue full
+            tx_acked, tx_failed: send_many() payloads acknowledged, and failed or timed out
+            tx_ds, max_rt: TX_DS/MAX_RT events seen
+            retries: histogram list of ARC_CNT (0-15) from OBSERVE_TX read at each send_many() result
+            lost_packets: OBSERVE_TX PLOS_CNT, saturates at 15 and resets on a channel change
+            rx_fifo_high_water: most payloads drained from the RX FIFO by one IRQ (the FIFO holds 3)
+            rx_queue_high_water: longest the receive queue has been
+            tx_fifo_high_water: most payloads send_many() has had in the TX FIFO
+            irq_service_us: histogram list of IRQ callback run times, see Radio.LATENCY_BUCKETS
+            rx_latency_us: histogram list of the time from the IRQ callback to recv() handing a payload out
+        """
+        with self._lock:
+            result = dict(spi_transactions=self._spi_transactions,
+                          spi_bytes=self._spi_bytes,
+                          rx_packets=self._rx_packets,
+                          tx_acked=self._tx_acked,
+                          tx_failed=self._tx_failed,
+                          tx_ds=self._tx_ds_count,
+                          max_rt=self._max_rt_count,
+                          retries=map(int, self._retry_histogram),
+                          lost_packets=self._plos_cnt,
+                          rx_fifo_high_water=self._rx_fifo_high_water,
+                          tx_fifo_high_water=self._tx_fifo_high_water,
+                          irq_service_us=map(int, self._irq_service_histogram))
+        with self._rx_cond:
+            result.update(rx_dropped=self._rx_dropped,
+                          rx_queue_high_water=self._rx_queue_high_water,
+                          rx_latency_us=map(int, self._rx_latency_histogram))
+        return result
 
     def interrupted(self, pin):
-        print "Rx'd interrupt"
+        """
+        IRQ callback, drains the RX FIFO into the receive queue and
+        clears every interrupt flag so the IRQ line is released
+        :param pin: the IRQ pin
+        :return:
+        """
+        timestamp = time.time()
+        rx_dr = 1 << Radio.BIT_MNEMONIC["RX_DR"]
+        tx_ds = 1 << Radio.BIT_MNEMONIC["TX_DS"]
+        max_rt = 1 << Radio.BIT_MNEMONIC["MAX_RT"]
+        status_cmd = Radio.COMMANDS["W_REGISTER"] | Radio.REGISTERS["STATUS"]
+        with self._lock:
+            status = self._xfer([Radio.COMMANDS["NOP"]])[0]
+            if status & (tx_ds | max_rt):
+                if status & tx_ds:
+                    self._tx_ds_count += 1
+                if status & max_rt:
+                    self._max_rt_count += 1
+                status = self._xfer([status_cmd, status & (tx_ds | max_rt)])[0]
+
+            packets = list()
+            while (status >> Radio.BIT_MNEMONIC["RX_P_NO"]) & 0x07 != Radio.RX_P_NO_EMPTY:
+                pipe = (status >> Radio.BIT_MNEMONIC["RX_P_NO"]) & 0x07
+                width = self._rx_width(pipe)
+                if width is None:
+                    # a corrupt dynamic width, the datasheet says to flush the RX FIFO
+                    self._xfer([Radio.COMMANDS["FLUSH_RX"]])
+                    status = self._xfer([status_cmd, rx_dr])[0]
+                    break
+                # clearing RX_DR clocks out STATUS again, with RX_P_NO now
+                # naming the next payload in the FIFO (or empty)
+                data, cleared = self._xfer_many([[Radio.COMMANDS["R_RX_PAYLOAD"]] + [0]*width, [status_cmd, rx_dr]])
+                packets.append((pipe, timestamp, bytearray(data[1:])))
+                status = cleared[0]
+
+            self._rx_packets += len(packets)
+            self._rx_fifo_high_water = max(self._rx_fifo_high_water, len(packets))
+            Radio._histogram_add(self._irq_service_histogram, time.time() - timestamp)
+
+        if packets:
+            with self._rx_cond:
+                for packet in packets:
+                    if len(self._rx_queue) == self._rx_queue.maxlen:
+                        self._rx_dropped += 1
+                    self._rx_queue.append(packet)
+                self._rx_queue_high_water = max(self._rx_queue_high_water, len(self._rx_queue))
+                self._rx_cond.notify_all()
+                self._set_wakeup()
+
+    def fileno(self):
+        """
+        a file descriptor that is readable whenever payloads are waiting in
+        the receive queue, so a radio can go into select() next to sockets
+        :return: the read end of the radio's wakeup pipe
+        """
+        with self._rx_cond:
+            if self._wakeup is None:
+                self._wakeup = os.pipe()
+                for fd in self._wakeup:
+                    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+                if self._rx_queue:
+                    self._set_wakeup()
+            return self._wakeup[0]
+
+    def _set_wakeup(self):
+        """
+        marks the wakeup pipe readable, called with _rx_cond held
+        """
+        if self._wakeup is not None:
+            try:
+                os.write(self._wakeup[1], b"\0")
+            except OSError as e:
+                if e.errno != errno.EAGAIN:  # a full pipe is readable already
+                    raise
+
+    def _clear_wakeup(self):
+        """
+        empties the wakeup pipe once the queue is empty, called with _rx_cond held
+        """
+        if self._wakeup is not None and not self._rx_queue:
+            try:
+                while os.read(self._wakeup[0], 64):
+                    pass
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def _rx_width(self, pipe):
+        """
+        the width of the payload at the head of the RX FIFO
+        :param pipe: the pipe it arrived on, from RX_P_NO
+        :return: the number of bytes to read, None if the chip reported a corrupt dynamic width
+        """
+        if pipe >= Radio.PIPES:
+            return None
+        if not self._dynamic_pipes & (1 << pipe):
+            return self._rx_widths[pipe]
+        width = self._xfer([Radio.COMMANDS["R_RX_PL_WID"], 0])[1]
+        if width > Radio.PAYLOAD_MAX:
+            return None
+        return width
+
+    def recv(self, timeout=None):
+        """
+        gets the oldest payload received by the IRQ callback, blocking until one arrives
+        :param timeout: seconds to wait, None waits forever
+        :return: (pipe, timestamp, payload bytearray), or None on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._rx_cond:
+            while not self._rx_queue:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._rx_cond.wait(remaining)
+            packet = self._rx_queue.popleft()
+            self._clear_wakeup()
+            Radio._histogram_add(self._rx_latency_histogram, time.time() - packet[1])
+            return packet
+
+    def recv_nowait(self):
+        """
+        gets the oldest payload received by the IRQ callback without blocking
+        :return: (pipe, timestamp, payload bytearray), or None if nothing is queued
+        """
+        with self._rx_cond:
+            if self._rx_queue:
+                packet = self._rx_queue.popleft()
+                self._clear_wakeup()
+                Radio._histogram_add(self._rx_latency_histogram, time.time() - packet[1])
+                return packet
+            return None
 
-        if self.is_data_ready():
-            print "Data Ready"
-        if self.is_txing():
-            print "Data tx'd"
+    def rx_pending(self):
+        """
+        :return: the number of received payloads waiting in the queue
+        """
+        return len(self._rx_queue)
+
+    def rx_dropped(self):
+        """
+        :return: the number of payloads dropped because the receive queue was full
+        """
+        return self._rx_dropped
 
     def write_register(self, register, value):
         """
@@ -145,20 +423,44 @@ class Radio(object):
         # write register is 001AAAAA
         # where AAAAA is reg num
         cmd = Radio.COMMANDS["W_REGISTER"] | (0x1f & register)
-        self._spi.xfer2([cmd, value])
+        self._xfer([cmd, value])
+        if register not in Radio.VOLATILE_REGISTERS:
+            self._shadow[register] = value & 0xff
 
-    def read_register(self, register):
+    def read_register(self, register, cached=True):
         """
-        reads value from register
+        reads value from register, answered from the shadow register file when it holds the register
         :param register: register number from Radio.REGISTERS
+        :param cached: False always reads the chip
         :return: value read from register
         """
+        if cached and register in self._shadow:
+            return self._shadow[register]
         # read register is 000AAAAA
         # where AAAAA is reg num
         cmd = Radio.COMMANDS["R_REGISTER"] | (0x1f & register)
-        result = self._spi.xfer2([cmd, 0])
+        result = self._xfer([cmd, 0])
+        if register not in Radio.VOLATILE_REGISTERS:
+            self._shadow[register] = result[1]
         return result[1]
 
+    def sync(self):
+        """
+        reloads the shadow register file from the chip, call this if the chip
+        may have been reset or written to behind this object's back
+        :return:
+        """
+        self._shadow.clear()
+        for register in sorted(Radio.REGISTERS.values()):
+            if register not in Radio.VOLATILE_REGISTERS:
+                self.read_register(register, cached=False)
+        self._rx_widths = [self._shadow[register] & 0x3f for register in Radio.RX_PW_REGISTERS]
+        self._payload_size = self._rx_widths[0]
+        if self._shadow[Radio.REGISTERS["FEATURE"]] & (1 << Radio.BIT_MNEMONIC["EN_DPL"]):
+            self._dynamic_pipes = self._shadow[Radio.REGISTERS["DYNPD"]] & 0x3f
+        else:
+            self._dynamic_pipes = 0
+
     def read_config(self):
         """
         reads configuration register
@@ -184,7 +486,7 @@ class Radio(object):
         :return: status register value
         """
         cmd = Radio.COMMANDS["NOP"]
-        result = self._spi.xfer2([cmd])
+        result = self._xfer([cmd])
         return result[0]
 
     def power_up(self):
@@ -216,6 +518,54 @@ class Radio(object):
         """
         return self.read_register(Radio.REGISTERS["RF_CH"])
 
+    def survey(self, samples=32, channels=None, dwell_us=RPD_SETTLE_US):
+        """
+        sweeps the channels sampling the received power detector (RPD), a carrier over -64dBm
+        sets it. The sweep is done samples times over, one sample per channel per pass, so a
+        burst of interference is not all counted against one channel. The channel, mode and CE
+        are put back afterwards.
+        :param samples: carrier detect samples taken per channel
+        :param channels: the channels to sweep, all 126 by default
+        :param dwell_us: microseconds in RX before each sample is read
+        :return: a ChannelSurvey
+        """
+        if channels is None:
+            channels = range(Radio.CHANNELS)
+        for ch in channels:
+            if ch < 0 or ch >= Radio.CHANNELS:
+                raise ValueError("Channel must be in range [0-%d]." % (Radio.CHANNELS - 1))
+        if samples < 1:
+            raise ValueError("There must be at least one sample per channel.")
+
+        result = ChannelSurvey(channels, samples)
+        hits = result.hits
+        rpd = Radio.REGISTERS["RPD"]
+        rpd_bit = 1 << Radio.BIT_MNEMONIC["RPD"]
+        with self._lock:
+            ce_state = self._ce.value()
+            config = self.read_config()
+            old_channel = self.get_channel()
+            self._ce.lo()
+            self.write_register(Radio.REGISTERS["CONFIG"],
+                                config | 1 << Radio.BIT_MNEMONIC["PWR_UP"] | 1 << Radio.BIT_MNEMONIC["PRIM_RX"])
+            if not config & (1 << Radio.BIT_MNEMONIC["PWR_UP"]):
+                delay.sleep_ms(1.5)
+            try:
+                for i in range(samples):
+                    for index, ch in enumerate(channels):
+                        self.set_channel(ch)
+                        self._ce.hi()
+                        delay.sleep_us(dwell_us)
+                        self._ce.lo()  # RPD holds its value once out of RX
+                        if self.read_register(rpd, cached=False) & rpd_bit:
+                            hits[index] += 1
+            finally:
+                self.set_channel(old_channel)
+                self.write_register(Radio.REGISTERS["CONFIG"], config)
+                if ce_state:
+                    self._ce.hi()
+        return result
+
     def start_rx(self):
         """
         start rx mode
@@ -244,9 +594,109 @@ class Radio(object):
         :param payload: a list of ints to be written
         :return:
         """
-        self._spi.xfer2([Radio.COMMANDS["FLUSH_TX"]])
+        self._xfer([Radio.COMMANDS["FLUSH_TX"]])
         cmd = [Radio.COMMANDS["W_TX_PAYLOAD"]] + payload
-        self._spi.xfer2(cmd)
+        self._xfer(cmd)
+
+    def send_many(self, payloads, timeout=1.0):
+        """
+        burst send, keeps the TX FIFO loaded with CE held high and
+        follows TX_FULL/TX_DS/MAX_RT in the STATUS byte every SPI command returns
+
+        at most Radio.TX_PIPELINE_DEPTH payloads are in the FIFO at once: TX_DS
+        is a single flag, and FIFO_STATUS can only tell empty from not empty,
+        so with two in flight a TX_DS always says exactly how many were sent
+        :param payloads: a list of payloads, each a list of ints, str or bytearray padded/cut to the payload
+                         size, or sent at its own length with dynamic payloads on pipe 0
+        :param timeout: seconds allowed for the whole burst, unsent payloads count as failed
+        :return: a list of True (acknowledged) / False (hit max retries or timed out), one per payload
+
+        CONFIG and CE are put back as they were afterwards, a radio that was receiving goes back to RX
+        """
+        count = len(payloads)
+        results = [False] * count
+        frames = list()
+        dynamic = self._dynamic_pipes & (1 << Radio.BIT_MNEMONIC["DPL_P0"])
+        for payload in payloads:
+            if dynamic:
+                data = list(bytearray(payload)[:Radio.PAYLOAD_MAX])
+                frames.append([Radio.COMMANDS["W_TX_PAYLOAD"]] + (data or [0]))
+            else:
+                data = list(bytearray(payload)[:self._payload_size])
+                frames.append([Radio.COMMANDS["W_TX_PAYLOAD"]] + data + [0] * (self._payload_size - len(data)))
+
+        tx_full = 1 << Radio.BIT_MNEMONIC["TX_FULL"]
+        tx_ds = 1 << Radio.BIT_MNEMONIC["TX_DS"]
+        max_rt = 1 << Radio.BIT_MNEMONIC["MAX_RT"]
+        status_cmd = Radio.COMMANDS["W_REGISTER"] | Radio.REGISTERS["STATUS"]
+        nop = [Radio.COMMANDS["NOP"]]
+        fifo_cmd = [Radio.COMMANDS["R_REGISTER"] | Radio.REGISTERS["FIFO_STATUS"], 0]
+        observe_cmd = [Radio.COMMANDS["R_REGISTER"] | Radio.REGISTERS["OBSERVE_TX"], 0]
+        tx_empty = 1 << Radio.BIT_MNEMONIC["TX_EMPTY"]
+        deadline = time.time() + timeout
+
+        with self._lock:
+            ce_state = self._ce.value()
+            config = self.read_config()
+            self._ce.lo()
+            self._xfer([Radio.COMMANDS["FLUSH_TX"]])
+            self._xfer([status_cmd, tx_ds | max_rt])
+            self.write_config_bit(Radio.BIT_MNEMONIC["PRIM_RX"], 0)
+            self._ce.hi()
+
+            try:
+                loaded = 0  # payloads written to the FIFO
+                done = 0  # payloads with a result
+                status = self._xfer(nop)[0]
+                while done < count and time.time() < deadline:
+                    if loaded < count and loaded - done < Radio.TX_PIPELINE_DEPTH and not status & tx_full:
+                        status = self._xfer(frames[loaded])[0]
+                        loaded += 1
+                        self._tx_fifo_high_water = max(self._tx_fifo_high_water, loaded - done)
+                    else:
+                        status = self._xfer(nop)[0]
+
+                    if status & (tx_ds | max_rt):
+                        in_fifo = loaded - done
+                        transfers = list()
+                        if status & max_rt:
+                            # flush before clearing MAX_RT, with CE high clearing it alone retransmits
+                            transfers.append([Radio.COMMANDS["FLUSH_TX"]])
+                        transfers.append([status_cmd, status & (tx_ds | max_rt)])
+                        transfers.append(observe_cmd)
+                        # TX_DS alone with two loaded is the one case STATUS can not settle
+                        read_fifo = status & tx_ds and not status & max_rt and in_fifo > 1
+                        if read_fifo:
+                            transfers.append(fifo_cmd)
+                        replies = self._xfer_many(transfers)
+                        observe_tx = replies[-2 if read_fifo else -1][1]
+                        self._retry_histogram[(observe_tx >> Radio.BIT_MNEMONIC["ARC_CNT"]) & 0x0f] += 1
+                        self._plos_cnt = (observe_tx >> Radio.BIT_MNEMONIC["PLOS_CNT"]) & 0x0f
+                        if status & tx_ds:
+                            self._tx_ds_count += 1
+                            if status & max_rt or (read_fifo and not replies[-1][1] & tx_empty):
+                                sent = in_fifo - 1  # one left, or the failed payload was still in the FIFO
+                            else:
+                                sent = in_fifo
+                            for i in range(done, done + sent):
+                                results[i] = True
+                            done += sent
+                        if status & max_rt:
+                            # the oldest payload gave up, the ones flushed behind it get reloaded
+                            self._max_rt_count += 1
+                            done += 1
+                            loaded = done
+                        status &= ~(tx_ds | max_rt | tx_full)
+            finally:
+                # back to the mode the radio was in, so a receiving radio keeps receiving
+                self._ce.lo()
+                self.write_register(Radio.REGISTERS["CONFIG"], config)
+                if ce_state:
+                    self._ce.hi()
+            acked = results.count(True)
+            self._tx_acked += acked
+            self._tx_failed += count - acked
+        return results
 
     def is_txing(self):
         """
@@ -275,19 +725,144 @@ class Radio(object):
         :param _len: length of data to be read
         :return: list of data
         """
-        data = self._spi.xfer2([Radio.COMMANDS["R_RX_PAYLOAD"]] + [0]*_len)
+        data = self._xfer([Radio.COMMANDS["R_RX_PAYLOAD"]] + [0]*_len)
         self.write_register(Radio.REGISTERS["STATUS"], self.read_status() | 1<<6) # write a 1 in pos 6 to clear FIFO
         return data[1:]
 
     def set_payload_size(self, payload_sz, pipe=0):
         """
-        set the payload size in range [0, 32]
+        set the static payload size in range [0, 32]
         :param payload_sz: payload size
-        :param pipe: pipe number
+        :param pipe: pipe number in range [0, 5], pipe 0 also sets the TX payload size
         :return:
         """
+        if payload_sz < 0 or payload_sz > Radio.PAYLOAD_MAX:
+            raise ValueError("Payload size must be in range [0-%d]." % (Radio.PAYLOAD_MAX))
+        Radio._check_pipe(pipe)
+        self.write_register(Radio.RX_PW_REGISTERS[pipe], payload_sz)
+        self._rx_widths[pipe] = payload_sz
         if pipe == 0:
-            self.write_register(Radio.REGISTERS["RX_PW_P0"], payload_sz)
+            self._payload_size = payload_sz
+
+    def get_payload_size(self, pipe=0):
+        """
+        :param pipe: pipe number in range [0, 5]
+        :return: the static payload size of the pipe, None if it uses dynamic payloads
+        """
+        Radio._check_pipe(pipe)
+        if self._dynamic_pipes & (1 << pipe):
+            return None
+        return self._rx_widths[pipe]
+
+    @staticmethod
+    def _check_pipe(pipe):
+        if pipe < 0 or pipe >= Radio.PIPES:
+            raise ValueError("Pipe must be in range [0-%d]." % (Radio.PIPES - 1))
+
+    def enable_dynamic_payloads(self, pipes=(0, 1, 2, 3, 4, 5)):
+        """
+        turns on dynamic payload length (DYNPD/FEATURE) for the given pipes, received payloads
+        are read at their actual length via R_RX_PL_WID and sends are not padded when pipe 0
+        is dynamic. Auto acknowledge is turned on for these pipes, the chip requires it.
+        :param pipes: pipe numbers in range [0, 5], every other pipe goes back to static payloads
+        :return:
+        """
+        mask = 0
+        for pipe in pipes:
+            Radio._check_pipe(pipe)
+            mask |= 1 << pipe
+        feature = self.read_register(Radio.REGISTERS["FEATURE"])
+        if mask:
+            self.write_register(Radio.REGISTERS["EN_AA"], self.read_register(Radio.REGISTERS["EN_AA"]) | mask)
+            self.write_register(Radio.REGISTERS["FEATURE"], feature | 1 << Radio.BIT_MNEMONIC["EN_DPL"])
+        else:
+            self.write_register(Radio.REGISTERS["FEATURE"], feature & ~(1 << Radio.BIT_MNEMONIC["EN_DPL"]))
+        self.write_register(Radio.REGISTERS["DYNPD"], mask)
+        self._dynamic_pipes = mask
+
+    def disable_dynamic_payloads(self):
+        """
+        goes back to the static payload sizes set by set_payload_size()
+        :return:
+        """
+        self.enable_dynamic_payloads(())
+
+    def set_address_width(self, width):
+        """
+        sets the RX/TX address width
+        :param width: the address width in bytes, in range [3, 5]
+        :return:
+        """
+        if width < 3 or width > 5:
+            raise ValueError("Address width must be in range [3-5].")
+        self.write_register(Radio.REGISTERS["SETUP_ADDRW"], width - 2)
+
+    def get_address_width(self):
+        """
+        :return: the RX/TX address width in bytes
+        """
+        return (self.read_register(Radio.REGISTERS["SETUP_ADDRW"]) & 0x03) + 2
+
+    def _write_address(self, register, address):
+        """
+        writes a multi byte address register, least significant byte first
+        :param register: the address register
+        :param address: the address, an int or a list/bytearray of bytes least significant first
+        :return:
+        """
+        width = self.get_address_width()
+        if isinstance(address, (int, long)):
+            data = [(address >> (8 * i)) & 0xff for i in range(width)]
+        else:
+            data = list(bytearray(address))
+            if len(data) != width:
+                raise ValueError("Address must be %d bytes long." % (width))
+        self._xfer([Radio.COMMANDS["W_REGISTER"] | register] + data)
+
+    def set_rx_address(self, pipe, address):
+        """
+        sets the address a pipe listens on. Pipes 2-5 share the upper bytes of pipe 1 and only
+        take their least significant byte from address
+        :param pipe: pipe number in range [0, 5]
+        :param address: an int or a list/bytearray of bytes least significant first
+        :return:
+        """
+        Radio._check_pipe(pipe)
+        if pipe < 2:
+            self._write_address(Radio.RX_ADDR_REGISTERS[pipe], address)
+        else:
+            lsb = address & 0xff if isinstance(address, (int, long)) else bytearray(address)[0]
+            self.write_register(Radio.RX_ADDR_REGISTERS[pipe], lsb)
+
+    def set_tx_address(self, address):
+        """
+        sets the address sent to, pipe 0 must listen on it as well for auto acknowledge
+        :param address: an int or a list/bytearray of bytes least significant first
+        :return:
+        """
+        self._write_address(Radio.REGISTERS["TX_ADDDR"], address)
+
+    def open_rx_pipe(self, pipe, address, payload_sz=None):
+        """
+        enables a pipe on an address
+        :param pipe: pipe number in range [0, 5]
+        :param address: see set_rx_address()
+        :param payload_sz: the static payload size, None leaves it as it is
+        :return:
+        """
+        self.set_rx_address(pipe, address)
+        if payload_sz is not None:
+            self.set_payload_size(payload_sz, pipe)
+        self.write_register(Radio.REGISTERS["EN_RXADDR"], self.read_register(Radio.REGISTERS["EN_RXADDR"]) | 1 << pipe)
+
+    def close_rx_pipe(self, pipe):
+        """
+        disables a pipe
+        :param pipe: pipe number in range [0, 5]
+        :return:
+        """
+        Radio._check_pipe(pipe)
+        self.write_register(Radio.REGISTERS["EN_RXADDR"], self.read_register(Radio.REGISTERS["EN_RXADDR"]) & ~(1 << pipe))
 
     def setup_basic(self):
         """
@@ -307,8 +882,7 @@ class Radio(object):
         flushes all FIFOs
         :return:
         """
-        self._spi.xfer2([Radio.COMMANDS["FLUSH_RX"]])
-        self._spi.xfer2([Radio.COMMANDS["FLUSH_TX"]])
+        self._xfer_many([[Radio.COMMANDS["FLUSH_RX"]], [Radio.COMMANDS["FLUSH_TX"]]])
 
 
     def write_str(self, _str):
@@ -326,14 +900,21 @@ class Radio(object):
 
     def read_str(self):
         """
-        read a string as a payload
+        read a string as a payload, payloads already drained by the IRQ callback come first
         :return:
         """
+        packet = self.recv_nowait()
+        if packet is not None:
+            return str(packet[2]).replace("\0", "")
         if not self.is_data_ready():
             return ""
         else:
             _str = ""
-            data = self.read_data(32)
+            width = self._rx_width((self.read_status() >> Radio.BIT_MNEMONIC["RX_P_NO"]) & 0x07)
+            if width is None:
+                self._xfer([Radio.COMMANDS["FLUSH_RX"]])
+                return ""
+            data = self.read_data(width)
             for d in data:
                 if d != 0:
                     _str += chr(d)
@@ -394,3 +975,265 @@ class Radio(object):
         print "--------------END CONFIG--------------"
 
 
+
+
+class RadioPoller(object):
+    """
+        A select() loop that services several radios, sockets and anything
+        else with a fileno() from one thread. Received payloads are handed to
+        a callback as the IRQ callback queues them, and blocking SPI work like
+        Radio.send_many() runs on worker threads with the result delivered
+        back on the loop thread.
+
+        This is the Python 2 stand-in for an asyncio radio interface: there
+        is no asyncio or async def here, so the loop is a plain select() with
+        callbacks rather than coroutines. Its limits follow from that:
+        callbacks run on the loop thread and must not block it, there are no
+        awaitable send()/recv() or async iteration, select() only takes
+        descriptors below FD_SETSIZE (1024), and SPI work still needs worker
+        threads since spidev has no non-blocking calls. Under an asyncio
+        loop, add_reader(radio.fileno(), ...) with Radio.recv_nowait() and
+        run_in_executor(None, radio.send_many, payloads) does the same job.
+
+        Examples
+        @code
+            poller = RF24.RadioPoller()
+            poller.add_radio(radio_1, lambda radio, pipe, timestamp, payload: forward(payload))
+            poller.add_radio(radio_2, on_packet)
+            poller.add_reader(server_socket, on_connection)
+            poller.send(radio_1, ["hello"], callback=lambda results, error: log(results))
+            poller.run()  # until poller.stop()
+        @endcode
+    """
+
+    def __init__(self, workers=1):
+        """
+        @param workers: the number of threads running submitted jobs
+        """
+        if workers < 1:
+            raise ValueError("There must be at least one worker.")
+        self._readers = dict()  # fd -> (source, callback, is_radio)
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._jobs = deque()
+        self._jobs_cond = threading.Condition()
+        self._finished = deque()  # (callback, result, error) waiting to run on the loop thread
+        self._running = False
+        self._closed = False
+        self._workers = list()
+        for i in range(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def add_radio(self, radio, callback):
+        """
+        calls callback(radio, pipe, timestamp, payload) on the loop thread for every payload the radio receives
+        @param radio: an RF24.Radio
+        @param callback: the function to call
+        """
+        self._readers[radio.fileno()] = (radio, callback, True)
+
+    def add_reader(self, source, callback):
+        """
+        calls callback(source) on the loop thread whenever source is readable
+        @param source: a socket, file or anything else with a fileno()
+        @param callback: the function to call
+        """
+        self._readers[source.fileno()] = (source, callback, False)
+
+    def remove(self, source):
+        """
+        stops watching a radio or reader
+        @param source: the radio or reader passed to add_radio()/add_reader()
+        """
+        self._readers.pop(source.fileno(), None)
+
+    def submit(self, function, args=(), callback=None):
+        """
+        runs function(*args) on a worker thread
+        @param function: the blocking function to run
+        @param args: its arguments
+        @param callback: called as callback(result, error) on the loop thread, error is None on success
+        """
+        with self._jobs_cond:
+            if self._closed:
+                raise ValueError("The poller is closed.")
+            self._jobs.append((function, args, callback))
+            self._jobs_cond.notify()
+
+    def send(self, radio, payloads, callback=None, timeout=1.0):
+        """
+        Radio.send_many() on a worker thread
+        @param radio: the radio to send with
+        @param payloads: the payloads for send_many()
+        @param callback: called as callback(results, error) on the loop thread
+        @param timeout: the send_many() timeout
+        """
+        self.submit(radio.send_many, (payloads, timeout), callback)
+
+    def _work(self):
+        while True:
+            with self._jobs_cond:
+                while not self._jobs and not self._closed:
+                    self._jobs_cond.wait()
+                if not self._jobs:
+                    return
+                function, args, callback = self._jobs.popleft()
+            result, error = None, None
+            try:
+                result = function(*args)
+            except Exception as e:
+                error = e
+            if callback is not None:
+                self._finished.append((callback, result, error))
+                self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wakeup[1], b"\0")
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def poll(self, timeout=None):
+        """
+        waits for one round of events and runs their callbacks
+        @param timeout: seconds to wait, None waits forever
+        @return: the number of callbacks run
+        """
+        fds = list(self._readers.keys()) + [self._wakeup[0]]
+        try:
+            readable = select.select(fds, [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return 0
+            raise
+
+        handled = 0
+        for fd in readable:
+            if fd == self._wakeup[0]:
+                try:
+                    while os.read(fd, 64):
+                        pass
+                except OSError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+                continue
+            if fd not in self._readers:
+                continue  # removed by an earlier callback this round
+            source, callback, is_radio = self._readers[fd]
+            if is_radio:
+                packet = source.recv_nowait()
+                while packet is not None:
+                    callback(source, *packet)
+                    handled += 1
+                    packet = source.recv_nowait()
+            else:
+                callback(source)
+                handled += 1
+
+        while self._finished:
+            callback, result, error = self._finished.popleft()
+            callback(result, error)
+            handled += 1
+        return handled
+
+    def run(self):
+        """
+        runs poll() until stop() is called
+        """
+        self._running = True
+        while self._running:
+            self.poll()
+
+    def stop(self):
+        """
+        makes run() return, safe to call from any thread or callback
+        """
+        self._running = False
+        self._wake()
+
+    def close(self):
+        """
+        stops the worker threads once the jobs already submitted are done and closes the wakeup pipe
+        """
+        self.stop()
+        with self._jobs_cond:
+            self._closed = True
+            self._jobs_cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+        for fd in self._wakeup:
+            os.close(fd)
+
+
+class ChannelSurvey(object):
+    """
+        The result of Radio.survey(), a count of carrier detect hits per
+        channel out of the same number of samples each.
+
+        Examples
+        @code
+            survey = radio.survey(samples=64)
+            radio.set_channel(survey.recommended())
+            survey.occupancy(104)  # fraction of samples a carrier was seen on channel 104
+        @endcode
+    """
+
+    def __init__(self, channels, samples):
+        """
+        @param channels: the channels swept
+        @param samples: samples taken per channel
+        """
+        self.channels = array('B', channels)
+        self.hits = array('H', [0]) * len(self.channels)
+        self.samples = samples
+        self._index = dict((ch, i) for i, ch in enumerate(self.channels))
+
+    def occupancy(self, channel):
+        """
+        @param channel: a channel in the survey
+        @return: the fraction of samples in [0, 1] that saw a carrier on channel
+        """
+        return float(self.hits[self._index[channel]]) / self.samples
+
+    def congestion(self, channel, spread=1):
+        """
+        carrier hits on channel and its neighbours, a 2Mbps link is 2MHz wide and
+        a WiFi channel covers ~20 RF24 channels, so neighbours count against it too
+        @param channel: a channel in the survey
+        @param spread: neighbouring channels each side to include, at half weight
+        @return: the weighted hit count
+        """
+        total = float(self.hits[self._index[channel]])
+        for offset in range(1, spread + 1):
+            for neighbour in (channel - offset, channel + offset):
+                if neighbour in self._index:
+                    total += self.hits[self._index[neighbour]] * 0.5
+        return total
+
+    def recommended(self, spread=1, exclude=()):
+        """
+        @param spread: see congestion()
+        @param exclude: channels not to recommend, e.g. ones other links use
+        @return: the least congested channel, None if every channel is excluded. Ties go to the
+                 highest channel (above most WiFi), whatever order the channels were swept in
+        """
+        best = None
+        best_score = None
+        for ch in self.channels:
+            if ch in exclude:
+                continue
+            score = self.congestion(ch, spread)
+            if best_score is None or score < best_score or (score == best_score and ch > best):
+                best, best_score = ch, score
+        return best
+
+    def as_dict(self):
+        """
+        @return: {channel: occupancy} for every channel swept
+        """
+        return dict((ch, self.occupancy(ch)) for ch in self.channels)
@@ -0,0 +1,403 @@
+"""
+    @file RF24Transport
+    @module RPiComponents.RF24Transport
+    @author Jacob Calvert <jacob+info@jacobncalvert.com>
+    @date October, 2015
+    @brief Large message transport over NRF24L01+ payloads
+
+    This module splits arbitrary binary messages into 32 byte radio
+    payloads and puts them back together on the other side, with a
+    sliding window and selective retransmission of lost fragments.
+"""
+import os
+import random
+import struct
+import threading
+import time
+from array import array
+from collections import deque
+
+
+class RadioTransport(object):
+    """
+        Sends and receives messages of any length over an RF24.Radio (or
+        anything with the same send_many()/start_rx()/recv() methods, like
+        SimulatedLink).
+
+        Every payload starts with a 1 byte type/message id, DATA payloads add
+        a 16 bit fragment number and a length byte and carry 28 bytes of data.
+        The sender pushes the unacknowledged fragments of its window in one
+        burst then POLLs; the receiver answers with an ACK holding the first
+        fragment it is missing and a bitmap of what it has after that, and
+        only the gaps are sent again. A POLL that gets no answer is sent
+        again on its own.
+
+        POLLs carry a random session nonce picked per RadioTransport. A
+        complete message is only delivered when a POLL arrives for it, and
+        is then tied to that nonce, so a restarted sender reusing the same
+        5 bit message id is never acknowledged for the message before it.
+        recv() keeps answering POLLs for linger seconds after it delivers,
+        in case the sender missed the final ACK.
+
+        Examples
+        @code
+            radio = RF24.Radio(0, 0, 26, 19)
+            radio.setup_basic()
+            transport = RadioTransport(radio)
+            transport.send(open("firmware.bin", "rb").read())
+            message = other_transport.recv(timeout=5)  # on the receiving side
+        @endcode
+    """
+
+    TYPE_DATA = 0
+    TYPE_POLL = 1
+    TYPE_ACK = 2
+
+    FLAG_LAST = 0x20  # set on the final fragment of a message
+    MSG_ID_MASK = 0x1f
+
+    PAYLOAD_SIZE = 32
+    DATA_HEADER = struct.Struct(">BHB")  # type/flags/msg id, fragment number, data length
+    POLL_HEADER = struct.Struct(">BI")  # type/msg id, session nonce
+    ACK_HEADER = struct.Struct(">BH")  # type/msg id, first missing fragment
+    FRAGMENT_DATA = PAYLOAD_SIZE - DATA_HEADER.size
+    BITMAP_BYTES = PAYLOAD_SIZE - ACK_HEADER.size
+    WINDOW_MAX = BITMAP_BYTES * 8
+    MAX_FRAGMENTS = 0xffff
+    RX_STALE_TIMEOUT = 1.0  # seconds without a fragment before an unacknowledged partial message is thrown away
+
+    def __init__(self, radio, window=64, ack_timeout=0.05, max_rounds=50, linger=0.2):
+        """
+        @param radio: the RF24.Radio (or SimulatedLink) to run over
+        @param window: the most fragments sent before asking for an ACK, at most RadioTransport.WINDOW_MAX
+        @param ack_timeout: seconds to wait for an ACK after a POLL
+        @param max_rounds: the most rounds without any progress before send() gives up
+        @param linger: seconds recv() keeps answering POLLs for the message it just delivered
+        """
+        if window < 1 or window > RadioTransport.WINDOW_MAX:
+            raise ValueError("Window must be in range [1-%d]." % (RadioTransport.WINDOW_MAX))
+        self._radio = radio
+        self._window = window
+        self._ack_timeout = ack_timeout
+        self._max_rounds = max_rounds
+        self._linger = linger
+        self._next_msg_id = 0
+        self._session = struct.unpack(">I", os.urandom(4))[0]
+
+        # receive side state for the message being reassembled
+        self._rx_msg_id = None
+        self._rx_fragments = dict()
+        self._rx_count = None  # known once the LAST fragment arrives
+        self._rx_nonce = None  # the session of the first POLL seen for it
+        self._rx_last = 0.0  # when its last fragment arrived
+        self._rx_done = None  # (msg id, session) of the last message delivered, re-acknowledged if polled again
+        self._rx_messages = deque()
+
+        self._stats_lock = threading.Lock()
+        self._messages_sent = 0
+        self._messages_failed = 0
+        self._messages_received = 0
+        self._bytes_sent = 0
+        self._bytes_received = 0
+        self._fragments_sent = 0
+        self._retransmissions = 0
+        self._polls = 0
+        self._send_time = 0.0
+
+    @staticmethod
+    def _first_byte(kind, msg_id, flags=0):
+        return (kind << 6) | flags | (msg_id & RadioTransport.MSG_ID_MASK)
+
+    def _fragment(self, view, msg_id, seq, count):
+        start = seq * RadioTransport.FRAGMENT_DATA
+        chunk = view[start:start + RadioTransport.FRAGMENT_DATA]
+        flags = RadioTransport.FLAG_LAST if seq == count - 1 else 0
+        frame = bytearray(RadioTransport.PAYLOAD_SIZE)
+        RadioTransport.DATA_HEADER.pack_into(frame, 0, RadioTransport._first_byte(RadioTransport.TYPE_DATA, msg_id, flags), seq, len(chunk))
+        frame[RadioTransport.DATA_HEADER.size:RadioTransport.DATA_HEADER.size + len(chunk)] = chunk
+        return frame
+
+    def _poll(self, msg_id):
+        """
+        asks the receiver which fragments it holds
+        @return: (first missing fragment, bitmap bytearray) or None if no ACK came back
+        """
+        poll = bytearray(RadioTransport.PAYLOAD_SIZE)
+        RadioTransport.POLL_HEADER.pack_into(poll, 0, RadioTransport._first_byte(RadioTransport.TYPE_POLL, msg_id), self._session)
+        with self._stats_lock:
+            self._polls += 1
+        if not self._radio.send_many([poll])[0]:
+            return None
+        self._radio.start_rx()
+        deadline = time.time() + self._ack_timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            packet = self._radio.recv(remaining)
+            if packet is None:
+                return None
+            payload = packet[2]
+            first, base = RadioTransport.ACK_HEADER.unpack_from(bytes(payload[:RadioTransport.ACK_HEADER.size]))
+            if first >> 6 == RadioTransport.TYPE_ACK and first & RadioTransport.MSG_ID_MASK == msg_id:
+                return base, payload[RadioTransport.ACK_HEADER.size:]
+
+    def send(self, message):
+        """
+        sends a message, blocking until the receiver has all of it
+        @param message: a str, bytes, bytearray or memoryview
+        @return: True once every fragment is acknowledged, False if the receiver stopped answering
+        """
+        view = memoryview(message)
+        count = max(1, (len(view) + RadioTransport.FRAGMENT_DATA - 1) // RadioTransport.FRAGMENT_DATA)
+        if count > RadioTransport.MAX_FRAGMENTS:
+            raise ValueError("Message is too long, the limit is %d bytes." % (RadioTransport.MAX_FRAGMENTS * RadioTransport.FRAGMENT_DATA))
+        msg_id = self._next_msg_id
+        self._next_msg_id = (self._next_msg_id + 1) & RadioTransport.MSG_ID_MASK
+
+        start = time.time()
+        acked = bytearray(count)
+        sent_count = array('H', [0]) * count
+        base = 0
+        idle_rounds = 0
+        burst = True
+        while base < count:
+            window_end = min(count, base + self._window)
+            if burst:
+                seqs = [seq for seq in range(base, window_end) if not acked[seq]]
+                self._radio.send_many([self._fragment(view, msg_id, seq, count) for seq in seqs])
+                retransmissions = 0
+                for seq in seqs:
+                    if sent_count[seq]:
+                        retransmissions += 1
+                    sent_count[seq] += 1
+                with self._stats_lock:
+                    self._retransmissions += retransmissions
+                    self._fragments_sent += len(seqs)
+
+            ack = self._poll(msg_id)
+            if ack is None:
+                idle_rounds += 1
+                if idle_rounds > self._max_rounds:
+                    return self._send_done(start, False, 0)
+                burst = False  # the POLL or its ACK was lost, ask again before resending anything
+                continue
+
+            ack_base, bitmap = ack
+            progress = False
+            for seq in range(base, min(ack_base, count)):
+                if not acked[seq]:
+                    acked[seq] = 1
+                    progress = True
+            for seq in range(max(base, ack_base), window_end):
+                i = seq - ack_base
+                if i < len(bitmap) * 8 and bitmap[i >> 3] & (1 << (i & 7)) and not acked[seq]:
+                    acked[seq] = 1
+                    progress = True
+            idle_rounds = 0 if progress else idle_rounds + 1
+            if idle_rounds > self._max_rounds:
+                return self._send_done(start, False, 0)
+            while base < count and acked[base]:
+                base += 1
+            burst = True
+
+        self._radio.start_rx()
+        return self._send_done(start, True, len(view))
+
+    def _send_done(self, start, delivered, length):
+        """
+        counts a finished send()
+        @return: delivered, for send() to return
+        """
+        with self._stats_lock:
+            if delivered:
+                self._messages_sent += 1
+                self._bytes_sent += length
+            else:
+                self._messages_failed += 1
+            self._send_time += time.time() - start
+        return delivered
+
+    def _rx_reset(self, msg_id=None):
+        self._rx_msg_id = msg_id
+        self._rx_fragments = dict()
+        self._rx_count = None
+        self._rx_nonce = None
+
+    def _ack(self, msg_id, everything=False):
+        ack = bytearray(RadioTransport.PAYLOAD_SIZE)
+        if everything:
+            base = RadioTransport.MAX_FRAGMENTS
+        elif msg_id != self._rx_msg_id:
+            base = 0  # nothing of this message has arrived
+        else:
+            base = 0
+            while base in self._rx_fragments:
+                base += 1
+            for seq in self._rx_fragments:
+                i = seq - base
+                if 0 < i < RadioTransport.WINDOW_MAX:
+                    ack[RadioTransport.ACK_HEADER.size + (i >> 3)] |= 1 << (i & 7)
+        RadioTransport.ACK_HEADER.pack_into(ack, 0, RadioTransport._first_byte(RadioTransport.TYPE_ACK, msg_id), base)
+        self._radio.send_many([ack])
+        self._radio.start_rx()
+
+    def _handle_poll(self, msg_id, nonce):
+        if self._rx_done == (msg_id, nonce):
+            if self._rx_msg_id == msg_id:
+                self._rx_reset()  # retransmissions of the message already delivered
+            self._ack(msg_id, everything=True)
+            return
+        if self._rx_msg_id == msg_id:
+            if self._rx_nonce is not None and self._rx_nonce != nonce:
+                self._rx_reset()  # left over from a sender that restarted
+            else:
+                self._rx_nonce = nonce
+        if self._rx_msg_id == msg_id and self._rx_count is not None and len(self._rx_fragments) >= self._rx_count:
+            message = b"".join([self._rx_fragments[i] for i in range(self._rx_count)])
+            self._rx_done = (msg_id, nonce)
+            self._rx_reset()
+            with self._stats_lock:
+                self._messages_received += 1
+                self._bytes_received += len(message)
+            self._rx_messages.append(message)
+            self._ack(msg_id, everything=True)
+            return
+        self._ack(msg_id)
+
+    def _handle(self, payload):
+        first = payload[0]
+        kind = first >> 6
+        msg_id = first & RadioTransport.MSG_ID_MASK
+        if kind == RadioTransport.TYPE_POLL:
+            self._handle_poll(msg_id, RadioTransport.POLL_HEADER.unpack_from(bytes(payload[:RadioTransport.POLL_HEADER.size]))[1])
+        elif kind == RadioTransport.TYPE_DATA:
+            now = time.time()
+            if msg_id != self._rx_msg_id:
+                self._rx_reset(msg_id)
+            elif self._rx_nonce is None and now - self._rx_last > RadioTransport.RX_STALE_TIMEOUT:
+                self._rx_reset(msg_id)  # never acknowledged, likely the start of a sender that died
+            self._rx_last = now
+            flags_seq_len = RadioTransport.DATA_HEADER.unpack_from(bytes(payload[:RadioTransport.DATA_HEADER.size]))
+            seq, length = flags_seq_len[1], flags_seq_len[2]
+            self._rx_fragments[seq] = bytes(payload[RadioTransport.DATA_HEADER.size:RadioTransport.DATA_HEADER.size + length])
+            if first & RadioTransport.FLAG_LAST:
+                self._rx_count = seq + 1
+
+    def _is_repoll(self, payload):
+        """
+        @return: True if payload is a POLL for the message delivered last
+        """
+        if payload[0] >> 6 != RadioTransport.TYPE_POLL or self._rx_done is None:
+            return False
+        first, nonce = RadioTransport.POLL_HEADER.unpack_from(bytes(payload[:RadioTransport.POLL_HEADER.size]))
+        return (first & RadioTransport.MSG_ID_MASK, nonce) == self._rx_done
+
+    def recv(self, timeout=None):
+        """
+        receives the next whole message, answering the sender's POLLs along the way,
+        then answers POLLs for it for up to linger seconds in case the final ACK was lost
+        @param timeout: seconds to wait, None waits forever
+        @return: the message as bytes, or None on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._rx_messages:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            packet = self._radio.recv(remaining)
+            if packet is not None:
+                self._handle(bytearray(packet[2]))
+
+        linger_until = time.time() + self._linger
+        while len(self._rx_messages) == 1:
+            remaining = linger_until - time.time()
+            if remaining <= 0:
+                break
+            packet = self._radio.recv(remaining)
+            if packet is None:
+                break
+            payload = bytearray(packet[2])
+            repoll = self._is_repoll(payload)
+            self._handle(payload)
+            if not repoll:
+                break  # the sender has moved on, so it had the final ACK
+            linger_until = time.time() + self._linger
+        return self._rx_messages.popleft()
+
+    def stats(self):
+        """
+        gets the transport counters
+        @return: a dict of message, byte, fragment, retransmission and poll counts, and send goodput in bytes/s
+        """
+        with self._stats_lock:
+            return dict(messages_sent=self._messages_sent,
+                        messages_failed=self._messages_failed,
+                        messages_received=self._messages_received,
+                        bytes_sent=self._bytes_sent,
+                        bytes_received=self._bytes_received,
+                        fragments_sent=self._fragments_sent,
+                        retransmissions=self._retransmissions,
+                        polls=self._polls,
+                        goodput=self._bytes_sent / self._send_time if self._send_time else 0.0)
+
+
+class SimulatedLink(object):
+    """
+        One end of an in-memory radio link with the send_many()/start_rx()/recv()
+        methods RadioTransport uses, for trying the transport without hardware.
+        Payloads are dropped with probability loss, like a packet that ran out
+        of retries.
+
+        Examples
+        @code
+            a, b = SimulatedLink.pair(loss=0.2)
+            sender, receiver = RadioTransport(a), RadioTransport(b)
+        @endcode
+    """
+
+    def __init__(self, loss=0.0, rng=None):
+        self._loss = loss
+        self._rng = rng or random.Random()
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._peer = None
+
+    @staticmethod
+    def pair(loss=0.0, seed=None):
+        """
+        builds two connected ends
+        @param loss: the probability a payload is lost, in each direction
+        @param seed: seeds the loss pattern so runs repeat
+        @return: (end_a, end_b)
+        """
+        rng = random.Random(seed)
+        a = SimulatedLink(loss, rng)
+        b = SimulatedLink(loss, rng)
+        a._peer = b
+        b._peer = a
+        return a, b
+
+    def send_many(self, payloads):
+        results = list()
+        for payload in payloads:
+            delivered = self._rng.random() >= self._loss
+            if delivered:
+                with self._peer._cond:
+                    self._peer._queue.append((0, time.time(), bytearray(payload)))
+                    self._peer._cond.notify()
+            results.append(delivered)
+        return results
+
+    def start_rx(self):
+        pass
+
+    def recv(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._queue:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._queue.popleft()
@@ -0,0 +1,265 @@
+"""
+    @file SPIBus
+    @module RPiComponents.SPIBus
+    @author Jacob Calvert <jacob+info@jacobncalvert.com>
+    @date October, 2015
+    @brief Shared SPI bus access with batched transfers
+
+    This module wraps spidev so several devices and threads can share an
+    SPI bus safely, and so a run of small transfers goes to the kernel as
+    one SPI_IOC_MESSAGE ioctl instead of one syscall each.
+"""
+import ctypes
+import fcntl
+import struct
+import threading
+import time
+
+try:
+    import spidev
+except ImportError:
+    spidev = None  # only buses given an _spi work without it
+
+
+class SPIBus(object):
+    """
+        One SPI device (bus and chip select). Every transfer holds a lock
+        shared by all SPIBus objects on the same bus number, and lock() can
+        be held across several transfers that must not be split up.
+
+        xfer_many() packs its transfers into spi_ioc_transfer segments and
+        submits them with a single ioctl, releasing chip select between
+        segments, so N transfers cost one syscall. Without a file descriptor
+        to ioctl (spidev before 3.0) it falls back to one xfer2() per
+        transfer.
+
+        Examples
+        @code
+            spi = SPIBus(0, 0, max_speed_hz=1000000)
+            status = spi.xfer([0xFF])
+            replies = spi.xfer_many([[1, 0x80, 0], [1, 0x90, 0], [1, 0xA0, 0]])  # one ioctl
+            scan = spi.message([[1, 0x80, 0], [1, 0x90, 0]])  # packed once
+            replies = scan.submit()  # and sent as often as needed
+            with spi.lock():
+                ...  # a sequence of transfers no other thread gets between
+            adc = ADC.MCP3008(_spi=spi)
+        @endcode
+    """
+
+    """
+        struct spi_ioc_transfer from linux/spi/spidev.h: tx_buf, rx_buf, len, speed_hz,
+        delay_usecs, bits_per_word, cs_change, tx_nbits, rx_nbits, word_delay_usecs, pad
+    """
+    TRANSFER = struct.Struct("=QQIIHBBBBBB")
+    SEGMENTS_MAX = (1 << 14) // TRANSFER.size - 1  # the ioctl size field is 14 bits
+    MESSAGE_BYTES_MAX = 4096  # spidev's default bufsiz, the most bytes one message may move
+
+    _bus_locks = dict()  # bus number -> RLock shared by every SPIBus on that bus
+    _bus_locks_lock = threading.Lock()
+
+    def __init__(self, bus=0, port=0, max_speed_hz=None, mode=None, _spi=None, _ioctl=fcntl.ioctl):
+        """
+        @param bus: the SPI bus number
+        @param port: the chip select on the bus
+        @param max_speed_hz: the clock rate, None leaves the device default
+        @param mode: the SPI mode [0-3], None leaves the device default
+        @param _spi: the spidev.SpiDev (or sim.spi.SpiDev) to use if not opening bus/port
+        @param _ioctl: the ioctl function batched messages are submitted with, None turns batching off,
+                       a device with its own ioctl() (like sim.spi.SpiDev) uses that by default
+        """
+        if _spi is None:
+            if spidev is None:
+                raise ImportError("spidev is needed to open SPI bus %d." % (bus))
+            _spi = spidev.SpiDev()
+            _spi.open(bus, port)
+        self._spi = _spi
+        if max_speed_hz is not None:
+            self._spi.max_speed_hz = max_speed_hz
+        if mode is not None:
+            self._spi.mode = mode
+        self._bus = bus
+        self._port = port
+        if _ioctl is fcntl.ioctl and hasattr(self._spi, "ioctl"):
+            _ioctl = self._spi.ioctl
+        self._ioctl = _ioctl
+        try:
+            self._fd = self._spi.fileno() if _ioctl is not None else None
+        except AttributeError:
+            self._fd = None  # spidev before 3.0 has no fileno()
+        self._lock = SPIBus._bus_lock(bus)
+        self._transfers = 0
+        self._syscalls = 0
+        self._bytes = 0
+
+    @staticmethod
+    def _bus_lock(bus):
+        with SPIBus._bus_locks_lock:
+            if bus not in SPIBus._bus_locks:
+                SPIBus._bus_locks[bus] = threading.RLock()
+            return SPIBus._bus_locks[bus]
+
+    def bus(self):
+        """
+        gets the SPI bus number
+        """
+        return self._bus
+
+    def port(self):
+        """
+        gets the chip select on the bus
+        """
+        return self._port
+
+    def lock(self):
+        """
+        the bus lock, hold it with a with statement across transfers that must go back to back
+        """
+        return self._lock
+
+    def batching(self):
+        """
+        @return: T/F indicating xfer_many() submits one ioctl per batch
+        """
+        return self._fd is not None
+
+    def xfer(self, data):
+        """
+        one transfer with chip select held for all of it
+        @param data: a list of bytes to send
+        @return: the list of bytes received
+        """
+        with self._lock:
+            self._transfers += 1
+            self._syscalls += 1
+            self._bytes += len(data)
+            return self._spi.xfer2(list(data))
+
+    def xfer_many(self, transfers):
+        """
+        several transfers in order, chip select released between them
+        @param transfers: a list of transfers, each a list of bytes to send
+        @return: a list of the lists of bytes received, one per transfer
+        """
+        if self._fd is None or len(transfers) < 2:
+            return self._xfer_each(transfers)
+        results = list()
+        with self._lock:
+            for message in self._split(transfers):
+                results.extend(message.submit())
+        return results
+
+    def message(self, transfers):
+        """
+        prepares transfers as a batch that can be submitted over and over
+        without being packed again, for fixed request sequences like an ADC scan
+        @param transfers: a list of transfers, each a list of bytes to send
+        @return: an SPIMessage
+        """
+        if len(transfers) > SPIBus.SEGMENTS_MAX or sum(len(data) for data in transfers) > SPIBus.MESSAGE_BYTES_MAX:
+            raise ValueError("A message holds at most %d transfers and %d bytes." %
+                             (SPIBus.SEGMENTS_MAX, SPIBus.MESSAGE_BYTES_MAX))
+        return SPIMessage(self, transfers)
+
+    def _split(self, transfers):
+        """
+        splits transfers into messages no bigger than one ioctl may carry
+        """
+        messages = list()
+        start = 0
+        while start < len(transfers):
+            stop = start
+            size = 0
+            while (stop < len(transfers) and stop - start < SPIBus.SEGMENTS_MAX and
+                   (stop == start or size + len(transfers[stop]) <= SPIBus.MESSAGE_BYTES_MAX)):
+                size += len(transfers[stop])
+                stop += 1
+            messages.append(SPIMessage(self, transfers[start:stop]))
+            start = stop
+        return messages
+
+    def _xfer_each(self, transfers):
+        """
+        one xfer2 syscall per transfer
+        """
+        with self._lock:
+            xfer2 = self._spi.xfer2
+            self._transfers += len(transfers)
+            self._syscalls += len(transfers)
+            self._bytes += sum(len(data) for data in transfers)
+            return [xfer2(list(data)) for data in transfers]
+
+    def _submit(self, message):
+        """
+        sends a prepared SPIMessage as one SPI_IOC_MESSAGE ioctl
+        @return: a copy of the bytes received, taken before the lock is released
+                 since another thread may submit the same message next
+        """
+        with self._lock:
+            self._ioctl(self._fd, message._request, message._segments, True)
+            self._transfers += len(message._lengths)
+            self._syscalls += 1
+            self._bytes += message._size
+            return bytearray(message._rx.raw)
+
+    def stats(self):
+        """
+        gets the bus counters for this device
+        @return a dict of transfers, syscalls and bytes moved
+        """
+        return dict(transfers=self._transfers, syscalls=self._syscalls, bytes=self._bytes)
+
+    def close(self):
+        """
+        closes the underlying device
+        """
+        self._spi.close()
+
+
+class SPIMessage(object):
+    """
+        A batch of transfers packed once into spi_ioc_transfer segments with
+        its own TX/RX buffers, made by SPIBus.message(). Chip select is
+        released between transfers.
+    """
+
+    def __init__(self, spi, transfers):
+        """
+        @param spi: the SPIBus the message is sent on
+        @param transfers: a list of transfers, each a list of bytes to send
+        """
+        self._spi = spi
+        self._transfers = [list(data) for data in transfers]
+        self._lengths = [len(data) for data in transfers]
+        self._size = sum(self._lengths)
+        self._tx = ctypes.create_string_buffer(bytes(bytearray().join(bytearray(data) for data in transfers)), self._size)
+        self._rx = ctypes.create_string_buffer(self._size)
+        tx_addr = ctypes.addressof(self._tx)
+        rx_addr = ctypes.addressof(self._rx)
+        segments = list()
+        offset = 0
+        last = len(transfers) - 1
+        for i, length in enumerate(self._lengths):
+            segments.append(SPIBus.TRANSFER.pack(tx_addr + offset, rx_addr + offset, length, 0, 0, 0,
+                                                 1 if i < last else 0, 0, 0, 0, 0))
+            offset += length
+        self._segments = bytearray(b"".join(segments))
+        # _IOW(SPI_IOC_MAGIC, 0, char[SPI_MSGSIZE(n)])
+        self._request = (1 << 30) | (len(self._segments) << 16) | (ord("k") << 8)
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def submit(self):
+        """
+        sends every transfer, in one ioctl when the bus is batching
+        @return: a list of the lists of bytes received, one per transfer
+        """
+        if not self._spi.batching() or len(self._lengths) < 2:
+            return self._spi._xfer_each(self._transfers)
+        received = self._spi._submit(self)
+        results = list()
+        offset = 0
+        for length in self._lengths:
+            results.append(list(received[offset:offset + length]))
+            offset += length
+        return results
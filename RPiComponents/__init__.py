@@ -7,14 +7,18 @@
     This file defines some module wide functions for controlling the GPIO
     pins.
 """
+import sim
+sim.install()  # RPICOMPONENTS_BACKEND=sim swaps in simulated hardware
 import RPi.GPIO as gpio
 import BasicLogic
+import SPIBus
 import LED
 import L293DMotor
 import ADC
 import EEPROM_24CXX
 import LCD
 import RF24
+import RF24Transport
 import RangeFinders
 
 def finalize():
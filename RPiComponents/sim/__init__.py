@@ -0,0 +1,79 @@
+"""
+    @file __init__
+    @module RPiComponents.sim
+    @author Jacob Calvert <jacob+info@jacobncalvert.com>
+    @date October, 2015
+    @brief Hardware-free simulation backend
+
+    Stands in for RPi.GPIO, spidev and smbus so the drivers run, and can be
+    benchmarked, on any machine. Set RPICOMPONENTS_BACKEND=sim before
+    importing RPiComponents, or call install("sim") before importing the
+    driver modules. Each driver also takes a simulated object directly
+    through its _gpio=, _spi= or _bus= argument.
+
+    Examples
+    @code
+        # RPICOMPONENTS_BACKEND=sim python app.py
+        import RPiComponents
+        from RPiComponents import sim
+        chip = sim.spi.MCP3008()
+        sim.spi.attach(0, 0, chip)
+        chip.set_voltage(3, 1.65)
+        RPiComponents.ADC.MCP3008(0, 0).read(3)  # 512
+    @endcode
+"""
+import os
+import sys
+import types
+
+import gpio
+import i2c
+import nrf24
+import spi
+
+BACKEND_ENV = "RPICOMPONENTS_BACKEND"
+BACKENDS = ("hardware", "sim")
+
+GPIO = None  # the simulated GPIO install() put in place of RPi.GPIO
+
+
+def backend():
+    """
+    @return: the backend named by the RPICOMPONENTS_BACKEND environment variable, "hardware" if unset
+    """
+    return os.environ.get(BACKEND_ENV, "hardware")
+
+
+def install(name=None):
+    """
+    puts the simulated modules in sys.modules as RPi.GPIO, spidev and smbus,
+    this has to happen before the driver modules are imported
+    @param name: "sim" or "hardware" (does nothing), None reads RPICOMPONENTS_BACKEND
+    @return: the simulated GPIO, or None for the hardware backend
+    """
+    global GPIO
+    if name is None:
+        name = backend()
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend %s, use one of %s." % (name, ", ".join(BACKENDS)))
+    if name == "hardware":
+        return None
+    if GPIO is not None:
+        return GPIO
+    if "RPi.GPIO" in sys.modules:
+        raise RuntimeError("RPi.GPIO is already imported, install the simulation before the drivers.")
+
+    GPIO = gpio.GPIO()
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = GPIO
+    sys.modules["RPi"] = rpi
+    sys.modules["RPi.GPIO"] = GPIO
+
+    spidev = types.ModuleType("spidev")
+    spidev.SpiDev = spi.SpiDev
+    sys.modules["spidev"] = spidev
+
+    smbus = types.ModuleType("smbus")
+    smbus.SMBus = i2c.SMBus
+    sys.modules["smbus"] = smbus
+    return GPIO
@@ -0,0 +1,363 @@
+"""
+    @file gpio
+    @module RPiComponents.sim.gpio
+    @author Jacob Calvert <jacob+info@jacobncalvert.com>
+    @date October, 2015
+    @brief In-memory stand-in for RPi.GPIO
+
+    GPIO has the RPi.GPIO functions and constants the drivers use, plus a
+    simulation side: drive() sets the level an input sees, watch() follows
+    what the drivers write to outputs, and every output write is kept in a
+    per-pin history.
+"""
+import threading
+import time
+from collections import deque
+
+
+class GPIO(object):
+    """
+        A board's worth of simulated pins. Edge callbacks run on a
+        dispatcher thread like they do with RPi.GPIO, wait_idle() waits for
+        them to finish.
+
+        Examples
+        @code
+            gpio = GPIO()
+            button = BasicLogic.ToggleInputCallback(17, callback=on_press, pud=gpio.PUD_UP, _gpio=gpio)
+            gpio.drive(17, gpio.LOW)  # press
+            gpio.wait_idle()
+            led = LED.LED(18, _gpio=gpio)
+            led.on()
+            gpio.history(18)  # [(timestamp, 1)]
+        @endcode
+    """
+
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+    VERSION = "sim"
+    RPI_REVISION = 3
+
+    def __init__(self, history=1024):
+        """
+        @param history: the number of output writes remembered per pin
+        """
+        self._mode = None
+        self._history_len = history
+        self._lock = threading.RLock()
+        self._direction = dict()  # pin -> IN/OUT
+        self._pull = dict()  # pin -> PUD_*
+        self._level = dict()  # pin -> level written to an output
+        self._driven = dict()  # pin -> level driven onto an input from outside
+        self._history = dict()  # pin -> deque of (timestamp, level)
+        self._writes = dict()  # pin -> output() calls
+        self.output_calls = 0  # output() calls, a list-form call counts once
+        self._events = dict()  # pin -> [edge, callbacks, bouncetime_s, last_edge_time, detected]
+        self._watchers = dict()  # pin -> callbacks on output changes
+        self._queue = deque()  # (callback, pin) waiting for the dispatcher
+        self._queue_cond = threading.Condition()
+        self._busy = 0
+        self._dispatcher = None
+
+    @staticmethod
+    def _channels(channel):
+        if isinstance(channel, (list, tuple)):
+            return channel
+        return (channel,)
+
+    def setmode(self, mode):
+        if mode not in (GPIO.BOARD, GPIO.BCM):
+            raise ValueError("An invalid mode was passed to setmode()")
+        if self._mode is not None and self._mode != mode:
+            raise ValueError("A different mode has already been set!")
+        self._mode = mode
+
+    def getmode(self):
+        return self._mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=PUD_OFF, initial=-1):
+        if self._mode is None:
+            raise RuntimeError("Please set pin numbering mode using GPIO.setmode(GPIO.BOARD) or GPIO.setmode(GPIO.BCM)")
+        with self._lock:
+            for pin in GPIO._channels(channel):
+                self._direction[pin] = direction
+                self._pull[pin] = pull_up_down
+                if direction == GPIO.OUT:
+                    self._set_output(pin, initial if initial != -1 else self._level.get(pin, GPIO.LOW))
+
+    def gpio_function(self, channel):
+        return self._direction.get(channel, GPIO.IN)
+
+    def output(self, channel, value):
+        channels = GPIO._channels(channel)
+        values = value if isinstance(value, (list, tuple)) else [value] * len(channels)
+        if len(values) != len(channels):
+            raise RuntimeError("Number of channels != number of values")
+        self.output_calls += 1
+        for pin, level in zip(channels, values):
+            if self._direction.get(pin) != GPIO.OUT:
+                raise RuntimeError("The GPIO channel has not been set up as an OUTPUT")
+            self._set_output(pin, level)
+
+    def _set_output(self, pin, level):
+        level = GPIO.HIGH if level else GPIO.LOW
+        with self._lock:
+            changed = self._level.get(pin) != level
+            self._level[pin] = level
+            self._writes[pin] = self._writes.get(pin, 0) + 1
+            if pin not in self._history:
+                self._history[pin] = deque(maxlen=self._history_len)
+            self._history[pin].append((time.time(), level))
+            watchers = list(self._watchers.get(pin, ()))
+        if changed:
+            for callback in watchers:
+                callback(pin, level)
+
+    def input(self, channel):
+        with self._lock:
+            if channel not in self._direction:
+                raise RuntimeError("You must setup() the GPIO channel first")
+            if self._direction[channel] == GPIO.OUT:
+                return self._level.get(channel, GPIO.LOW)
+            return self._input_level(channel)
+
+    def _input_level(self, pin):
+        if pin in self._driven:
+            return self._driven[pin]
+        return GPIO.HIGH if self._pull.get(pin) == GPIO.PUD_UP else GPIO.LOW
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        if edge not in (GPIO.RISING, GPIO.FALLING, GPIO.BOTH):
+            raise ValueError("The edge must be set to RISING, FALLING or BOTH")
+        with self._lock:
+            if channel in self._events:
+                raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+            bounce = bouncetime * 10**-3 if bouncetime else 0
+            self._events[channel] = [edge, [callback] if callback else [], bounce, None, False]
+
+    def add_event_callback(self, channel, callback):
+        with self._lock:
+            if channel not in self._events:
+                raise RuntimeError("Add event detection using add_event_detect first before adding a callback")
+            self._events[channel][1].append(callback)
+
+    def remove_event_detect(self, channel):
+        with self._lock:
+            self._events.pop(channel, None)
+
+    def event_detected(self, channel):
+        with self._lock:
+            event = self._events.get(channel)
+            if event is None or not event[4]:
+                return False
+            event[4] = False
+            return True
+
+    def wait_for_edge(self, channel, edge, timeout=None):
+        """
+        blocks until drive() makes the edge on channel
+        @return: channel, or None on timeout
+        """
+        seen = threading.Event()
+        self.add_event_detect(channel, edge, lambda pin: seen.set())
+        try:
+            return channel if seen.wait(timeout * 10**-3 if timeout else None) else None
+        finally:
+            self.remove_event_detect(channel)
+
+    def cleanup(self, channel=None):
+        with self._lock:
+            pins = list(self._direction.keys()) if channel is None else GPIO._channels(channel)
+            for pin in pins:
+                self._direction.pop(pin, None)
+                self._events.pop(pin, None)
+            if channel is None:
+                self._mode = None
+
+    def PWM(self, channel, frequency):
+        return PWM(self, channel, frequency)
+
+    # simulation side
+
+    def drive(self, pin, level):
+        """
+        drives an input pin from outside, firing edge detection
+        @param pin: the pin
+        @param level: GPIO.HIGH/GPIO.LOW
+        """
+        level = GPIO.HIGH if level else GPIO.LOW
+        now = time.time()
+        with self._lock:
+            old = self._input_level(pin)
+            self._driven[pin] = level
+            event = self._events.get(pin)
+            if old == level or event is None:
+                return
+            edge, callbacks, bounce, last, detected = event
+            rising = level == GPIO.HIGH
+            if edge == GPIO.BOTH or (edge == GPIO.RISING) == rising:
+                if last is not None and now - last < bounce:
+                    return
+                event[3] = now
+                event[4] = True
+                callbacks = list(callbacks)
+            else:
+                return
+        if callbacks:
+            with self._queue_cond:
+                for callback in callbacks:
+                    self._queue.append((callback, pin))
+                self._start_dispatcher()
+                self._queue_cond.notify_all()
+
+    def release(self, pin):
+        """
+        stops driving an input pin, it goes back to its pull-up/pull-down level
+        """
+        with self._lock:
+            pull = GPIO.HIGH if self._pull.get(pin) == GPIO.PUD_UP else GPIO.LOW
+        self.drive(pin, pull)
+        with self._lock:
+            self._driven.pop(pin, None)
+
+    def watch(self, pin, callback):
+        """
+        calls callback(pin, level) on the writing thread whenever an output pin changes level
+        """
+        with self._lock:
+            self._watchers.setdefault(pin, list()).append(callback)
+
+    def history(self, pin):
+        """
+        @return: a list of (timestamp, level) for the latest writes to an output pin
+        """
+        with self._lock:
+            return list(self._history.get(pin, ()))
+
+    def writes(self, pin):
+        """
+        @return: the number of output() calls on a pin, including ones that did not change its level
+        """
+        return self._writes.get(pin, 0)
+
+    def wait_idle(self, timeout=1.0):
+        """
+        waits for every queued edge callback to finish
+        @return: T/F indicating the callbacks finished in time
+        """
+        deadline = time.time() + timeout
+        with self._queue_cond:
+            while self._queue or self._busy:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._queue_cond.wait(remaining)
+        return True
+
+    def _start_dispatcher(self):
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch)
+            self._dispatcher.daemon = True
+            self._dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            with self._queue_cond:
+                while not self._queue:
+                    self._queue_cond.wait()
+                callback, pin = self._queue.popleft()
+                self._busy += 1
+            try:
+                callback(pin)
+            finally:
+                with self._queue_cond:
+                    self._busy -= 1
+                    self._queue_cond.notify_all()
+
+
+class PWM(object):
+    """
+        Software PWM on a simulated pin, keeps a history of frequency and
+        duty cycle changes so the time spent high can be worked out.
+    """
+
+    def __init__(self, gpio, channel, frequency):
+        if frequency <= 0:
+            raise ValueError("frequency must be greater than 0.0")
+        self._gpio = gpio
+        self._channel = channel
+        self._frequency = float(frequency)
+        self._duty_cycle = 0.0
+        self._running = False
+        self._changes = list()  # (timestamp, frequency, duty cycle while running, 0 when stopped)
+
+    def _record(self):
+        self._changes.append((time.time(), self._frequency, self._duty_cycle if self._running else 0.0))
+
+    def start(self, dutycycle):
+        if dutycycle < 0 or dutycycle > 100:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        self._duty_cycle = float(dutycycle)
+        self._running = True
+        self._record()
+
+    def ChangeDutyCycle(self, dutycycle):
+        if dutycycle < 0 or dutycycle > 100:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        self._duty_cycle = float(dutycycle)
+        self._record()
+
+    def ChangeFrequency(self, frequency):
+        if frequency <= 0:
+            raise ValueError("frequency must be greater than 0.0")
+        self._frequency = float(frequency)
+        self._record()
+
+    def stop(self):
+        self._running = False
+        self._record()
+
+    # simulation side
+
+    def duty_cycle(self):
+        return self._duty_cycle if self._running else 0.0
+
+    def frequency(self):
+        return self._frequency
+
+    def changes(self):
+        """
+        @return: a list of (timestamp, frequency, effective duty cycle) for every change
+        """
+        return list(self._changes)
+
+    def high_time(self, start, end=None):
+        """
+        the time the pin spent high between start and end
+        @param start: a time.time() timestamp
+        @param end: a time.time() timestamp, now by default
+        @return: seconds high
+        """
+        if end is None:
+            end = time.time()
+        total = 0.0
+        for i, (timestamp, frequency, duty) in enumerate(self._changes):
+            until = self._changes[i + 1][0] if i + 1 < len(self._changes) else end
+            lo = max(start, timestamp)
+            hi = min(end, until)
+            if hi > lo:
+                total += (hi - lo) * duty / 100.0
+        return total
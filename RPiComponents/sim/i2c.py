@@ -0,0 +1,199 @@
+"""
+    @file i2c
+    @module RPiComponents.sim.i2c
+    @author Jacob Calvert <jacob+info@jacobncalvert.com>
+    @date October, 2015
+    @brief In-memory stand-in for smbus with a simulated 24CXX EEPROM
+
+    SMBus has the smbus.SMBus calls the drivers use, plus the plain
+    transactions of EEPROM_24CXX.RawI2C, and hands each transaction to
+    the device attached at its address. A device answers
+    write(address, data) and read(address, length), and raises IOError to
+    NACK like a real part would.
+"""
+import errno
+import time
+
+_devices = dict()  # (bus, address) -> device
+
+
+def attach(bus, device):
+    """
+    puts a device on a simulated I2C bus at every address it answers to
+    @param bus: the bus number SMBus(bus) is opened with
+    @param device: an object with addresses(), write(address, data) and read(address, length)
+    """
+    for address in device.addresses():
+        _devices[(bus, address)] = device
+
+
+def detach(bus, device):
+    """
+    takes a device off a simulated I2C bus
+    """
+    for address in device.addresses():
+        if _devices.get((bus, address)) is device:
+            del _devices[(bus, address)]
+
+
+class SMBus(object):
+    """
+        A simulated I2C bus. With clock_hz set every transaction takes as
+        long as it would on the wire, 9 clocks for each byte and the
+        address byte.
+
+        Examples
+        @code
+            part = EEPROM24CXX(*BasicEEPROM.VARIANTS["24C256"])
+            attach(1, part)
+            eeprom = BasicEEPROM.from_variant("24C256", 0x50, 1, _bus=SMBus(1))
+        @endcode
+    """
+
+    BLOCK_MAX = 32
+
+    def __init__(self, bus=None, clock_hz=None):
+        """
+        @param bus: the bus number devices were attached to
+        @param clock_hz: the modelled bus clock, None takes no time
+        """
+        self._bus = bus
+        self._bit_time = 1.0 / clock_hz if clock_hz else 0
+        self.transactions = 0
+
+    def open(self, bus):
+        self._bus = bus
+
+    def close(self):
+        pass
+
+    def _device(self, addr, num_bytes):
+        self.transactions += 1
+        if self._bit_time:
+            time.sleep((num_bytes + 1) * 9 * self._bit_time)
+        device = _devices.get((self._bus, addr))
+        if device is None:
+            raise IOError(errno.EREMOTEIO, "Remote I/O error")
+        return device
+
+    def _write(self, addr, data):
+        self._device(addr, len(data)).write(addr, data)
+
+    def _read(self, addr, length):
+        return self._device(addr, length).read(addr, length)
+
+    def write_quick(self, addr):
+        self._write(addr, [])
+
+    def write_byte(self, addr, val):
+        self._write(addr, [val])
+
+    def write_byte_data(self, addr, cmd, val):
+        self._write(addr, [cmd, val])
+
+    def write_word_data(self, addr, cmd, val):
+        self._write(addr, [cmd, val & 0xff, (val >> 8) & 0xff])
+
+    def write_i2c_block_data(self, addr, cmd, vals):
+        if len(vals) > SMBus.BLOCK_MAX:
+            raise OverflowError("Third argument must be a list of at least one, but not more than 32 integers")
+        self._write(addr, [cmd] + list(vals))
+
+    def read_byte(self, addr):
+        return self._read(addr, 1)[0]
+
+    def read_byte_data(self, addr, cmd):
+        self._write(addr, [cmd])
+        return self._read(addr, 1)[0]
+
+    def read_word_data(self, addr, cmd):
+        self._write(addr, [cmd])
+        data = self._read(addr, 2)
+        return data[0] | (data[1] << 8)
+
+    def read_i2c_block_data(self, addr, cmd, length=BLOCK_MAX):
+        if length > SMBus.BLOCK_MAX:
+            raise OverflowError("Length must be at most 32")
+        self._write(addr, [cmd])
+        return self._read(addr, length)
+
+    def write_raw(self, addr, data):
+        """
+        a plain write() on /dev/i2c-N, see EEPROM_24CXX.RawI2C
+        """
+        self._write(addr, list(data))
+
+    def read_raw(self, addr, length):
+        """
+        a plain read() on /dev/i2c-N, see EEPROM_24CXX.RawI2C
+        """
+        return bytearray(self._read(addr, length))
+
+
+class EEPROM24CXX(object):
+    """
+        A 24CXX serial EEPROM. Writes wrap inside the page like the real
+        part, and it NACKs everything for write_cycle_ms after a write.
+        8 bit parts over 256 bytes answer on one address per 256 byte
+        block.
+    """
+
+    ADDRESS_MODE_16BIT = 0  # the same values as BasicEEPROM's
+    ADDRESS_MODE_8BIT = 1
+
+    def __init__(self, capacity, page_size, address_mode, base_address=0x50, write_cycle_ms=5):
+        """
+        @param capacity: the storage size in bytes
+        @param page_size: the page write buffer size
+        @param address_mode: EEPROM24CXX.ADDRESS_MODE_16BIT or EEPROM24CXX.ADDRESS_MODE_8BIT
+        @param base_address: the device address (of block 0)
+        @param write_cycle_ms: how long the part is busy after a write
+        """
+        self.memory = bytearray(capacity)
+        self.writes = 0
+        self.nacks = 0
+        self._page_size = page_size
+        self._addr_mode = address_mode
+        self._base_addr = base_address
+        self._write_cycle = write_cycle_ms * 10**-3
+        self._busy_until = 0
+        self._pointer = 0
+
+    def addresses(self):
+        if self._addr_mode == EEPROM24CXX.ADDRESS_MODE_8BIT:
+            blocks = max(1, len(self.memory) >> 8)
+            return range(self._base_addr, self._base_addr + blocks)
+        return [self._base_addr]
+
+    def _check_ready(self):
+        if time.time() < self._busy_until:
+            self.nacks += 1
+            raise IOError(errno.EREMOTEIO, "Remote I/O error")
+
+    def write(self, addr, data):
+        self._check_ready()
+        if not data:
+            return  # an address only probe
+        if self._addr_mode == EEPROM24CXX.ADDRESS_MODE_8BIT:
+            self._pointer = ((addr - self._base_addr) << 8) | data[0]
+            data = data[1:]
+        else:
+            if len(data) < 2:
+                return  # half an address, the part waits for the rest
+            self._pointer = (data[0] << 8) | data[1]
+            data = data[2:]
+        self._pointer %= len(self.memory)
+        if data:
+            page_start = self._pointer - (self._pointer % self._page_size)
+            for i, byte in enumerate(data):
+                self.memory[page_start + (self._pointer - page_start + i) % self._page_size] = byte
+            self.writes += 1
+            self._busy_until = time.time() + self._write_cycle
+
+    def read(self, addr, length):
+        self._check_ready()
+        data = list()
+        for i in range(length):
+            data.append(self.memory[self._pointer])
+            self._pointer = (self._pointer + 1) % len(self.memory)
+        return data
@@ -0,0 +1,324 @@
+"""
+    @file nrf24
+    @module RPiComponents.sim.nrf24
+    @author Jacob Calvert <jacob+info@jacobncalvert.com>
+    @date October, 2015
+    @brief Register level NRF24L01+ simulation
+
+    NRF24 answers SPI commands like the chip: registers, the 3 deep TX and
+    RX FIFOs, STATUS flags, auto acknowledge with retries, dynamic payloads,
+    the IRQ pin and CE. Radios sharing an Air hear each other when they are
+    on the same channel and address; packets go over instantly, lost with
+    the Air's loss rate.
+"""
+import random
+import threading
+from collections import deque
+
+
+class Air(object):
+    """
+        The space radios transmit into, shared by every NRF24 in it.
+
+        Examples
+        @code
+            gpio = sim.install("sim")
+            board_b = sim.gpio.GPIO()
+            a, b = Air.pair(gpio, (26, 19), (16, 20), loss=0.1, gpio_b=board_b)
+            sim.spi.attach(0, 0, a)
+            sim.spi.attach(0, 1, b)
+            radio_a = RF24.Radio(0, 0, 26, 19)
+            radio_b = RF24.Radio(0, 1, 16, 20, _gpio=board_b)
+        @endcode
+    """
+
+    def __init__(self, loss=0.0, seed=None):
+        """
+        @param loss: the chance [0, 1) of each transmission (and each ACK) being lost
+        @param seed: seeds the loss and noise random numbers
+        """
+        self.lock = threading.RLock()  # one lock for every radio so a transmission is atomic
+        self.retry_wait = threading.Condition(self.lock)  # waits out the retry delay with the air free
+        self.radios = list()
+        self.loss = loss
+        self.noise = dict()  # channel -> chance of a carrier at each RPD sample
+        self.random = random.Random(seed)
+
+    @classmethod
+    def pair(cls, gpio, pins_a, pins_b, loss=0.0, seed=None, gpio_b=None):
+        """
+        two radios in a fresh Air
+        @param gpio: the simulated GPIO the radios' CE and IRQ pins are on
+        @param pins_a: (ce, irq) of the first radio
+        @param pins_b: (ce, irq) of the second radio
+        @param loss: see Air()
+        @param seed: see Air()
+        @param gpio_b: puts the second radio on its own board. Edge callbacks run one at a
+                       time per board like RPi.GPIO's, so on one board a Radio busy in
+                       send_many() holds up the other Radio's IRQ callback
+        @return: (first NRF24, second NRF24)
+        """
+        air = cls(loss, seed)
+        return NRF24(air, gpio, *pins_a), NRF24(air, gpio_b or gpio, *pins_b)
+
+    def lost(self):
+        return self.loss and self.random.random() < self.loss
+
+
+class NRF24(object):
+    """
+        One NRF24L01+. Register numbers and bits are the datasheet's, the
+        same ones RF24.Radio uses.
+    """
+
+    R_REGISTER = 0x00
+    W_REGISTER = 0x20
+    R_RX_PL_WID = 0x60
+    R_RX_PAYLOAD = 0x61
+    W_TX_PAYLOAD = 0xA0
+    W_TX_PAYLOAD_NOACK = 0xB0
+    FLUSH_TX = 0xE1
+    FLUSH_RX = 0xE2
+    REUSE_TX_PL = 0xE3
+    NOP = 0xFF
+
+    CONFIG = 0x00
+    EN_AA = 0x01
+    EN_RXADDR = 0x02
+    SETUP_AW = 0x03
+    SETUP_RETR = 0x04
+    RF_CH = 0x05
+    STATUS = 0x07
+    OBSERVE_TX = 0x08
+    RPD = 0x09
+    RX_ADDR_P0 = 0x0A
+    RX_ADDR_P1 = 0x0B
+    TX_ADDR = 0x10
+    RX_PW_P0 = 0x11
+    FIFO_STATUS = 0x17
+    DYNPD = 0x1C
+    FEATURE = 0x1D
+
+    RX_DR = 0x40
+    TX_DS = 0x20
+    MAX_RT = 0x10
+    PWR_UP = 0x02
+    PRIM_RX = 0x01
+    EN_DPL = 0x04
+
+    FIFO_DEPTH = 3
+    RESET = {0x00: 0x08, 0x01: 0x3F, 0x02: 0x03, 0x03: 0x03, 0x04: 0x03, 0x05: 0x02, 0x06: 0x0E,
+             0x0C: 0xC3, 0x0D: 0xC4, 0x0E: 0xC5, 0x0F: 0xC6}
+
+    def __init__(self, air, gpio=None, ce=None, irq=None):
+        """
+        @param air: the Air the radio transmits into
+        @param gpio: the simulated GPIO holding the CE and IRQ pins, None runs with CE always high and no IRQ
+        @param ce: the CE pin the driver writes
+        @param irq: the IRQ pin the radio drives, active low
+        """
+        self._air = air
+        self._gpio = gpio
+        self._ce_pin = ce
+        self._irq_pin = irq
+        self._registers = [0] * 0x20
+        for register, value in NRF24.RESET.items():
+            self._registers[register] = value
+        self._addresses = {NRF24.RX_ADDR_P0: [0xE7] * 5, NRF24.RX_ADDR_P1: [0xC2] * 5, NRF24.TX_ADDR: [0xE7] * 5}
+        self._status_flags = 0
+        self._tx_fifo = deque()  # (payload, no_ack)
+        self._rx_fifo = deque()  # (pipe, payload)
+        self._ce = gpio is None
+        self._irq_level = 1
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.packets_lost = 0
+        air.radios.append(self)
+        if gpio is not None:
+            if ce is not None:
+                gpio.watch(ce, self._ce_changed)
+            if irq is not None:
+                gpio.drive(irq, 1)
+
+    def _ce_changed(self, pin, level):
+        with self._air.lock:
+            if self._listening() and not level:
+                self._sample_rpd()  # RPD keeps the last value from RX mode
+            self._ce = bool(level)
+            self._run()
+
+    def _sample_rpd(self):
+        channel = self._registers[NRF24.RF_CH]
+        busy = any(radio is not self and radio._registers[NRF24.RF_CH] == channel and
+                   radio._powered() and radio._tx_fifo and radio._ce for radio in self._air.radios)
+        carrier = busy or self._air.random.random() < self._air.noise.get(channel, 0)
+        self._registers[NRF24.RPD] = 1 if carrier else 0
+
+    # state
+
+    def _status(self):
+        rx_p_no = self._rx_fifo[0][0] if self._rx_fifo else 7
+        tx_full = 1 if len(self._tx_fifo) >= NRF24.FIFO_DEPTH else 0
+        return self._status_flags | (rx_p_no << 1) | tx_full
+
+    def _fifo_status(self):
+        value = 0
+        if len(self._tx_fifo) >= NRF24.FIFO_DEPTH:
+            value |= 0x20
+        if not self._tx_fifo:
+            value |= 0x10
+        if len(self._rx_fifo) >= NRF24.FIFO_DEPTH:
+            value |= 0x02
+        if not self._rx_fifo:
+            value |= 0x01
+        return value
+
+    def _address_width(self):
+        return (self._registers[NRF24.SETUP_AW] & 0x03) + 2
+
+    def _pipe_address(self, pipe):
+        width = self._address_width()
+        if pipe < 2:
+            return self._addresses[NRF24.RX_ADDR_P0 + pipe][:width]
+        return [self._registers[NRF24.RX_ADDR_P0 + pipe]] + self._addresses[NRF24.RX_ADDR_P1][1:width]
+
+    def _powered(self):
+        return self._registers[NRF24.CONFIG] & NRF24.PWR_UP
+
+    def _listening(self):
+        return self._powered() and self._ce and self._registers[NRF24.CONFIG] & NRF24.PRIM_RX
+
+    def _dynamic(self, pipe):
+        return self._registers[NRF24.FEATURE] & NRF24.EN_DPL and self._registers[NRF24.DYNPD] & (1 << pipe)
+
+    # SPI
+
+    def transfer(self, data):
+        with self._air.lock:
+            reply = [self._status()] + [0] * (len(data) - 1)
+            command = data[0]
+            if command & 0xE0 == NRF24.R_REGISTER:
+                register = command & 0x1F
+                value = self._read_register(register)
+                for i in range(1, len(data)):
+                    reply[i] = value[i - 1] if i - 1 < len(value) else 0
+            elif command & 0xE0 == NRF24.W_REGISTER:
+                self._write_register(command & 0x1F, data[1:])
+            elif command == NRF24.R_RX_PAYLOAD:
+                if self._rx_fifo:
+                    payload = self._rx_fifo.popleft()[1]
+                    for i in range(1, len(data)):
+                        reply[i] = payload[i - 1] if i - 1 < len(payload) else 0
+            elif command == NRF24.R_RX_PL_WID:
+                if len(data) > 1:
+                    reply[1] = len(self._rx_fifo[0][1]) if self._rx_fifo else 0
+            elif command in (NRF24.W_TX_PAYLOAD, NRF24.W_TX_PAYLOAD_NOACK):
+                if len(self._tx_fifo) < NRF24.FIFO_DEPTH:
+                    self._tx_fifo.append((list(data[1:33]), command == NRF24.W_TX_PAYLOAD_NOACK))
+            elif command == NRF24.FLUSH_TX:
+                self._tx_fifo.clear()
+            elif command == NRF24.FLUSH_RX:
+                self._rx_fifo.clear()
+            self._run()
+            return reply
+
+    def _read_register(self, register):
+        if register in self._addresses:
+            return list(self._addresses[register][:self._address_width()])
+        if register == NRF24.STATUS:
+            return [self._status()]
+        if register == NRF24.FIFO_STATUS:
+            return [self._fifo_status()]
+        if register == NRF24.RPD:
+            if self._listening():
+                self._sample_rpd()
+            return [self._registers[NRF24.RPD]]
+        return [self._registers[register]]
+
+    def _write_register(self, register, values):
+        if not values:
+            return
+        if register in self._addresses:
+            width = self._address_width()
+            address = self._addresses[register]
+            for i in range(min(width, len(values))):
+                address[i] = values[i]
+        elif register == NRF24.STATUS:
+            self._status_flags &= ~(values[0] & (NRF24.RX_DR | NRF24.TX_DS | NRF24.MAX_RT))
+        elif register in (NRF24.OBSERVE_TX, NRF24.RPD, NRF24.FIFO_STATUS):
+            pass  # read only
+        else:
+            self._registers[register] = values[0] & 0xFF
+            if register == NRF24.RF_CH:
+                self._registers[NRF24.OBSERVE_TX] &= 0x0F  # PLOS_CNT resets on a channel write
+
+    # air
+
+    def _run(self):
+        """
+        transmits whatever the TX FIFO holds while the radio is in TX mode, then updates IRQ
+        """
+        config = self._registers[NRF24.CONFIG]
+        while (self._tx_fifo and self._ce and config & NRF24.PWR_UP and not config & NRF24.PRIM_RX and
+               not self._status_flags & NRF24.MAX_RT):
+            payload, no_ack = self._tx_fifo[0]
+            auto_ack = self._registers[NRF24.EN_AA] & 0x01 and not no_ack
+            retries = self._registers[NRF24.SETUP_RETR] & 0x0F if auto_ack else 0
+            attempts = 0
+            acked = False
+            while attempts <= retries and not acked:
+                if attempts:
+                    # the auto retry delay, 250us steps, lets the receiver's IRQ drain a full FIFO
+                    self._air.retry_wait.wait(((self._registers[NRF24.SETUP_RETR] >> 4) + 1) * 250 * 10**-6)
+                attempts += 1
+                delivered = not self._air.lost() and self._deliver(payload)
+                acked = delivered and (not auto_ack or not self._air.lost())
+            self._registers[NRF24.OBSERVE_TX] = (self._registers[NRF24.OBSERVE_TX] & 0xF0) | (attempts - 1)
+            if acked or not auto_ack:
+                self._tx_fifo.popleft()
+                self._status_flags |= NRF24.TX_DS
+                self.packets_sent += 1
+            else:
+                lost = min(15, (self._registers[NRF24.OBSERVE_TX] >> 4) + 1)
+                self._registers[NRF24.OBSERVE_TX] = (lost << 4) | (attempts - 1)
+                self._status_flags |= NRF24.MAX_RT
+                self.packets_lost += 1
+        self._update_irq()
+
+    def _deliver(self, payload):
+        """
+        hands payload to every radio listening on this channel and address
+        @return: T/F indicating a radio took it
+        """
+        address = self._addresses[NRF24.TX_ADDR][:self._address_width()]
+        channel = self._registers[NRF24.RF_CH]
+        taken = False
+        for radio in self._air.radios:
+            if radio is self or not radio._listening() or radio._registers[NRF24.RF_CH] != channel:
+                continue
+            for pipe in range(6):
+                if not radio._registers[NRF24.EN_RXADDR] & (1 << pipe) or radio._pipe_address(pipe) != address:
+                    continue
+                if radio._dynamic(pipe):
+                    data = payload
+                else:
+                    width = radio._registers[NRF24.RX_PW_P0 + pipe]
+                    if width != len(payload):
+                        break  # a static width mismatch fails the packet CRC
+                    data = payload
+                if len(radio._rx_fifo) < NRF24.FIFO_DEPTH:
+                    radio._rx_fifo.append((pipe, list(data)))
+                    radio._status_flags |= NRF24.RX_DR
+                    radio.packets_received += 1
+                    radio._update_irq()
+                    taken = True
+                break
+        return taken
+
+    def _update_irq(self):
+        masked = self._registers[NRF24.CONFIG] & (NRF24.RX_DR | NRF24.TX_DS | NRF24.MAX_RT)
+        level = 0 if self._status_flags & ~masked else 1
+        if level != self._irq_level:
+            self._irq_level = level
+            if self._gpio is not None and self._irq_pin is not None:
+                self._gpio.drive(self._irq_pin, level)
@@ -0,0 +1,173 @@
+"""
+    @file spi
+    @module RPiComponents.sim.spi
+    @author Jacob Calvert <jacob+info@jacobncalvert.com>
+    @date October, 2015
+    @brief In-memory stand-in for spidev with a simulated MCP3008
+
+    SpiDev has the spidev.SpiDev calls the drivers use and hands every
+    transfer to the device attached at its bus and chip select. Its ioctl()
+    decodes SPI_IOC_MESSAGE requests the way the kernel does, so SPIBus
+    batching runs against it unchanged.
+"""
+import ctypes
+import errno
+import struct
+import time
+
+_devices = dict()  # (bus, port) -> device
+
+TRANSFER = struct.Struct("=QQIIHBBBBBB")  # struct spi_ioc_transfer, see SPIBus.TRANSFER
+
+
+def attach(bus, port, device):
+    """
+    puts a device on a simulated SPI bus
+    @param bus: the bus number
+    @param port: the chip select
+    @param device: an object with transfer(data) returning the bytes clocked back
+    """
+    _devices[(bus, port)] = device
+
+
+def detach(bus, port):
+    """
+    takes the device off a simulated SPI bus and chip select
+    """
+    _devices.pop((bus, port), None)
+
+
+class SpiDev(object):
+    """
+        A simulated spidev device. syscall_us makes every xfer/ioctl call
+        spin for that long, to model the cost of a syscall on the Pi.
+
+        Examples
+        @code
+            attach(0, 0, MCP3008())
+            adc = ADC.MCP3008(0, 0)  # with the sim backend installed
+            spi = SPIBus(0, 0, _spi=SpiDev(device=MCP3008(), syscall_us=20))  # or explicitly
+        @endcode
+    """
+
+    def __init__(self, bus=None, port=None, device=None, syscall_us=0):
+        """
+        @param bus: opens this bus straight away, like spidev.SpiDev(bus, port)
+        @param port: the chip select to open
+        @param device: the device to talk to instead of the one attached at bus/port
+        @param syscall_us: microseconds each call spins for
+        """
+        self.max_speed_hz = 500000
+        self.mode = 0
+        self.bits_per_word = 8
+        self.cshigh = False
+        self.syscalls = 0
+        self.transfers = 0
+        self._device = device
+        self._syscall_time = syscall_us * 10**-6
+        if bus is not None:
+            self.open(bus, port)
+
+    def open(self, bus, port):
+        if self._device is None:
+            self._device = _devices.get((bus, port))
+            if self._device is None:
+                raise IOError(errno.ENOENT, "No such file or directory")
+
+    def close(self):
+        pass
+
+    def fileno(self):
+        return -1
+
+    def _syscall(self):
+        self.syscalls += 1
+        if self._syscall_time:
+            end = time.time() + self._syscall_time
+            while time.time() < end:
+                pass
+
+    def _transfer(self, data):
+        self.transfers += 1
+        reply = list(self._device.transfer(list(data)))
+        return (reply + [0] * len(data))[:len(data)]
+
+    def xfer2(self, data):
+        self._syscall()
+        return self._transfer(data)
+
+    xfer = xfer2
+
+    def writebytes(self, data):
+        self.xfer2(data)
+
+    def readbytes(self, length):
+        return self.xfer2([0] * length)
+
+    def ioctl(self, fd, request, arg, mutate_flag=True):
+        self._syscall()
+        segments = bytes(arg)
+        for i in range(((request >> 16) & 0x3fff) // TRANSFER.size):
+            tx_buf, rx_buf, length = TRANSFER.unpack_from(segments, i * TRANSFER.size)[:3]
+            reply = bytes(bytearray(self._transfer(bytearray(ctypes.string_at(tx_buf, length)))))
+            ctypes.memmove(rx_buf, reply, length)
+        return 0
+
+
+class MCP3008(object):
+    """
+        An MCP3008 answering the 3 byte conversion request the driver sends:
+        start bit in the first byte, SGL/DIFF and the channel in the top of
+        the second, the result in the bottom 2 bits of the second and the
+        third byte.
+    """
+
+    def __init__(self, vref=3.3):
+        """
+        @param vref: the reference voltage set_voltage() scales against
+        """
+        self.conversions = 0
+        self._vref = float(vref)
+        self._values = [0] * 8
+        self._sources = dict()  # channel -> function of time returning volts
+
+    def set_value(self, channel, value):
+        """
+        @param channel: the input [0-7]
+        @param value: the 10 bit reading [0-1023]
+        """
+        self._values[channel] = max(0, min(1023, int(value)))
+        self._sources.pop(channel, None)
+
+    def set_voltage(self, channel, volts):
+        """
+        @param channel: the input [0-7]
+        @param volts: the input voltage, clipped to [0, vref]
+        """
+        self.set_value(channel, round(volts / self._vref * 1023))
+
+    def set_source(self, channel, source):
+        """
+        @param channel: the input [0-7]
+        @param source: a function source(timestamp) returning the input voltage at each conversion
+        """
+        self._sources[channel] = source
+
+    def _sample(self, channel):
+        if channel in self._sources:
+            volts = self._sources[channel](time.time())
+            return max(0, min(1023, int(round(volts / self._vref * 1023))))
+        return self._values[channel]
+
+    def transfer(self, data):
+        if len(data) < 3 or not data[0] & 0x01:
+            return [0] * len(data)  # no start bit where the driver puts it
+        self.conversions += 1
+        config = data[1] >> 4
+        channel = config & 0x07
+        if config & 0x08:
+            value = self._sample(channel)
+        else:
+            # pairs are CH0/CH1, CH2/CH3... with channel naming the positive input
+            value = max(0, self._sample(channel) - self._sample(channel ^ 1))
+        return [0, (value >> 8) & 0x03, value & 0xff] + [0] * (len(data) - 3)
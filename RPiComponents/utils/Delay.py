@@ -6,44 +6,151 @@
     @brief Time delay methods
 
 """
+import ctypes
+import ctypes.util
+import sys
 import time
 
+CLOCK_MONOTONIC = 1  # from <linux/time.h>, other systems number their clocks differently
+
+
+_Timespec = ctypes.c_long * 2  # struct timespec, an array reads back faster than a Structure
+
+_clock_gettime = None  # left None off Linux, monotonic_ns() falls back to the wall clock
+if sys.platform.startswith("linux"):
+    try:
+        _clock_gettime = ctypes.CDLL(ctypes.util.find_library("rt") or ctypes.util.find_library("c"),
+                                     use_errno=True).clock_gettime
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+        if _clock_gettime(CLOCK_MONOTONIC, _Timespec()) != 0:
+            _clock_gettime = None
+    except (OSError, AttributeError, TypeError):
+        _clock_gettime = None
+
+
+def monotonic_ns():
+    """
+    reads CLOCK_MONOTONIC, which NTP and date changes do not move, on Linux,
+    falling back to time.time() elsewhere or if clock_gettime() fails
+    :return: the time in integer nanoseconds from an arbitrary start
+    """
+    if _clock_gettime is not None:
+        ts = _Timespec()
+        if _clock_gettime(CLOCK_MONOTONIC, ts) == 0:
+            return ts[0] * 1000000000 + ts[1]
+    return int(time.time() * 10**9)
+
+
+SPIN_MIN_NS = 20000  # never spin for less than time.sleep() can be trusted with
+SPIN_MAX_NS = 2000000  # or burn more than 2ms of CPU on one delay
+PRECISE_MAX_NS = 1000000  # sleep_us()/sleep_ns() delays shorter than this spin their tail, longer ones just sleep
+CALIBRATION_SAMPLES = 16
+CALIBRATION_SLEEP_US = 50
+
+_spin_ns = SPIN_MAX_NS  # replaced by calibrate() on import
+
+
+def calibrate(samples=CALIBRATION_SAMPLES, sleep_us=CALIBRATION_SLEEP_US):
+    """
+    measures how far time.sleep() overshoots on this machine and sets the
+    spin threshold to twice the 90th percentile of it, runs once on import
+    :param samples: the number of short sleeps to time
+    :param sleep_us: the length of each sleep
+    :return: the new spin threshold in nanoseconds
+    """
+    global _spin_ns
+    overshoots = list()
+    for i in range(samples):
+        start = monotonic_ns()
+        time.sleep(sleep_us * 10**-6)
+        overshoots.append(monotonic_ns() - start - sleep_us * 1000)
+    overshoots.sort()
+    _spin_ns = max(SPIN_MIN_NS, min(SPIN_MAX_NS, 2 * overshoots[len(overshoots) * 9 // 10]))
+    return _spin_ns
+
+
+def spin_threshold_ns():
+    """
+    :return: how long before a deadline the delays stop sleeping and busy-wait, in nanoseconds
+    """
+    return _spin_ns
+
+
+def set_spin_threshold_ns(ns):
+    """
+    overrides the calibrated spin threshold, 0 sleeps all the way and never spins
+    :param ns: the threshold in nanoseconds
+    :return:
+    """
+    global _spin_ns
+    if ns < 0:
+        raise ValueError("The spin threshold can not be negative.")
+    _spin_ns = ns
+
+
+def sleep_until(deadline_ns):
+    """
+    sleep the current thread until monotonic_ns() reaches deadline_ns,
+    sleeping until the spin threshold before it and busy-waiting the rest.
+    Loops that add their period to the last deadline do not drift
+    :param deadline_ns: the absolute deadline, on the monotonic_ns() clock
+    :return: how late the deadline was met, in nanoseconds
+    """
+    now = monotonic_ns()
+    remaining = deadline_ns - now
+    if remaining > _spin_ns:
+        time.sleep((remaining - _spin_ns) * 10**-9)
+        now = monotonic_ns()
+    while now < deadline_ns:
+        now = monotonic_ns()
+    return now - deadline_ns
+
 
 def sleep_s(s):
     """
     sleep the current thread for the specified
-    number of seconds
+    number of seconds, a plain time.sleep()
     :param s: seconds to sleep
     :return:
     """
-    time.sleep(s)
+    if s > 0:
+        time.sleep(s)
 
 
 def sleep_ms(ms):
     """
     sleep the current thread for the specified
-    number of milliseconds
+    number of milliseconds, a plain time.sleep()
     :param ms: milliseconds to sleep
     :return:
     """
-    sleep_s(ms * 10**-3)
+    if ms > 0:
+        time.sleep(ms * 10**-3)
 
 
 def sleep_us(us):
     """
     sleep the current thread for the specified
-    number of microseconds
+    number of microseconds, see sleep_ns()
     :param us: microseconds to sleep
     :return:
     """
-    sleep_ms(us * 10**-3)
+    sleep_ns(us * 10**3)
 
 
 def sleep_ns(ns):
     """
     sleep the current thread for the specified
-    number of nanoseconds
+    number of nanoseconds. Delays under PRECISE_MAX_NS
+    go through sleep_until() and spin their tail, longer
+    ones are a plain time.sleep() that costs no CPU
     :param ns: nanoseconds to sleep
     :return:
     """
-    sleep_us(ns * 10**-3)
\ No newline at end of file
+    if ns >= PRECISE_MAX_NS:
+        time.sleep(ns * 10**-9)
+    elif ns > 0:
+        sleep_until(monotonic_ns() + int(ns))
+
+
+calibrate()
@@ -0,0 +1,281 @@
+"""
+    @file Periodic
+    @module RPiComponents.utils.Periodic
+    @author Jacob Calvert <jacob+info@jacobncalvert.com>
+    @date October, 2015
+    @brief Periodic task scheduler
+
+    Runs many periodic functions on one thread. Each task is due at an
+    absolute monotonic deadline, the next one being its last deadline
+    plus the period, so a slow iteration does not push the rest back.
+    The due tasks are kept in a heap ordered by deadline.
+"""
+import errno
+import fcntl
+import heapq
+import os
+import select
+import threading
+
+import Delay
+
+
+class PeriodicTask(object):
+    """
+        A function the Scheduler runs every period, made by Scheduler.add().
+    """
+
+    def __init__(self, function, period_ns, args, count, name):
+        self._function = function
+        self._args = args
+        self._period = period_ns
+        self._count = count
+        self._name = name
+        self._cancelled = False
+        self._scheduler = None
+        self._runs = 0
+        self._overruns = 0
+        self._missed = 0
+        self._errors = 0
+        self._last_error = None
+        self._jitter_sum = 0
+        self._jitter_max = 0
+        self._run_time_max = 0
+
+    def name(self):
+        """
+        @return: the name given to Scheduler.add(), the function's name by default
+        """
+        return self._name
+
+    def period_ms(self):
+        """
+        @return: the period in milliseconds
+        """
+        return self._period * 10**-6
+
+    def cancel(self):
+        """
+        stops the task, a run already in progress finishes
+        """
+        self._cancelled = True
+        if self._scheduler is not None:
+            self._scheduler._wake()
+
+    def is_active(self):
+        """
+        @return: True until the task is cancelled or has run count times
+        """
+        return not self._cancelled
+
+    def last_error(self):
+        """
+        @return: the last exception the function raised, None if it never has
+        """
+        return self._last_error
+
+    def stats(self):
+        """
+        gets the task's timing counters
+        @return: a dict of runs, overruns (runs that ended past the next deadline), missed (deadlines
+                 skipped after an overrun), errors, jitter_mean_us and jitter_max_us (start past the
+                 deadline) and run_time_max_us
+        """
+        return {
+            "runs": self._runs,
+            "overruns": self._overruns,
+            "missed": self._missed,
+            "errors": self._errors,
+            "jitter_mean_us": self._jitter_sum / self._runs / 1000.0 if self._runs else 0.0,
+            "jitter_max_us": self._jitter_max / 1000.0,
+            "run_time_max_us": self._run_time_max / 1000.0,
+        }
+
+
+class Scheduler(object):
+    """
+        Runs PeriodicTasks on one thread, against absolute deadlines.
+        Waits are a select() on a wakeup pipe until the spin threshold
+        before the next deadline, then Delay.sleep_until() for the rest,
+        so tasks added or cancelled from other threads take effect at once.
+
+        Examples
+        @code
+            scheduler = Periodic.Scheduler()
+            scheduler.add(adc.read, 10, args=(adc.CH0,))  # any function or driver method
+            scheduler.add(led.set_brightness, 20, args=(50,), count=1, start_ms=500)
+            scan = scheduler.add(finder.distance_cm, 100)
+            scheduler.start()  # or scheduler.run() on this thread
+            scan.stats()  # {'runs': 10, 'overruns': 0, 'jitter_max_us': 23.1, ...}
+        @endcode
+    """
+
+    def __init__(self):
+        self._heap = list()  # (deadline_ns, sequence, task)
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._stop = threading.Event()  # a new one per run(), so a stale stop() can not end the next run
+        self._thread = None
+
+    def add(self, function, period_ms, args=(), count=None, start_ms=0, name=None):
+        """
+        schedules function(*args) every period_ms
+        @param function: the function or bound driver method to run
+        @param period_ms: the period in milliseconds
+        @param args: the arguments to call it with
+        @param count: the number of runs before the task ends, None for no limit
+        @param start_ms: the delay before the first run
+        @param name: a name for the task, the function's name by default
+        @return: the PeriodicTask
+        """
+        if period_ms <= 0:
+            raise ValueError("The period must be positive.")
+        if count is not None and count < 1:
+            raise ValueError("The count must be at least 1.")
+        if name is None:
+            name = getattr(function, "__name__", repr(function))
+        task = PeriodicTask(function, int(period_ms * 10**6), tuple(args), count, name)
+        task._scheduler = self
+        self._push(Delay.monotonic_ns() + int(start_ms * 10**6), task)
+        self._wake()
+        return task
+
+    def tasks(self):
+        """
+        @return: the tasks still scheduled, soonest first
+        """
+        with self._lock:
+            return [task for deadline, sequence, task in sorted(self._heap) if not task._cancelled]
+
+    def _push(self, deadline, task):
+        with self._lock:
+            self._sequence += 1
+            heapq.heappush(self._heap, (deadline, self._sequence, task))
+
+    def _wake(self):
+        try:
+            os.write(self._wakeup[1], b"\0")
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _wait(self, timeout_ns):
+        try:
+            readable = select.select([self._wakeup[0]], [], [], None if timeout_ns is None else timeout_ns * 10**-9)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        if readable:
+            try:
+                while os.read(self._wakeup[0], 64):
+                    pass
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def run_once(self, timeout_ms=None):
+        """
+        waits for the next task to be due and runs it
+        @param timeout_ms: the longest to wait, None waits until a task is due or stop() is called
+        @return: the PeriodicTask run, None if none was due in time
+        """
+        return self._run_once(timeout_ms, self._stop)
+
+    def _run_once(self, timeout_ms, stop):
+        give_up = None if timeout_ms is None else Delay.monotonic_ns() + int(timeout_ms * 10**6)
+        while True:
+            if stop.is_set():
+                return None  # checked before taking a task, a stopped run never starts another
+            with self._lock:
+                while self._heap and self._heap[0][2]._cancelled:
+                    heapq.heappop(self._heap)
+                deadline, sequence, task = self._heap[0] if self._heap else (None, None, None)
+                now = Delay.monotonic_ns()
+                if deadline is not None and deadline - now <= Delay.spin_threshold_ns():
+                    heapq.heappop(self._heap)
+                    break
+            if give_up is not None and now >= give_up:
+                return None
+            wait = None if deadline is None else deadline - now - Delay.spin_threshold_ns()
+            if give_up is not None and (wait is None or give_up - now < wait):
+                wait = give_up - now
+            self._wait(wait)
+        jitter = Delay.sleep_until(deadline)
+
+        start = Delay.monotonic_ns()
+        try:
+            task._function(*task._args)
+        except Exception as e:
+            task._errors += 1
+            task._last_error = e
+        end = Delay.monotonic_ns()
+
+        task._runs += 1
+        task._jitter_sum += jitter
+        task._jitter_max = max(task._jitter_max, jitter)
+        task._run_time_max = max(task._run_time_max, end - start)
+
+        next_deadline = deadline + task._period
+        if end > next_deadline:
+            missed = (end - next_deadline) // task._period + 1
+            task._overruns += 1
+            task._missed += missed
+            next_deadline += missed * task._period  # skip the deadlines already past rather than bunching up
+        if task._count is not None and task._runs >= task._count:
+            task._cancelled = True
+        if not task._cancelled:
+            self._push(next_deadline, task)
+        return task
+
+    def run(self):
+        """
+        runs tasks on this thread until stop() is called
+        """
+        self._stop = threading.Event()
+        self._loop(self._stop)
+
+    def _loop(self, stop):
+        while not stop.is_set():
+            self._run_once(None, stop)
+
+    def start(self):
+        """
+        runs the tasks on a new thread, a scheduler that was stopped can be started again
+        """
+        if self._thread is not None:
+            return
+        self._stop = threading.Event()  # set up before the thread, so a stop() straight after is not lost
+        self._thread = threading.Thread(target=self._loop, args=(self._stop,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        makes run() and run_once() return after the task in progress, safe to call from any thread or task.
+        From another thread it waits for the scheduler thread to exit, from a task it returns straight
+        away and the thread exits once the task does
+        """
+        self._stop.set()
+        self._wake()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def stats(self):
+        """
+        gets the stats() of every scheduled task, give tasks unique names to see them all
+        @return: a dict of task name -> PeriodicTask.stats()
+        """
+        return dict((task.name(), task.stats()) for task in self.tasks())
+
+    def close(self):
+        """
+        stops the scheduler and closes its wakeup pipe
+        """
+        self.stop()
+        for fd in self._wakeup:
+            os.close(fd)
@@ -0,0 +1,68 @@
+"""
+    @file delay_jitter
+    @brief utils.Delay accuracy and jitter benchmark
+
+    Times short delays made with a plain time.sleep() against the
+    calibrated sleep/spin Delay.sleep_us(), which only spins below
+    Delay.PRECISE_MAX_NS (1ms), then runs a fixed period loop with
+    relative sleeps against one on Delay.sleep_until() deadlines to show
+    the drift. Needs no hardware.
+
+    usage: python benchmarks/delay_jitter.py [samples] [ticks]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+from utils import Delay
+
+DELAYS_US = (10, 50, 100, 500, 1000, 5000)
+PERIOD_US = 1000
+
+
+def errors_us(delay, us, samples):
+    errors = list()
+    for i in range(samples):
+        start = Delay.monotonic_ns()
+        delay(us)
+        errors.append((Delay.monotonic_ns() - start) / 1000.0 - us)
+    errors.sort()
+    return sum(errors) / len(errors), errors[len(errors) * 99 // 100]
+
+
+def time_sleep_us(us):
+    time.sleep(us * 10**-6)
+
+
+def relative_loop(ticks):
+    start = Delay.monotonic_ns()
+    for i in range(ticks):
+        Delay.sleep_us(PERIOD_US)
+    return (Delay.monotonic_ns() - start) / 1000.0 - ticks * PERIOD_US
+
+
+def deadline_loop(ticks):
+    start = deadline = Delay.monotonic_ns()
+    for i in range(ticks):
+        deadline += PERIOD_US * 1000
+        Delay.sleep_until(deadline)
+    return (Delay.monotonic_ns() - start) / 1000.0 - ticks * PERIOD_US
+
+
+def run(samples, ticks):
+    print "spin threshold calibrated to %.0fus" % (Delay.spin_threshold_ns() / 1000.0)
+    print "%-10s %26s %26s" % ("", "time.sleep() error (us)", "Delay.sleep_us() error (us)")
+    print "%-10s %13s %12s %13s %12s" % ("delay", "mean", "p99", "mean", "p99")
+    for us in DELAYS_US:
+        plain = errors_us(time_sleep_us, us, samples)
+        hybrid = errors_us(Delay.sleep_us, us, samples)
+        print "%-10s %13.1f %12.1f %13.1f %12.1f" % ("%dus" % (us), plain[0], plain[1], hybrid[0], hybrid[1])
+    print
+    print "%d ticks of %dus: sleep_us() each tick drifts %.0fus, sleep_until() deadlines drift %.0fus" % (
+        ticks, PERIOD_US, relative_loop(ticks), deadline_loop(ticks))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500, int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
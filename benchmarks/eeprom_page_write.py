@@ -0,0 +1,64 @@
+"""
+    @file eeprom_page_write
+    @brief BasicEEPROM page write benchmark
+
+    Compares the old one-byte-per-transaction write loop with the page
+    write engine in BasicEEPROM.write_bytes, against the simulated 24CXX
+    from the sim backend, so it runs without any hardware.
+
+    usage: python benchmarks/eeprom_page_write.py [num_bytes] [variant]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+import sim
+sim.install("sim")
+
+import EEPROM_24CXX
+
+
+def legacy_write_bytes(eeprom, addr_start, bytes_lst):
+    """
+    the write loop BasicEEPROM.write_bytes used before the page engine,
+    one transaction and a fixed 10ms sleep per byte
+    """
+    for i in range(len(bytes_lst)):
+        addr = addr_start + i
+        eeprom._write_three_bytes([(addr >> 8) & 0x0ff, addr & 0x0ff, bytes_lst[i]])
+        EEPROM_24CXX.BasicEEPROM.usleep(10000)
+
+
+def run(num_bytes, variant):
+    capacity, page_size, address_mode = EEPROM_24CXX.BasicEEPROM.VARIANTS[variant]
+    if address_mode != EEPROM_24CXX.BasicEEPROM.ADDRESS_MODE_16BIT:
+        raise ValueError("The legacy loop is only reproduced for 16 bit parts.")
+    data = bytearray(os.urandom(num_bytes))
+    results = list()
+
+    for name in ("legacy loop", "page engine"):
+        part = sim.i2c.EEPROM24CXX(capacity, page_size, address_mode)
+        sim.i2c.attach(1, part)
+        bus = sim.i2c.SMBus(1, clock_hz=100000)
+        eeprom = EEPROM_24CXX.BasicEEPROM.from_variant(variant, 0x50, 1, _bus=bus)
+        start = time.time()
+        if name == "legacy loop":
+            legacy_write_bytes(eeprom, 0, list(data))
+        else:
+            eeprom.write_bytes(0, data)
+        elapsed = time.time() - start
+        if part.memory[:num_bytes] != data:
+            raise RuntimeError("%s wrote the wrong data" % (name))
+        results.append((name, bus.transactions - part.nacks, part.nacks, elapsed))
+
+    print "%d bytes to a simulated %s (page size %d)" % (num_bytes, variant, page_size)
+    print "%-15s %15s %15s %12s" % ("", "transactions", "NACKed polls", "wall time")
+    for name, transactions, nacks, elapsed in results:
+        print "%-15s %15d %15d %11.3fs" % (name, transactions, nacks, elapsed)
+    print "%-15s %14.1fx %15s %11.1fx" % ("saving", float(results[0][1]) / results[1][1], "", results[0][3] / results[1][3])
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 512, sys.argv[2] if len(sys.argv) > 2 else "24C256")
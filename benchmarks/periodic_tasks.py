@@ -0,0 +1,81 @@
+"""
+    @file periodic_tasks
+    @brief utils.Periodic scheduler benchmark
+
+    Runs a set of periodic jobs for a few seconds two ways: a thread each
+    looping on Delay.sleep_ms(period), the way the driver loops are
+    written, and all of them on one Periodic.Scheduler. Reports how many
+    runs each way fell short of the expected count and the scheduler's
+    jitter. Needs no hardware.
+
+    usage: python benchmarks/periodic_tasks.py [tasks] [seconds]
+"""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+from utils import Delay
+from utils import Periodic
+
+WORK_US = 50  # a driver call's worth of busy time per run
+
+
+def job():
+    Delay.sleep_us(WORK_US)
+
+
+def periods_ms(tasks):
+    return [(2, 5, 10, 20)[i % 4] for i in range(tasks)]
+
+
+def threaded(tasks, seconds):
+    runs = [0] * tasks
+    stopping = [False]
+
+    def loop(i, period):
+        while not stopping[0]:
+            job()
+            runs[i] += 1
+            Delay.sleep_ms(period)
+
+    threads = [threading.Thread(target=loop, args=(i, period)) for i, period in enumerate(periods_ms(tasks))]
+    for thread in threads:
+        thread.start()
+    Delay.sleep_s(seconds)
+    stopping[0] = True
+    for thread in threads:
+        thread.join()
+    return runs
+
+
+def scheduled(tasks, seconds):
+    scheduler = Periodic.Scheduler()
+    added = [scheduler.add(job, period, start_ms=i * 0.08, name="job%d" % (i))  # staggered so deadlines do not coincide
+             for i, period in enumerate(periods_ms(tasks))]
+    scheduler.start()
+    Delay.sleep_s(seconds)
+    scheduler.stop()
+    scheduler.close()
+    return [task.stats() for task in added]
+
+
+def run(tasks, seconds):
+    expected = [int(seconds * 1000 / period) for period in periods_ms(tasks)]
+    runs = threaded(tasks, seconds)
+    stats = scheduled(tasks, seconds)
+    short = lambda counts: 100.0 * (sum(expected) - sum(counts)) / sum(expected)
+    print "%d tasks at 2/5/10/20ms, %dus of work each, for %ss (%d runs expected)" % (
+        tasks, WORK_US, seconds, sum(expected))
+    print "%-32s %10s %12s" % ("", "runs", "short by")
+    print "%-32s %10d %11.1f%%" % ("a thread each, sleep_ms() loop", sum(runs), short(runs))
+    print "%-32s %10d %11.1f%%" % ("one Periodic.Scheduler", sum(s["runs"] for s in stats),
+                                   short([s["runs"] for s in stats]))
+    print "scheduler jitter: mean %.1fus, max %.1fus, %d overruns" % (
+        sum(s["jitter_mean_us"] for s in stats) / len(stats), max(s["jitter_max_us"] for s in stats),
+        sum(s["overruns"] for s in stats))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 24, float(sys.argv[2]) if len(sys.argv) > 2 else 3)
@@ -0,0 +1,105 @@
+"""
+    @file pin_bank
+    @brief PinBank output call benchmark
+
+    Counts gpio.output() calls for LCD1602A1.write_str() and
+    BipolarL293DStepperMotor.step() against the pin at a time writes they
+    used before PinBank, both writing every call and with
+    BasicToggleOutput's cached level skipping repeats, on the simulated
+    GPIO from the sim backend, so it runs without any hardware.
+
+    usage: python benchmarks/pin_bank.py [characters] [steps]
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+import sim
+gpio = sim.install("sim")
+
+from utils import Delay
+Delay.sleep_ms = lambda ms: None  # the LCD's 10ms settle would dominate the run
+Delay.sleep_us = lambda us: None
+
+import BasicLogic
+import L293DMotor
+import LCD
+
+TEXT = "The quick brown fox jumps over"
+FWD_PHASES = ((1, 0, 1, 0), (0, 1, 1, 0), (0, 1, 0, 1), (1, 0, 0, 1))  # 1a, 1b, 2a, 2b
+
+
+class UncachedOutput(BasicLogic.BasicToggleOutput):
+    """
+        Writes on every high()/low(), like BasicToggleOutput before it cached the level.
+    """
+
+    def _write(self, level):
+        self.invalidate()
+        BasicLogic.BasicToggleOutput._write(self, level)
+
+
+def pin_at_a_time_lcd(chars, output=BasicLogic.BasicToggleOutput):
+    en, rs = output(5, _gpio=gpio), output(13, _gpio=gpio)
+    data = [output(pin, _gpio=gpio) for pin in (19, 26, 16, 20)]
+    for c in chars:
+        bits = bin(ord(c))[2:].zfill(8)
+        rs.hi()
+        for half in (bits[:4], bits[4:]):
+            for databit in data:
+                databit.lo()
+            for i in range(4):
+                if half[i] == "1":
+                    data[::-1][i].high()
+            en.hi()
+            en.lo()
+
+
+def pin_at_a_time_stepper(steps, output=BasicLogic.BasicToggleOutput):
+    coils = [output(pin, _gpio=gpio) for pin in (1, 7, 8, 25)]
+    for i in range(steps):
+        for phase in FWD_PHASES:
+            for coil, level in zip(coils, phase):
+                if level:
+                    coil.hi()
+                else:
+                    coil.lo()
+
+
+def pin_bank_lcd(chars):
+    lcd = LCD.LCD1602A1(5, 6, 13, [19, 26, 16, 20], _gpio=gpio)
+    gpio.output_calls = 0
+    for i in range(0, len(chars), 16):
+        lcd.write_str(chars[i:i + 16])
+
+
+def pin_bank_stepper(steps):
+    motor = L293DMotor.BipolarL293DStepperMotor(21, 1, 7, 8, 25, step_delay=0, _gpio=gpio)
+    gpio.output_calls = 0
+    for i in range(steps):
+        motor.step()
+
+
+def count(func, *args):
+    gpio.output_calls = 0
+    func(*args)
+    return gpio.output_calls
+
+
+def run(characters, steps):
+    chars = (TEXT * (characters // len(TEXT) + 1))[:characters]
+    rows = (
+        ("LCD, %d characters" % (characters),
+         count(pin_at_a_time_lcd, chars, UncachedOutput), count(pin_at_a_time_lcd, chars), count(pin_bank_lcd, chars)),
+        ("stepper, %d steps" % (steps),
+         count(pin_at_a_time_stepper, steps, UncachedOutput), count(pin_at_a_time_stepper, steps),
+         count(pin_bank_stepper, steps)),
+    )
+    print "%-24s %12s %12s %12s %10s" % ("gpio.output() calls", "every write", "cached pins", "PinBank", "saving")
+    for name, before, cached, after in rows:
+        print "%-24s %12d %12d %12d %9.1fx" % (name, before, cached, after, float(before) / after)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 320, int(sys.argv[2]) if len(sys.argv) > 2 else 200)
@@ -0,0 +1,53 @@
+"""
+    @file spi_batching
+    @brief SPIBus batched transfer benchmark
+
+    Compares MCP3008.scan() with one xfer2 syscall per conversion against
+    the batched SPI_IOC_MESSAGE path in SPIBus.xfer_many, on the simulated
+    MCP3008 from the sim backend, so it runs without any hardware.
+
+    usage: python benchmarks/spi_batching.py [scans] [syscall_us]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+import sim
+sim.install("sim")
+
+import ADC
+import SPIBus
+
+
+def run(scans, syscall_us):
+    chip = sim.spi.MCP3008()
+    for channel in range(8):
+        chip.set_value(channel, channel * 100)
+    results = list()
+    for name in ("xfer2 per conversion", "batched ioctl"):
+        fake = sim.spi.SpiDev(device=chip, syscall_us=syscall_us)
+        if name == "batched ioctl":
+            spi = SPIBus.SPIBus(0, 0, _spi=fake)
+        else:
+            spi = SPIBus.SPIBus(0, 0, _spi=fake, _ioctl=None)
+        adc = ADC.MCP3008(_spi=spi)
+        out = adc.scan()
+        start = time.time()
+        for i in range(scans):
+            adc.scan(out=out)
+        elapsed = time.time() - start
+        if list(out) != [ch * 100 for ch in range(8)]:
+            raise RuntimeError("%s read the wrong values" % (name))
+        results.append((name, fake.syscalls, elapsed))
+
+    print "%d scans of 8 channels, %dus modelled per syscall" % (scans, syscall_us)
+    print "%-22s %12s %14s %12s" % ("", "syscalls", "scans/s", "wall time")
+    for name, syscalls, elapsed in results:
+        print "%-22s %12d %14.0f %11.3fs" % (name, syscalls, scans / elapsed, elapsed)
+    print "%-22s %11.1fx %13.1fx" % ("saving", float(results[0][1]) / results[1][1], results[0][2] / results[1][2])
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000, int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -0,0 +1,252 @@
+"""
+    @file test_adc
+    @brief ADC tests against the simulated MCP3008
+
+    usage: python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import unittest
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+import sim
+sim.install("sim")
+
+import ADC
+from ADC import ADCAcquisition, ADCPipeline, MCP3008, MCP3008Array
+from SPIBus import SPIBus
+
+
+def wait_for(condition, timeout=5):
+    """
+    polls condition() until it is true or timeout seconds pass
+    @return: the last value of condition()
+    """
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+def copy_view(typecode, view):
+    """
+    copies a zero-copy block view back into a list of values
+    """
+    values = array(typecode)
+    if hasattr(values, "frombytes"):
+        values.frombytes(bytes(view))
+    else:
+        values.fromstring(bytes(view))  # python 2, where the views are buffer objects
+    return list(values)
+
+
+class ADCTestCase(unittest.TestCase):
+
+    def adc(self, values=(100, 200, 300, 400, 500, 600, 700, 800)):
+        """
+        @return: (MCP3008, the simulated chip, the simulated spidev)
+        """
+        chip = sim.spi.MCP3008()
+        for channel, value in enumerate(values):
+            chip.set_value(channel, value)
+        dev = sim.spi.SpiDev(device=chip)
+        return MCP3008(_spi=SPIBus(0, 0, _spi=dev)), chip, dev
+
+
+class MCP3008Test(ADCTestCase):
+
+    def test_read(self):
+        adc, chip, dev = self.adc()
+        self.assertEqual(adc.read(MCP3008.CH3), 400)
+        self.assertEqual(adc.read(MCP3008.CH1_POS_CH0_NEG), 100)
+        self.assertEqual(adc.read(MCP3008.CH0_POS_CH1_NEG), 0)  # clipped at 0, not negative
+
+    def test_read_many(self):
+        adc, chip, dev = self.adc()
+        self.assertEqual(list(adc.read_many([MCP3008.CH7, MCP3008.CH0, MCP3008.CH7])), [800, 100, 800])
+        before = dev.syscalls
+        adc.read_many([MCP3008.CH7, MCP3008.CH0, MCP3008.CH7])
+        self.assertEqual(dev.syscalls - before, 1)  # one batched message for every conversion
+        self.assertEqual(chip.conversions, 6)
+
+    def test_read_many_into(self):
+        adc, chip, dev = self.adc()
+        out = array('H', [0]) * 6
+        self.assertTrue(adc.read_many([MCP3008.CH1, MCP3008.CH2], out, 3) is out)
+        self.assertEqual(list(out), [0, 0, 0, 200, 300, 0])
+
+    def test_read_many_bad_channel(self):
+        adc, chip, dev = self.adc()
+        self.assertRaises(ValueError, adc.read_many, [MCP3008.CH0, 16])
+        self.assertEqual(chip.conversions, 0)
+
+    def test_scan(self):
+        adc, chip, dev = self.adc()
+        self.assertEqual(list(adc.scan()), [100, 200, 300, 400, 500, 600, 700, 800])
+        self.assertEqual(list(adc.scan(differential=True)), [0, 100, 0, 100, 0, 100, 0, 100])
+        chip.set_voltage(MCP3008.CH5, 3.3)
+        self.assertEqual(adc.scan()[MCP3008.CH5], 1023)
+
+
+class ADCAcquisitionTest(ADCTestCase):
+
+    def test_frames(self):
+        adc, chip, dev = self.adc()
+        for spin in (True, False):
+            acq = adc.start_acquisition([MCP3008.CH2, MCP3008.CH0], 2000, capacity=64, spin=spin)
+            self.assertTrue(wait_for(lambda: acq.available() >= 10))
+            acq.stop()
+            timestamps, samples, count = acq.read_block()
+            self.assertGreaterEqual(count, 10)
+            self.assertEqual(copy_view('H', samples), [300, 100] * count)
+            timestamps = copy_view('d', timestamps)
+            self.assertEqual(timestamps, sorted(timestamps))
+            acq.release(count)
+            self.assertEqual(acq.available(), 0)
+            self.assertEqual(acq.stats()["frames"], count)
+
+    def test_overrun(self):
+        adc, chip, dev = self.adc()
+        acq = adc.start_acquisition([MCP3008.CH0], 2000, capacity=4)
+        self.assertTrue(wait_for(lambda: acq.stats()["overruns"] > 0))
+        acq.stop()
+        self.assertEqual(acq.available(), 4)  # unread frames are kept, new ones are dropped
+        timestamps, samples, count = acq.read_block(max_frames=3)
+        self.assertEqual(count, 3)
+
+    def test_error(self):
+        adc, chip, dev = self.adc()
+        acq = ADCAcquisition(adc, [MCP3008.CH0], 2000, capacity=1024)
+        transfer_many = adc._transfer_many
+        calls = [0]
+
+        def failing(commands):
+            calls[0] += 1
+            if calls[0] > 5:
+                raise IOError("spi gone")
+            return transfer_many(commands)
+        adc._transfer_many = failing
+        acq.start()
+        self.assertTrue(wait_for(lambda: not acq.stats()["running"]))
+        self.assertTrue(isinstance(acq.stats()["error"], IOError))
+        timestamps, samples, count = acq.read_block()
+        self.assertEqual(count, 5)  # the frames before the failure are still readable
+        acq.release(count)
+        self.assertRaises(IOError, acq.read_block)
+
+        adc._transfer_many = transfer_many
+        acq.start()  # a restart clears the error
+        self.assertEqual(acq.stats()["error"], None)
+        self.assertTrue(wait_for(lambda: acq.available() > 0))
+        acq.stop()
+
+    def test_rate(self):
+        adc, chip, dev = self.adc()
+        self.assertRaises(ValueError, ADCAcquisition, adc, [MCP3008.CH0], 0)
+        self.assertRaises(ValueError, ADCAcquisition, adc, [MCP3008.CH0, 16], 100)
+
+
+@unittest.skipIf(ADC.numpy is None, "ADCPipeline needs numpy")
+class ADCPipelineTest(unittest.TestCase):
+
+    def assertRows(self, result, expected):
+        self.assertEqual(result.shape, (len(expected), len(expected[0])))
+        for row, want in zip(result.tolist(), expected):
+            for value, v in zip(row, want):
+                self.assertAlmostEqual(value, v)
+
+    def test_calibration(self):
+        pipe = ADCPipeline(2, gain=[2, 1], offset=[0, -12], vref=1.024)
+        self.assertRows(pipe.process(array('H', [0, 512, 1023, 100])), [[0.0, 0.5], [2.046, 0.088]])
+        pipe = ADCPipeline(2)
+        self.assertRows(pipe.process(ADC.numpy.array([[1, 2], [3, 4]])), [[1, 2], [3, 4]])
+
+    def test_mean(self):
+        pipe = ADCPipeline(1, filter_mode=ADCPipeline.FILTER_MEAN, window=4)
+        # the history starts out as the first frame repeated, and carries over between blocks
+        self.assertRows(pipe.process(array('H', [0, 1, 2, 3])), [[0.0], [0.25], [0.75], [1.5]])
+        self.assertRows(pipe.process(array('H', [4, 5, 6, 7])), [[2.5], [3.5], [4.5], [5.5]])
+
+    def test_median(self):
+        pipe = ADCPipeline(2, filter_mode=ADCPipeline.FILTER_MEDIAN, window=3)
+        result = pipe.process(array('H', [5, 0, 5, 10, 900, 0, 5, 0, 5, 9, 5, 0]))
+        self.assertRows(result, [[5, 0]] * 6)  # single sample spikes are removed
+
+    def test_iir(self):
+        pipe = ADCPipeline(1, filter_mode=ADCPipeline.FILTER_IIR, alpha=0.5)
+        self.assertRows(pipe.process(array('H', [0, 8, 8, 8])), [[0.0], [4.0], [6.0], [7.0]])
+
+    def test_iir_long_blocks(self):
+        values = [(i * 37) % 1024 for i in range(3000)]
+        expected = list()
+        y = values[0]
+        for x in values:
+            y += 0.5 * (x - y)
+            expected.append([y])
+        pipe = ADCPipeline(1, filter_mode=ADCPipeline.FILTER_IIR, alpha=0.5)
+        # long enough to be evaluated in several segments, and split across blocks
+        self.assertRows(pipe.process(array('H', values[:1700])), expected[:1700])
+        self.assertRows(pipe.process(array('H', values[1700:])), expected[1700:])
+
+    def test_decimation(self):
+        pipe = ADCPipeline(1, decimation=3)
+        kept = [pipe.process(array('H', block)).tolist() for block in ([0, 1, 2], [3, 4, 5, 6], [7, 8, 9])]
+        self.assertEqual(kept, [[[0.0]], [[3.0], [6.0]], [[9.0]]])
+        pipe.reset()
+        self.assertEqual(pipe.process(array('H', [1, 2, 3])).tolist(), [[1.0]])
+
+    def test_bad_args(self):
+        self.assertRaises(ValueError, ADCPipeline, 1, window=0)
+        self.assertRaises(ValueError, ADCPipeline, 1, decimation=0)
+        self.assertRaises(ValueError, ADCPipeline, 1, filter_mode=ADCPipeline.FILTER_IIR, alpha=0)
+
+
+class MCP3008ArrayTest(ADCTestCase):
+
+    def chips(self):
+        """
+        @return: three MCP3008s, two on bus 0 and one on bus 1, with chip i reading 100 * i + channel
+        """
+        chips = list()
+        for i, (bus, port) in enumerate([(0, 0), (0, 1), (1, 0)]):
+            chip = sim.spi.MCP3008()
+            for channel in range(8):
+                chip.set_value(channel, 100 * i + channel)
+            chips.append(MCP3008(_spi=SPIBus(bus, port, _spi=sim.spi.SpiDev(device=chip))))
+        return chips
+
+    def test_read_frame(self):
+        for schedule in (MCP3008Array.SCHEDULE_ROUND_ROBIN, MCP3008Array.SCHEDULE_THREAD_PER_BUS):
+            adcs = MCP3008Array(self.chips(), channels=[MCP3008.CH1, MCP3008.CH6], schedule=schedule)
+            self.addCleanup(adcs.close)
+            for frame in range(3):
+                timestamp, values = adcs.read_frame()
+                self.assertEqual(list(values), [1, 6, 101, 106, 201, 206])
+            latency = adcs.latency()
+            self.assertEqual(len(latency), 3)
+            for chip in latency:
+                self.assertTrue(0 <= chip["last"] <= chip["max"])
+                self.assertTrue(0 <= chip["mean"] <= chip["max"])
+
+    def test_error(self):
+        for schedule in (MCP3008Array.SCHEDULE_ROUND_ROBIN, MCP3008Array.SCHEDULE_THREAD_PER_BUS):
+            chips = self.chips()
+            adcs = MCP3008Array(chips, schedule=schedule)
+            self.addCleanup(adcs.close)
+
+            def failing(commands):
+                raise IOError("spi gone")
+            chips[2]._transfer_many = failing
+            self.assertRaises(IOError, adcs.read_frame)
+            del chips[2]._transfer_many
+            self.assertEqual(adcs.read_frame()[1][16], 200)  # the array keeps working once the bus is back
+
+    def test_bad_channel(self):
+        self.assertRaises(ValueError, MCP3008Array, self.chips(), channels=[MCP3008.CH0, 16])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,220 @@
+"""
+    @file test_basiclogic
+    @brief BasicLogic tests against the simulated GPIO
+
+    usage: python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+import sim
+sim.install("sim")
+
+from BasicLogic import BasicToggleInputOutput, BasicToggleOutput, OutputGroup, PinBank, ToggleInputCallback, output_stats
+
+PINS = [4, 17, 27, 22]
+
+
+class OldGPIO(sim.gpio.GPIO):
+    """
+        A simulated GPIO that takes one channel per output() call, like RPi.GPIO before 0.5.8.
+    """
+
+    def output(self, channel, value):
+        if isinstance(channel, (list, tuple)):
+            raise ValueError("Channel must be an integer")
+        sim.gpio.GPIO.output(self, channel, value)
+
+
+class PinBankTest(unittest.TestCase):
+
+    def levels(self, board):
+        return [board.input(pin) for pin in PINS]
+
+    def test_initial(self):
+        board = sim.gpio.GPIO()
+        bank = PinBank(PINS, initial=0x9, _gpio=board)
+        self.assertEqual(self.levels(board), [1, 0, 0, 1])
+        self.assertEqual((bank.state(), bank.pins()), (0x9, tuple(PINS)))
+
+    def test_write(self):
+        board = sim.gpio.GPIO()
+        bank = PinBank(PINS, _gpio=board)
+        calls = board.output_calls
+        writes = [board.writes(pin) for pin in PINS]
+        bank.write(0x5)
+        self.assertEqual(self.levels(board), [1, 0, 1, 0])
+        self.assertEqual(board.output_calls - calls, 1)  # both pins in one list-form output()
+        bank.write(0x6)
+        self.assertEqual(self.levels(board), [0, 1, 1, 0])
+        self.assertEqual([board.writes(pin) - n for pin, n in zip(PINS, writes)], [2, 1, 1, 0])  # 27 is not written again
+        bank.write(0x16)  # bits past the last pin are ignored
+        self.assertEqual(bank.state(), 0x6)
+        self.assertEqual(bank.stats(), dict(output_calls=2, pin_writes=4, elided_pins=8, elided_updates=1))
+
+    def test_set_clear(self):
+        board = sim.gpio.GPIO()
+        bank = PinBank(PINS, initial=0x1, _gpio=board)
+        bank.set(0xa)
+        self.assertEqual(self.levels(board), [1, 1, 0, 1])
+        bank.clear(0x3)
+        self.assertEqual(self.levels(board), [0, 0, 0, 1])
+
+    def test_force(self):
+        board = sim.gpio.GPIO()
+        bank = PinBank(PINS, initial=0x3, _gpio=board)
+        writes = [board.writes(pin) for pin in PINS]
+        bank.write(0x3, force=True)
+        self.assertEqual([board.writes(pin) - n for pin, n in zip(PINS, writes)], [1, 1, 1, 1])
+
+    def test_old_gpio(self):
+        board = OldGPIO()
+        bank = PinBank(PINS, _gpio=board)
+        bank.write(0xf)
+        bank.write(0x0)
+        self.assertEqual(self.levels(board), [0, 0, 0, 0])
+        self.assertEqual(bank.stats()["output_calls"], 8)  # one call per pin once lists are refused
+
+    def test_reset_stats(self):
+        bank = PinBank(PINS, _gpio=sim.gpio.GPIO())
+        bank.write(0x1)
+        bank.reset_stats()
+        self.assertEqual(bank.stats(), dict(output_calls=0, pin_writes=0, elided_pins=0, elided_updates=0))
+
+    def test_bad_pins(self):
+        self.assertRaises(ValueError, PinBank, [], _gpio=sim.gpio.GPIO())
+        self.assertRaises(ValueError, PinBank, [4, 17, 4], _gpio=sim.gpio.GPIO())
+        self.assertTrue(OutputGroup is PinBank)
+
+
+class WriteElisionTest(unittest.TestCase):
+
+    def test_output(self):
+        board = sim.gpio.GPIO()
+        out = BasicToggleOutput(4, _gpio=board)
+        writes = board.writes(4)
+        out.low()  # the level after setup() is not trusted, the first write goes out
+        out.low()
+        out.hi()
+        out.high()
+        self.assertEqual(board.writes(4) - writes, 2)
+        self.assertEqual(out.elided_writes(), 2)
+        self.assertEqual(out.value(), 1)
+        self.assertEqual(out.stats(), dict(output_calls=2, pin_writes=2, elided_pins=2, elided_updates=2))
+
+    def test_invalidate(self):
+        board = sim.gpio.GPIO()
+        out = BasicToggleOutput(4, _gpio=board)
+        out.high()
+        board.output(4, 0)  # driven behind the object's back
+        self.assertEqual(out.value(), 1)
+        out.invalidate()
+        self.assertEqual(out.value(), 0)
+        out.high()
+        self.assertEqual(board.input(4), 1)
+
+    def test_input_output(self):
+        board = sim.gpio.GPIO()
+        pin = BasicToggleInputOutput(4, mode=BasicToggleInputOutput.MODE_OUT, _gpio=board)
+        writes = board.writes(4)
+        pin.high()
+        pin.high()
+        self.assertEqual((board.writes(4) - writes, pin.elided_writes()), (1, 1))
+        pin.set_input()  # switching direction forgets the level
+        board.drive(4, 0)
+        self.assertEqual(pin.value(), 0)
+        pin.set_output()
+        writes = board.writes(4)
+        pin.high()
+        self.assertEqual(board.writes(4) - writes, 1)
+
+    def test_output_stats(self):
+        board = sim.gpio.GPIO()
+        out = BasicToggleOutput(5, _gpio=board)
+        bank = PinBank(PINS, _gpio=board)
+        out.high()
+        out.high()
+        bank.write(0x3)
+        self.assertEqual(output_stats([out, bank]), dict(output_calls=2, pin_writes=3, elided_pins=3, elided_updates=1))
+
+
+class QueuedCallbackTest(unittest.TestCase):
+
+    def switch(self, callback, **kwargs):
+        """
+        @return: (ToggleInputCallback in queue mode on pin 6, the simulated board)
+        """
+        board = sim.gpio.GPIO()
+        kwargs.setdefault("queue_size", 16)
+        kwargs.setdefault("debounce_delay", 0)
+        switch = ToggleInputCallback(6, callback, edge=board.BOTH, _gpio=board, **kwargs)
+        self.addCleanup(switch.close)
+        return switch, board
+
+    def toggle(self, board, levels):
+        for level in levels:
+            board.drive(6, level)
+            board.wait_idle()  # one edge at a time, so each is read at its own level
+
+    def test_events(self):
+        batches = list()
+        switch, board = self.switch(lambda pin, events: batches.append((pin, events)))
+        self.toggle(board, [1, 0, 1])
+        self.assertTrue(switch.wait_idle(5))
+        events = [event for pin, batch in batches for event in batch]
+        self.assertEqual(set(pin for pin, batch in batches), set([6]))
+        self.assertEqual([level for timestamp, level in events], [1, 0, 1])
+        timestamps = [timestamp for timestamp, level in events]
+        self.assertEqual(timestamps, sorted(timestamps))
+        stats = switch.stats()
+        self.assertEqual((stats["captured"], stats["dispatched"], stats["dropped"]), (3, 3, 0))
+        self.assertEqual(switch.pending(), 0)
+
+    def test_debounce(self):
+        events = list()
+        switch, board = self.switch(lambda pin, batch: events.extend(batch), debounce_delay=10000)
+        self.toggle(board, [1, 0, 1, 0])
+        self.assertTrue(switch.wait_idle(5))
+        self.assertEqual([level for timestamp, level in events], [1])  # the rest fell inside the window
+        self.assertEqual(switch.stats()["dropped"], 3)
+
+    def test_slow_callback(self):
+        release = threading.Event()
+        batches = list()
+
+        def slow(pin, events):
+            release.wait(5)
+            batches.append(len(events))
+        switch, board = self.switch(slow, queue_size=4, batch_size=2)
+        self.toggle(board, [1, 0] * 5)
+        stats = switch.stats()
+        self.assertGreater(stats["overruns"], 0)  # the ring filled up behind the callback
+        self.assertEqual(stats["captured"] + stats["overruns"], 10)
+        release.set()
+        self.assertTrue(switch.wait_idle(5))
+        self.assertEqual(sum(batches), stats["captured"])
+        self.assertTrue(max(batches) <= 2)
+        self.assertEqual(switch.stats()["high_water"], 4)
+
+    def test_callback_error(self):
+        def failing(pin, events):
+            raise RuntimeError("callback failed")
+        switch, board = self.switch(failing)
+        self.toggle(board, [1])
+        self.assertTrue(switch.wait_idle(5))
+        self.toggle(board, [0])
+        self.assertTrue(switch.wait_idle(5))
+        self.assertEqual(switch.stats()["callback_errors"], 2)  # the dispatcher carries on
+
+    def test_bad_args(self):
+        board = sim.gpio.GPIO()
+        self.assertRaises(ValueError, ToggleInputCallback, 6, _gpio=board, queue_size=-1)
+        self.assertRaises(ValueError, ToggleInputCallback, 7, _gpio=board, queue_size=4, batch_size=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
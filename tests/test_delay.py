@@ -0,0 +1,95 @@
+"""
+    @file test_delay
+    @brief utils.Delay tests
+
+    usage: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+from utils import Delay
+
+
+class SleepUntilTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(Delay.set_spin_threshold_ns, Delay.spin_threshold_ns())
+
+    def test_deadline(self):
+        deadline = Delay.monotonic_ns() + 300000
+        late = Delay.sleep_until(deadline)
+        now = Delay.monotonic_ns()
+        self.assertGreaterEqual(late, 0)
+        self.assertGreaterEqual(now, deadline)
+        self.assertLessEqual(deadline + late, now)
+
+    def test_precision(self):
+        lateness = list()
+        for i in range(21):
+            lateness.append(Delay.sleep_until(Delay.monotonic_ns() + 300000))
+        lateness.sort()
+        self.assertLess(lateness[10], 200000)  # the spun tail keeps the median well under time.sleep()'s overshoot
+
+    def test_past_deadline(self):
+        start = Delay.monotonic_ns()
+        late = Delay.sleep_until(start - 5000000)
+        self.assertGreaterEqual(late, 5000000)
+        self.assertLess(Delay.monotonic_ns() - start, 5000000)  # returns straight away
+
+    def test_no_drift(self):
+        start = deadline = Delay.monotonic_ns()
+        for i in range(50):
+            deadline += 1000000
+            Delay.sleep_until(deadline)
+        # a late tick does not push the ones after it back
+        self.assertLess(Delay.monotonic_ns() - start, 50 * 1000000 + 5000000)
+
+    def test_spin_threshold(self):
+        self.assertTrue(Delay.SPIN_MIN_NS <= Delay.calibrate(samples=4) <= Delay.SPIN_MAX_NS)
+        Delay.set_spin_threshold_ns(0)  # sleeps all the way
+        self.assertEqual(Delay.spin_threshold_ns(), 0)
+        self.assertGreaterEqual(Delay.sleep_until(Delay.monotonic_ns() + 100000), 0)
+        self.assertRaises(ValueError, Delay.set_spin_threshold_ns, -1)
+
+
+class RelativeSleepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.deadlines = list()
+        sleep_until = Delay.sleep_until
+
+        def recording(deadline_ns):
+            self.deadlines.append(deadline_ns)
+            return sleep_until(deadline_ns)
+        Delay.sleep_until = recording
+        self.addCleanup(setattr, Delay, "sleep_until", sleep_until)
+
+    def elapsed_ns(self, delay, value):
+        start = Delay.monotonic_ns()
+        delay(value)
+        return Delay.monotonic_ns() - start
+
+    def test_sub_ms_spins(self):
+        self.assertGreaterEqual(self.elapsed_ns(Delay.sleep_us, 200), 200000)
+        self.assertGreaterEqual(self.elapsed_ns(Delay.sleep_ns, 50000), 50000)
+        self.assertEqual(len(self.deadlines), 2)
+
+    def test_long_delays_sleep(self):
+        self.assertGreaterEqual(self.elapsed_ns(Delay.sleep_ms, 2), 2000000)
+        self.assertGreaterEqual(self.elapsed_ns(Delay.sleep_s, 0.002), 2000000)
+        self.assertGreaterEqual(self.elapsed_ns(Delay.sleep_us, 2000), 2000000)
+        self.assertGreaterEqual(self.elapsed_ns(Delay.sleep_ms, 0.5), 500000)
+        self.assertEqual(self.deadlines, [])  # plain time.sleep(), no spinning
+
+    def test_non_positive(self):
+        for delay in (Delay.sleep_s, Delay.sleep_ms, Delay.sleep_us, Delay.sleep_ns):
+            delay(0)
+            delay(-1)
+        self.assertEqual(self.deadlines, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,322 @@
+"""
+    @file test_eeprom
+    @brief EEPROM_24CXX tests against the simulated 24CXX
+
+    usage: python -m unittest discover tests
+"""
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+import sim
+sim.install("sim")
+
+from EEPROM_24CXX import BasicEEPROM, CachedEEPROM, EEPROMImage, QueuedEEPROMWriter
+
+BUS = 1
+
+
+class SMBusOnly(sim.i2c.SMBus):
+    """
+        A simulated bus without the raw transactions, like smbus.SMBus
+        when /dev/i2c-N can not be opened directly.
+    """
+
+    def __getattribute__(self, name):
+        if name in ("write_raw", "read_raw"):
+            raise AttributeError(name)
+        return sim.i2c.SMBus.__getattribute__(self, name)
+
+
+class EEPROMTestCase(unittest.TestCase):
+
+    def eeprom(self, variant="24C256", bus_class=sim.i2c.SMBus, write_cycle_ms=0):
+        """
+        @return: (BasicEEPROM, the simulated part, the simulated bus)
+        """
+        capacity, page_size, address_mode = BasicEEPROM.VARIANTS[variant]
+        part = sim.i2c.EEPROM24CXX(capacity, page_size, address_mode, write_cycle_ms=write_cycle_ms)
+        sim.i2c.attach(BUS, part)
+        self.addCleanup(sim.i2c.detach, BUS, part)
+        bus = bus_class(BUS)
+        return BasicEEPROM.from_variant(variant, 0x50, BUS, _bus=bus), part, bus
+
+
+class BasicEEPROMTest(EEPROMTestCase):
+
+    def test_page_split(self):
+        eeprom, part, bus = self.eeprom()
+        data = bytearray(os.urandom(200))
+        self.assertEqual(eeprom.write_bytes(40, data), len(data))
+        self.assertEqual(part.memory[40:240], data)
+        # 40-63, 64-127, 128-191, 192-239: one transaction per page piece
+        self.assertEqual(part.writes, 4)
+
+    def test_page_split_smbus_blocks(self):
+        eeprom, part, bus = self.eeprom(bus_class=SMBusOnly)
+        data = bytearray(os.urandom(128))
+        eeprom.write_bytes(0, data)
+        self.assertEqual(part.memory[:128], data)
+        # a 64 byte page is 31 + 31 + 2 bytes in 32 byte SMBus blocks with a 2 byte address
+        self.assertEqual(part.writes, 6)
+
+    def test_ack_polling(self):
+        eeprom, part, bus = self.eeprom(write_cycle_ms=2)
+        data = bytearray(os.urandom(256))
+        eeprom.write_bytes(0, data)  # each page write waits out the last one's write cycle
+        self.assertEqual(part.memory[:256], data)
+        self.assertEqual(part.writes, 4)
+        self.assertGreater(part.nacks, 0)
+
+    def test_write_byte(self):
+        eeprom, part, bus = self.eeprom()
+        eeprom.write_byte(0x1234, 0xa5)
+        self.assertEqual(part.memory[0x1234], 0xa5)
+        self.assertEqual(eeprom.read_byte(0x1234), 0xa5)
+
+    def test_block_select(self):
+        eeprom, part, bus = self.eeprom("24C16")
+        data = bytearray(os.urandom(100))
+        eeprom.write_bytes(0x1e0, data)  # crosses from block 1 into block 2
+        self.assertEqual(part.memory[0x1e0:0x1e0 + len(data)], data)
+
+    def test_raw_block_read(self):
+        eeprom, part, bus = self.eeprom()
+        part.memory[:600] = os.urandom(600)
+        before = bus.transactions
+        self.assertEqual(eeprom.read_bytes(0, 600), part.memory[:600])
+        self.assertEqual(bus.transactions - before, 6)  # an address write and a read per 256 bytes
+
+    def test_smbus_read(self):
+        for variant in ("24C16", "24C256"):
+            eeprom, part, bus = self.eeprom(variant, bus_class=SMBusOnly)
+            part.memory[:300] = os.urandom(300)
+            self.assertEqual(eeprom.read_bytes(0, 300), part.memory[:300])
+
+    def test_stream_bytes(self):
+        eeprom, part, bus = self.eeprom("24C16")
+        part.memory[:] = os.urandom(len(part.memory))
+        chunks = list(eeprom.stream_bytes(0xf0, 0x120, chunk_size=64))
+        # chunks stop at the 256 byte block boundary, where the device address changes
+        self.assertEqual([len(chunk) for chunk in chunks], [16, 64, 64, 64, 64, 16])
+        self.assertEqual(bytearray().join(chunks), part.memory[0xf0:0x210])
+
+    def test_read_back(self):
+        eeprom, part, bus = self.eeprom("24C16")
+        eeprom.write_string(0x1fe, "across blocks")
+        self.assertEqual(eeprom.read_string(0x1fe, 13), "across blocks")
+
+    def test_diff_write(self):
+        eeprom, part, bus = self.eeprom()
+        data = bytearray(os.urandom(256))
+        eeprom.write_bytes(0, data)
+        writes = part.writes
+        data[70] ^= 0xff
+        data[200] ^= 0xff
+        self.assertEqual(eeprom.write_bytes(0, data, diff=True), 2)
+        self.assertEqual(part.writes - writes, 2)
+        self.assertEqual(part.memory[:256], data)
+
+    def test_diff_write_span(self):
+        eeprom, part, bus = self.eeprom()
+        data = bytearray(64)
+        data[10] = data[20] = 1
+        self.assertEqual(eeprom.write_bytes(0, data, diff=True), 11)  # 10-20 as one write, not the page
+        self.assertEqual(part.writes, 1)
+
+    def test_fill_space(self):
+        eeprom, part, bus = self.eeprom()
+        self.assertEqual(eeprom.fill_space(32, 160, 0xff), 128)
+        self.assertEqual(part.memory[32:160], bytearray(b"\xff") * 128)
+        self.assertEqual((part.memory[31], part.memory[160]), (0, 0))
+        self.assertEqual(part.writes, 3)  # 32-63, 64-127, 128-159
+        self.assertEqual(eeprom.fill_space(0, 256, 0xff, diff=True), 32 + 32 + 64)  # 0-31, 160-191, 192-255
+        self.assertEqual(part.memory[:256], bytearray(b"\xff") * 256)
+
+    def test_variants(self):
+        eeprom, part, bus = self.eeprom("24C02")
+        self.assertEqual((eeprom.capacity(), eeprom.page_size()), (256, 8))
+        self.assertRaises(ValueError, BasicEEPROM.from_variant, "24C03", 0x50, BUS, _bus=bus)
+
+
+class CachedEEPROMTest(EEPROMTestCase):
+
+    def test_write_back(self):
+        eeprom, part, bus = self.eeprom()
+        cache = CachedEEPROM(eeprom, max_pages=4)
+        cache.write_byte(0x10, 42)
+        cache.write_bytes(0x20, b"abc")
+        self.assertEqual(part.writes, 0)
+        self.assertEqual(cache.read_byte(0x10), 42)
+        self.assertEqual(cache.stats()["dirty_pages"], 1)
+        cache.flush()
+        self.assertEqual(part.writes, 1)  # the changed span 0x10-0x22 as one page write
+        self.assertEqual(part.memory[0x10], 42)
+        self.assertEqual(bytes(part.memory[0x20:0x23]), b"abc")
+        self.assertEqual(cache.stats()["dirty_pages"], 0)
+
+    def test_unchanged_bytes_stay_clean(self):
+        eeprom, part, bus = self.eeprom()
+        part.memory[0:64] = bytearray(b"x") * 64
+        cache = CachedEEPROM(eeprom)
+        cache.write_bytes(0, b"xxxx")
+        cache.flush()
+        self.assertEqual(part.writes, 0)
+
+    def test_eviction(self):
+        eeprom, part, bus = self.eeprom()
+        cache = CachedEEPROM(eeprom, max_pages=2)
+        for page in range(3):
+            cache.write_byte(page * 64, page + 1)
+        stats = cache.stats()
+        self.assertEqual((stats["evictions"], stats["writebacks"], stats["cached_pages"]), (1, 1, 2))
+        self.assertEqual(part.memory[0], 1)  # the least recently used page was written back
+        self.assertEqual(part.memory[64], 0)
+
+    def test_hits_and_misses(self):
+        eeprom, part, bus = self.eeprom()
+        part.memory[:128] = os.urandom(128)
+        cache = CachedEEPROM(eeprom)
+        self.assertEqual(cache.read_bytes(60, 10), part.memory[60:70])  # spans two pages
+        self.assertEqual(cache.read_bytes(60, 10), part.memory[60:70])
+        stats = cache.stats()
+        self.assertEqual((stats["misses"], stats["hits"]), (2, 2))
+
+    def test_whole_page_not_loaded(self):
+        eeprom, part, bus = self.eeprom()
+        cache = CachedEEPROM(eeprom)
+        cache.write_bytes(128, bytearray(os.urandom(64)))
+        self.assertEqual(cache.stats()["misses"], 0)
+
+    def test_invalidate(self):
+        eeprom, part, bus = self.eeprom()
+        cache = CachedEEPROM(eeprom)
+        cache.read_byte(0)
+        part.memory[0] = 7  # written behind the cache's back
+        self.assertEqual(cache.read_byte(0), 0)
+        cache.invalidate()
+        self.assertEqual(cache.read_byte(0), 7)
+
+    def test_max_pages(self):
+        eeprom, part, bus = self.eeprom()
+        self.assertRaises(ValueError, CachedEEPROM, eeprom, max_pages=0)
+
+
+class EEPROMImageTest(EEPROMTestCase):
+
+    def test_lazy_load(self):
+        eeprom, part, bus = self.eeprom()
+        part.memory[:256] = os.urandom(256)
+        img = EEPROMImage(eeprom, size=1024)
+        self.assertEqual(bus.transactions, 0)
+        self.assertEqual(bytearray(img[70:80]), part.memory[70:80])
+        before = bus.transactions
+        self.assertEqual(img[75], part.memory[75])
+        self.assertEqual(bytearray(img.view(64, 128)), part.memory[64:128])
+        self.assertEqual(bus.transactions, before)  # the page is already loaded
+
+    def test_pack_unpack(self):
+        eeprom, part, bus = self.eeprom()
+        img = EEPROMImage(eeprom, size=1024)
+        img.pack_into("<II", 0x100, 1, 2)
+        self.assertEqual(img.unpack_from("<II", 0x100), (1, 2))
+        self.assertEqual(struct.unpack_from("<II", img[0x100:0x108]), (1, 2))
+        self.assertRaises(ValueError, img.pack_into, "<I", 1022, 0)
+
+    def test_commit(self):
+        eeprom, part, bus = self.eeprom()
+        img = EEPROMImage(eeprom, size=1024)
+        img[60:68] = b"abcdefgh"  # meets across the 64 byte page boundary
+        img[300] = 7
+        self.assertTrue(img.dirty())
+        self.assertEqual(part.writes, 0)
+        self.assertEqual(img.commit(), 9)
+        self.assertFalse(img.dirty())
+        self.assertEqual(bytes(part.memory[60:68]), b"abcdefgh")
+        self.assertEqual(part.memory[300], 7)
+        self.assertEqual(img.commit(), 0)
+
+    def test_slice_size(self):
+        eeprom, part, bus = self.eeprom()
+        img = EEPROMImage(eeprom, size=1024)
+        self.assertRaises(ValueError, img.__setitem__, slice(0, 4), b"abc")
+        self.assertRaises(ValueError, img.__getitem__, slice(0, 8, 2))
+        self.assertRaises(IndexError, img.__getitem__, 1024)
+
+    def test_failed_commit_stays_dirty(self):
+        eeprom, part, bus = self.eeprom()
+        img = EEPROMImage(eeprom, size=1024)
+        img[10:14] = b"abcd"
+        sim.i2c.detach(BUS, part)
+        self.assertRaises(IOError, img.commit)
+        self.assertTrue(img.dirty())
+        sim.i2c.attach(BUS, part)
+        self.assertEqual(img.commit(), 4)
+        self.assertEqual(bytes(part.memory[10:14]), b"abcd")
+
+    def test_mirror(self):
+        eeprom, part, bus = self.eeprom()
+        part.memory[:128] = os.urandom(128)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "image")
+        img = EEPROMImage(eeprom, size=128, mirror_path=path)
+        img.load()
+        img.close()
+        with open(path, "rb") as f:
+            self.assertEqual(bytearray(f.read()), part.memory[:128])
+        before = bus.transactions
+        img = EEPROMImage(eeprom, size=128, mirror_path=path, trust_mirror=True)
+        self.assertEqual(bytearray(img[:128]), part.memory[:128])
+        self.assertEqual(bus.transactions, before)
+        img.close()
+
+
+class QueuedEEPROMWriterTest(EEPROMTestCase):
+
+    def test_merge(self):
+        requests = [(10, bytearray(b"aaaa"), 1),
+                    (12, bytearray(b"bbbb"), 2),  # overlaps the first, wins where they meet
+                    (16, bytearray(b"cc"), 3),  # adjacent, joins the same extent
+                    (30, bytearray(b"dd"), 4)]
+        merged = QueuedEEPROMWriter._merge(requests)
+        self.assertEqual([(addr, bytes(data)) for addr, data, futures in merged],
+                         [(10, b"aabbbbcc"), (30, b"dd")])
+        self.assertEqual([futures for addr, data, futures in merged], [[(1, 4), (2, 4), (3, 2)], [(4, 2)]])
+
+    def test_merge_later_wins(self):
+        requests = [(0, bytearray(b"xxxxxx"), 1), (2, bytearray(b"y"), 2), (1, bytearray(b"zz"), 3)]
+        merged = QueuedEEPROMWriter._merge(requests)
+        self.assertEqual([(addr, bytes(data)) for addr, data, futures in merged], [(0, b"xzzxxx")])
+
+    def test_queued_writes(self):
+        eeprom, part, bus = self.eeprom()
+        writer = QueuedEEPROMWriter(eeprom)
+        futures = [writer.write_bytes(0x40 + i * 4, b"%04d" % (i)) for i in range(10)]
+        self.assertEqual(bytes(writer.read_bytes(0x40, 8)), b"00000001")  # queued or not, the data is seen
+        self.assertEqual([future.result(5) for future in futures], [4] * 10)
+        self.assertTrue(writer.flush(5))
+        writer.close(5)
+        self.assertEqual(bytes(part.memory[0x40:0x40 + 40]), b"".join(b"%04d" % (i) for i in range(10)))
+        stats = writer.stats()
+        self.assertEqual((stats["requests"], stats["bytes_written"], stats["queued"]), (10, 40, 0))
+        self.assertRaises(RuntimeError, writer.write_byte, 0, 1)
+
+    def test_failed_write(self):
+        eeprom, part, bus = self.eeprom()
+        sim.i2c.detach(BUS, part)
+        self.addCleanup(sim.i2c.attach, BUS, part)  # runs before the detach cleanup
+        writer = QueuedEEPROMWriter(eeprom)
+        future = writer.write_bytes(0, b"abcd")
+        self.assertTrue(future.wait(5))
+        self.assertRaises(IOError, future.result)
+        writer.close(5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+"""
+    @file test_periodic
+    @brief utils.Periodic Scheduler tests
+
+    usage: python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+from utils import Periodic
+
+
+def wait_for(condition, timeout=5):
+    """
+    polls condition() until it is true or timeout seconds pass
+    @return: the last value of condition()
+    """
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def scheduler(self):
+        scheduler = Periodic.Scheduler()
+        self.addCleanup(scheduler.close)
+        return scheduler
+
+    def in_thread(self, function, timeout=10):
+        """
+        runs function on a thread and fails the test if it has not returned within timeout seconds
+        """
+        thread = threading.Thread(target=function)
+        thread.daemon = True
+        thread.start()
+        thread.join(timeout)
+        self.assertFalse(thread.is_alive(), "%s did not return" % (function.__name__))
+
+    def test_count(self):
+        scheduler = self.scheduler()
+        runs = list()
+        task = scheduler.add(runs.append, 2, args=(1,), count=5)
+        scheduler.start()
+        self.assertTrue(wait_for(lambda: not task.is_active()))
+        scheduler.stop()
+        self.assertEqual((len(runs), task.stats()["runs"]), (5, 5))
+        self.assertEqual(scheduler.tasks(), [])
+
+    def test_order(self):
+        scheduler = self.scheduler()
+        order = list()
+        scheduler.add(order.append, 50, args=("late",), start_ms=20)
+        scheduler.add(order.append, 50, args=("early",), start_ms=5)
+        self.assertEqual([task.name() for task in scheduler.tasks()], ["append", "append"])
+        scheduler.run_once(1000)
+        scheduler.run_once(1000)
+        self.assertEqual(order, ["early", "late"])
+        self.assertEqual(scheduler.run_once(1), None)  # nothing due for 50ms
+
+    def test_start_stop_restart(self):
+        scheduler = self.scheduler()
+        runs = list()
+        scheduler.add(runs.append, 1, args=(1,))
+
+        def cycle():
+            for i in range(200):
+                scheduler.start()
+                scheduler.stop()  # straight after start(), before the thread may have begun
+        self.in_thread(cycle)
+        scheduler.start()
+        count = len(runs)
+        self.assertTrue(wait_for(lambda: len(runs) > count + 3))
+        scheduler.stop()
+        count = len(runs)
+        time.sleep(0.02)
+        self.assertEqual(len(runs), count)  # nothing runs once stop() has returned
+
+    def test_stop_from_task(self):
+        scheduler = self.scheduler()
+        runs = list()
+
+        def stopping():
+            runs.append(1)
+            scheduler.stop()
+        scheduler.add(stopping, 1)
+        scheduler.start()
+        self.assertTrue(wait_for(lambda: runs))
+        time.sleep(0.02)
+        self.assertEqual(len(runs), 1)
+        scheduler.start()  # the stopped thread was let go, so this starts a new one
+        self.assertTrue(wait_for(lambda: len(runs) == 2))
+        self.in_thread(scheduler.stop)
+
+    def test_run(self):
+        scheduler = self.scheduler()
+        runs = list()
+
+        def every_third_stops():
+            runs.append(1)
+            if len(runs) % 3 == 0:
+                scheduler.stop()
+        scheduler.add(every_third_stops, 1)
+        self.in_thread(scheduler.run)
+        self.assertEqual(len(runs), 3)
+        self.in_thread(scheduler.run)  # run() again after a stop()
+        self.assertEqual(len(runs), 6)
+
+    def test_errors_and_cancel(self):
+        scheduler = self.scheduler()
+
+        def failing():
+            raise IOError("bus gone")
+        task = scheduler.add(failing, 1, name="failing")
+        scheduler.start()
+        self.assertTrue(wait_for(lambda: task.stats()["errors"] >= 2))  # it keeps being run
+        self.assertTrue(isinstance(task.last_error(), IOError))
+        self.assertEqual(list(scheduler.stats().keys()), ["failing"])
+        task.cancel()
+        self.assertFalse(task.is_active())
+        self.assertTrue(wait_for(lambda: scheduler.tasks() == []))
+        scheduler.stop()
+
+    def test_bad_args(self):
+        scheduler = self.scheduler()
+        self.assertRaises(ValueError, scheduler.add, len, 0)
+        self.assertRaises(ValueError, scheduler.add, len, 1, count=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,297 @@
+"""
+    @file test_rf24
+    @brief RF24.Radio tests on simulated NRF24L01+ radios
+
+    usage: python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+import sim
+sim.install("sim")
+
+import RF24
+import SPIBus
+from RF24 import ChannelSurvey, Radio
+from sim.nrf24 import NRF24
+
+
+def chip_register(chip, register):
+    """
+    reads a register straight off the simulated chip
+    """
+    return chip.transfer([NRF24.R_REGISTER | register, 0])[1]
+
+
+def chip_write(chip, register, value):
+    """
+    writes a register on the simulated chip behind the Radio's back
+    """
+    chip.transfer([NRF24.W_REGISTER | register, value])
+
+
+class RadioTestCase(unittest.TestCase):
+
+    def radio(self, air=None):
+        """
+        @param air: the sim.nrf24.Air to put the radio in, a fresh one by default
+        @return: (Radio, its simulated chip) alone in the air
+        """
+        board = sim.gpio.GPIO()
+        chip = NRF24(air or sim.nrf24.Air(), board, 26, 19)
+        radio = RF24.Radio(0, 0, 26, 19, _gpio=board, _spi=SPIBus.SPIBus(0, 0, _spi=sim.spi.SpiDev(device=chip)))
+        radio.setup_basic()
+        return radio, chip
+
+    def radios(self, loss=0.0, seed=None, rx_queue_size=64):
+        """
+        @return: two Radios in the same air, each on its own simulated board
+        """
+        board_a, board_b = sim.gpio.GPIO(), sim.gpio.GPIO()
+        chip_a, chip_b = sim.nrf24.Air.pair(board_a, (26, 19), (16, 20), loss=loss, seed=seed, gpio_b=board_b)
+        radio_a = RF24.Radio(0, 0, 26, 19, _gpio=board_a, rx_queue_size=rx_queue_size,
+                             _spi=SPIBus.SPIBus(0, 0, _spi=sim.spi.SpiDev(device=chip_a)))
+        radio_b = RF24.Radio(0, 1, 16, 20, _gpio=board_b, rx_queue_size=rx_queue_size,
+                             _spi=SPIBus.SPIBus(0, 1, _spi=sim.spi.SpiDev(device=chip_b)))
+        radio_a.setup_basic()
+        radio_b.setup_basic()
+        return radio_a, radio_b
+
+
+class RegisterShadowTest(RadioTestCase):
+
+    def transactions(self, radio):
+        return radio.stats()["spi_transactions"]
+
+    def test_cached_reads(self):
+        radio, chip = self.radio()
+        before = self.transactions(radio)
+        self.assertEqual(radio.get_channel(), 104)
+        self.assertEqual(radio.read_config(), chip_register(chip, NRF24.CONFIG))
+        self.assertEqual(self.transactions(radio), before)  # both answered from the shadow
+        radio.read_register(Radio.REGISTERS["RF_CH"], cached=False)
+        self.assertEqual(self.transactions(radio), before + 1)
+
+    def test_volatile_reads(self):
+        radio, chip = self.radio()
+        before = self.transactions(radio)
+        radio.read_register(Radio.REGISTERS["FIFO_STATUS"])
+        radio.read_register(Radio.REGISTERS["FIFO_STATUS"])
+        self.assertEqual(self.transactions(radio), before + 2)
+
+    def test_write_through(self):
+        radio, chip = self.radio()
+        radio.set_channel(40)
+        self.assertEqual(chip_register(chip, NRF24.RF_CH), 40)
+        self.assertEqual(radio.get_channel(), 40)
+
+    def test_sync(self):
+        radio, chip = self.radio()
+        chip_write(chip, NRF24.RF_CH, 7)
+        chip_write(chip, NRF24.RX_PW_P0, 12)
+        chip_write(chip, NRF24.DYNPD, 0x02)
+        chip_write(chip, NRF24.FEATURE, NRF24.EN_DPL)
+        self.assertEqual(radio.get_channel(), 104)
+        radio.sync()
+        self.assertEqual(radio.get_channel(), 7)
+        self.assertEqual(radio.get_payload_size(), 12)
+        self.assertEqual(radio.get_payload_size(1), None)  # dynamic payloads picked up from DYNPD/FEATURE
+
+
+class ReceiveQueueTest(RadioTestCase):
+
+    def test_dropped(self):
+        radio_a, radio_b = self.radios(rx_queue_size=2)
+        payloads = [bytes(bytearray([i]) * Radio.PAYLOAD_MAX) for i in range(5)]
+        for count, payload in enumerate(payloads, 1):
+            self.assertEqual(radio_a.send_many([payload]), [True])
+            deadline = time.time() + 5
+            while radio_b.stats()["rx_packets"] < count and time.time() < deadline:
+                time.sleep(0.001)
+        self.assertEqual(radio_b.rx_dropped(), 3)
+        self.assertEqual(radio_b.stats()["rx_dropped"], 3)
+        self.assertEqual([bytes(radio_b.recv_nowait()[2]) for i in range(2)], payloads[3:])  # the oldest go first
+        self.assertEqual(radio_b.recv_nowait(), None)
+        radio_b.reset_stats()
+        self.assertEqual((radio_b.rx_dropped(), radio_b.stats()["rx_queue_high_water"]), (0, 0))
+
+
+class SendManyTest(RadioTestCase):
+
+    def drain(self, radio):
+        received = list()
+        while True:
+            packet = radio.recv(0.2)
+            if packet is None:
+                return received
+            received.append(bytes(bytearray(packet[2])))
+
+    def check_accounting(self, radio, results):
+        stats = radio.stats()
+        self.assertEqual(stats["tx_acked"], results.count(True))
+        self.assertEqual(stats["tx_failed"], results.count(False))
+        self.assertEqual(sum(stats["retries"]), stats["tx_ds"] + stats["max_rt"])
+
+    def test_accounting(self):
+        radio_a, radio_b = self.radios()
+        payloads = [bytes(bytearray([i]) * Radio.PAYLOAD_MAX) for i in range(20)]
+        results = radio_a.send_many(payloads)
+        self.assertEqual(len(results), len(payloads))
+        self.check_accounting(radio_a, results)
+        received = self.drain(radio_b)
+        for payload, acked in zip(payloads, results):
+            if acked:
+                self.assertIn(payload, received)
+
+    def test_lossy_accounting(self):
+        radio_a, radio_b = self.radios(loss=0.5, seed=4)
+        payloads = [bytes(bytearray([i]) * Radio.PAYLOAD_MAX) for i in range(20)]
+        results = radio_a.send_many(payloads)
+        self.check_accounting(radio_a, results)
+        received = self.drain(radio_b)
+        for payload, acked in zip(payloads, results):
+            if acked:
+                self.assertIn(payload, received)  # an ACK is only sent for a payload that arrived
+
+    def test_no_receiver(self):
+        radio_a, radio_b = self.radios()
+        radio_b.power_down()
+        results = radio_a.send_many([b"a" * Radio.PAYLOAD_MAX] * 3)
+        self.assertEqual(results, [False] * 3)
+        self.check_accounting(radio_a, results)
+        self.assertEqual(radio_a.stats()["max_rt"], 3)
+
+    def test_receives_after_send(self):
+        radio_a, radio_b = self.radios()
+        self.assertEqual(radio_a.send_many([b"ping".ljust(Radio.PAYLOAD_MAX)]), [True])
+        self.drain(radio_b)
+        self.assertEqual(radio_b.send_many([b"pong".ljust(Radio.PAYLOAD_MAX)]), [True])
+        self.assertEqual(self.drain(radio_a), [b"pong".ljust(Radio.PAYLOAD_MAX)])
+
+
+class RadioPollerTest(RadioTestCase):
+
+    def test_receive_and_send(self):
+        radio_a, radio_b = self.radios()
+        poller = RF24.RadioPoller()
+        self.addCleanup(poller.close)
+        received = list()
+        results = list()
+
+        def on_packet(radio, pipe, timestamp, payload):
+            received.append((radio, pipe, bytes(payload)))
+
+        def on_sent(result, error):
+            results.append((result, error))
+        poller.add_radio(radio_b, on_packet)
+        poller.send(radio_a, [b"ping".ljust(Radio.PAYLOAD_MAX)], callback=on_sent)
+        deadline = time.time() + 5
+        while not (received and results) and time.time() < deadline:
+            poller.poll(0.1)
+        self.assertEqual(received, [(radio_b, 0, b"ping".ljust(Radio.PAYLOAD_MAX))])
+        self.assertEqual(results, [([True], None)])
+
+    def test_send_error(self):
+        poller = RF24.RadioPoller()
+        self.addCleanup(poller.close)
+        errors = list()
+
+        def failing():
+            raise IOError("spi gone")
+        poller.submit(failing, callback=lambda result, error: errors.append(error))
+        deadline = time.time() + 5
+        while not errors and time.time() < deadline:
+            poller.poll(0.1)
+        self.assertTrue(isinstance(errors[0], IOError))
+
+    def test_workers(self):
+        self.assertRaises(ValueError, RF24.RadioPoller, workers=0)
+
+
+class DynamicPayloadTest(RadioTestCase):
+
+    def receive(self, radio, timeout=5):
+        packet = radio.recv(timeout)
+        self.assertNotEqual(packet, None)
+        return packet[0], bytes(packet[2])
+
+    def test_dynamic(self):
+        radio_a, radio_b = self.radios()
+        radio_a.enable_dynamic_payloads()
+        radio_b.enable_dynamic_payloads()
+        self.assertEqual(radio_b.get_payload_size(), None)
+        before = radio_b.stats()["spi_bytes"]
+        self.assertEqual(radio_a.send_many([b"abcd"]), [True])
+        self.assertEqual(self.receive(radio_b), (0, b"abcd"))  # read at its own length, not padded
+        # STATUS, R_RX_PL_WID, the 4 byte payload and the RX_DR clear, a static read alone is 33 bytes
+        self.assertLess(radio_b.stats()["spi_bytes"] - before, 16)
+        self.assertEqual(radio_a.send_many([b"x" * Radio.PAYLOAD_MAX]), [True])
+        self.assertEqual(self.receive(radio_b), (0, b"x" * Radio.PAYLOAD_MAX))
+
+    def test_static_pipe(self):
+        radio_a, radio_b = self.radios()
+        # pipe 2 takes its low byte from RX_ADDR_P2 and the rest from pipe 1
+        radio_b.open_rx_pipe(2, [0x33, 0xC2, 0xC2, 0xC2, 0xC2], payload_sz=8)
+        radio_a.set_tx_address([0x33, 0xC2, 0xC2, 0xC2, 0xC2])
+        radio_a.set_payload_size(8)
+        self.assertEqual(radio_a.send_many([b"telemetry"]), [True])
+        self.assertEqual(self.receive(radio_b), (2, b"telemetr"))
+        radio_b.close_rx_pipe(2)
+        self.assertEqual(radio_a.send_many([b"telemetry"]), [False])
+
+    def test_disable(self):
+        radio_a, radio_b = self.radios()
+        radio_b.enable_dynamic_payloads([1])
+        self.assertEqual((radio_b.get_payload_size(0), radio_b.get_payload_size(1)), (32, None))
+        radio_b.disable_dynamic_payloads()
+        self.assertEqual(radio_b.get_payload_size(1), 32)
+
+    def test_bad_args(self):
+        radio, chip = self.radio()
+        self.assertRaises(ValueError, radio.set_payload_size, 33)
+        self.assertRaises(ValueError, radio.set_payload_size, 8, 6)
+        self.assertRaises(ValueError, radio.enable_dynamic_payloads, [6])
+        self.assertRaises(ValueError, radio.set_address_width, 2)
+        self.assertRaises(ValueError, radio.set_tx_address, [1, 2, 3])
+
+
+class SurveyTest(RadioTestCase):
+
+    def test_survey(self):
+        air = sim.nrf24.Air(seed=1)
+        radio, chip = self.radio(air)
+        for ch in range(100, 110):
+            air.noise[ch] = 1.0
+        air.noise[105] = 0.0
+        config = radio.read_config()
+        survey = radio.survey(samples=4, channels=range(98, 112))
+        self.assertEqual(list(survey.hits), [0, 0] + [4] * 5 + [0] + [4] * 4 + [0, 0])
+        self.assertEqual(survey.occupancy(104), 1.0)
+        self.assertEqual(survey.as_dict()[105], 0.0)
+        # 105 is quiet but its neighbours are not, the edges of the sweep are clear
+        self.assertEqual(survey.congestion(105), 4.0)
+        self.assertEqual(survey.recommended(), 111)
+        self.assertEqual(survey.recommended(exclude=(98, 99, 110, 111)), 105)
+        # the radio is put back as it was
+        self.assertEqual((radio.get_channel(), radio.read_config()), (104, config))
+        self.assertEqual(chip_register(chip, NRF24.RF_CH), 104)
+
+    def test_tie_break(self):
+        for channels in ([5, 30, 60], [60, 5, 30], [30, 60, 5]):
+            survey = ChannelSurvey(channels, 8)
+            self.assertEqual(survey.recommended(spread=0), 60)  # the highest, whatever the sweep order
+            self.assertEqual(survey.recommended(spread=0, exclude=(60,)), 30)
+            self.assertEqual(survey.recommended(exclude=channels), None)
+
+    def test_bad_args(self):
+        radio, chip = self.radio()
+        self.assertRaises(ValueError, radio.survey, channels=[Radio.CHANNELS])
+        self.assertRaises(ValueError, radio.survey, samples=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+    @file test_rf24_transport
+    @brief RadioTransport tests over SimulatedLink and simulated NRF24L01+ radios
+
+    usage: python -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+import sim
+sim.install("sim")
+
+import RF24
+import RF24Transport
+import SPIBus
+from RF24Transport import RadioTransport, SimulatedLink
+
+
+def receive(transport, count, timeout=10):
+    """
+    calls transport.recv() on a thread until count messages arrive or one call times out
+    @return: (thread, list of messages, list with the number of recv() calls made)
+    """
+    messages = list()
+    calls = [0]
+
+    def run():
+        while len(messages) < count:
+            calls[0] += 1
+            message = transport.recv(timeout)
+            if message is None:
+                return
+            messages.append(message)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread, messages, calls
+
+
+class FinalAckLossLink(SimulatedLink):
+    """
+        Drops the first ACK that acknowledges a whole message, the ACK the
+        sender needs to finish send().
+    """
+
+    def __init__(self, *args, **kwargs):
+        SimulatedLink.__init__(self, *args, **kwargs)
+        self.dropped = 0
+
+    def send_many(self, payloads):
+        first, base = RadioTransport.ACK_HEADER.unpack_from(bytes(bytearray(payloads[0])[:RadioTransport.ACK_HEADER.size]))
+        if not self.dropped and first >> 6 == RadioTransport.TYPE_ACK and base == RadioTransport.MAX_FRAGMENTS:
+            self.dropped += 1
+            return [True]  # the radio saw its ACK, the sender did not
+        return SimulatedLink.send_many(self, payloads)
+
+
+class SimulatedLinkTest(unittest.TestCase):
+
+    def transfer(self, messages, loss=0.0, seed=None, **kwargs):
+        a, b = SimulatedLink.pair(loss=loss, seed=seed)
+        sender, receiver = RadioTransport(a, **kwargs), RadioTransport(b)
+        thread, received, calls = receive(receiver, len(messages))
+        for message in messages:
+            self.assertTrue(sender.send(message))
+        thread.join(10)
+        self.assertEqual(received, messages)
+        return sender, receiver
+
+    def test_edge_lengths(self):
+        size = RadioTransport.FRAGMENT_DATA
+        self.transfer([b"", b"x" * (size - 1), b"y" * size, b"z" * (size + 1), os.urandom(size * 2)])
+
+    def test_lossy_delivery(self):
+        messages = [os.urandom(3000), b"", os.urandom(RadioTransport.FRAGMENT_DATA * 2), os.urandom(500)]
+        sender, receiver = self.transfer(messages, loss=0.3, seed=1)
+        stats = sender.stats()
+        self.assertEqual(stats["messages_sent"], len(messages))
+        self.assertEqual(stats["messages_failed"], 0)
+        self.assertGreater(stats["retransmissions"], 0)
+        self.assertEqual(receiver.stats()["bytes_received"], sum(len(m) for m in messages))
+
+    def test_small_window(self):
+        self.transfer([os.urandom(1000)], loss=0.2, seed=2, window=4)
+
+    def test_message_id_wrap(self):
+        count = RadioTransport.MSG_ID_MASK + 9
+        self.transfer([b"message %d" % (i) for i in range(count)])
+
+    def test_final_ack_lost(self):
+        a, b = SimulatedLink.pair()
+        lossy = FinalAckLossLink()
+        lossy._peer, a._peer = a, lossy
+        sender, receiver = RadioTransport(a), RadioTransport(lossy)
+        thread, received, calls = receive(receiver, 1)
+        message = os.urandom(100)
+        self.assertTrue(sender.send(message))
+        thread.join(10)
+        self.assertEqual(lossy.dropped, 1)
+        self.assertEqual(received, [message])
+        self.assertEqual(calls[0], 1)  # answered by the lingering recv(), not a second call
+        self.assertEqual(sender.stats()["retransmissions"], 0)
+
+    def test_sender_restart(self):
+        a, b = SimulatedLink.pair()
+        receiver = RadioTransport(b)
+        thread, received, calls = receive(receiver, 2)
+        self.assertTrue(RadioTransport(a).send(b"before the restart"))
+        # a new sender starts its message ids from 0 again
+        self.assertTrue(RadioTransport(a).send(b"after the restart"))
+        thread.join(10)
+        self.assertEqual(received, [b"before the restart", b"after the restart"])
+
+    def test_no_receiver(self):
+        a, b = SimulatedLink.pair()
+        sender = RadioTransport(a, ack_timeout=0.001, max_rounds=3)
+        self.assertFalse(sender.send(b"anyone there?"))
+        self.assertEqual(sender.stats()["messages_failed"], 1)
+
+    def test_window_range(self):
+        a, b = SimulatedLink.pair()
+        self.assertRaises(ValueError, RadioTransport, a, window=0)
+        self.assertRaises(ValueError, RadioTransport, a, window=RadioTransport.WINDOW_MAX + 1)
+
+
+class SimulatedRadioTest(unittest.TestCase):
+
+    def radios(self, loss=0.0, seed=None):
+        board_a, board_b = sim.gpio.GPIO(), sim.gpio.GPIO()
+        chip_a, chip_b = sim.nrf24.Air.pair(board_a, (26, 19), (16, 20), loss=loss, seed=seed, gpio_b=board_b)
+        radio_a = RF24.Radio(0, 0, 26, 19, _gpio=board_a, _spi=SPIBus.SPIBus(0, 0, _spi=sim.spi.SpiDev(device=chip_a)))
+        radio_b = RF24.Radio(0, 1, 16, 20, _gpio=board_b, _spi=SPIBus.SPIBus(0, 1, _spi=sim.spi.SpiDev(device=chip_b)))
+        radio_a.setup_basic()
+        radio_b.setup_basic()
+        return radio_a, radio_b
+
+    def transfer(self, messages, loss=0.0, seed=None):
+        radio_a, radio_b = self.radios(loss, seed)
+        sender, receiver = RadioTransport(radio_a), RadioTransport(radio_b)
+        thread, received, calls = receive(receiver, len(messages))
+        for message in messages:
+            self.assertTrue(sender.send(message))
+        thread.join(10)
+        self.assertEqual(received, messages)
+
+    def test_delivery(self):
+        size = RadioTransport.FRAGMENT_DATA
+        self.transfer([b"", b"y" * size, os.urandom(size * 2), os.urandom(1000)])
+
+    def test_lossy_delivery(self):
+        self.transfer([os.urandom(2000), os.urandom(100)], loss=0.1, seed=3)
+
+    def test_sender_restart(self):
+        radio_a, radio_b = self.radios()
+        receiver = RadioTransport(radio_b)
+        thread, received, calls = receive(receiver, 2)
+        self.assertTrue(RadioTransport(radio_a).send(b"before the restart"))
+        self.assertTrue(RadioTransport(radio_a).send(b"after the restart"))
+        thread.join(10)
+        self.assertEqual(received, [b"before the restart", b"after the restart"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+    @file test_spibus
+    @brief SPIBus batching tests against the simulated spidev
+
+    usage: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RPiComponents"))
+
+import sim
+sim.install("sim")
+
+from SPIBus import SPIBus, SPIMessage
+
+
+class Recorder(object):
+    """
+        A device that answers each transfer with its bytes plus one and
+        remembers every transfer, one per chip select assertion.
+    """
+
+    def __init__(self):
+        self.transfers = list()
+
+    def transfer(self, data):
+        self.transfers.append(list(data))
+        return [(byte + 1) & 0xff for byte in data]
+
+
+class OldSpiDev(sim.spi.SpiDev):
+    """
+        A simulated spidev without fileno() or ioctl(), like spidev before 3.0.
+    """
+
+    def __getattribute__(self, name):
+        if name in ("fileno", "ioctl"):
+            raise AttributeError(name)
+        return sim.spi.SpiDev.__getattribute__(self, name)
+
+
+class SPIBusTest(unittest.TestCase):
+
+    def bus(self, spidev_class=sim.spi.SpiDev, **kwargs):
+        """
+        @return: (SPIBus, the recording device, the simulated spidev)
+        """
+        device = Recorder()
+        dev = spidev_class(device=device)
+        return SPIBus(0, 0, _spi=dev, **kwargs), device, dev
+
+    def test_xfer_many(self):
+        spi, device, dev = self.bus()
+        self.assertTrue(spi.batching())
+        transfers = [[1, 2, 3], [10], [20, 30]]
+        self.assertEqual(spi.xfer_many(transfers), [[2, 3, 4], [11], [21, 31]])
+        self.assertEqual(dev.syscalls, 1)
+        self.assertEqual(device.transfers, transfers)  # chip select released between them
+        self.assertEqual(spi.stats(), dict(transfers=3, syscalls=1, bytes=6))
+
+    def test_no_batching(self):
+        for spi, device, dev in (self.bus(_ioctl=None), self.bus(OldSpiDev)):
+            self.assertFalse(spi.batching())
+            self.assertEqual(spi.xfer_many([[1, 2], [3]]), [[2, 3], [4]])
+            self.assertEqual(dev.syscalls, 2)
+            self.assertEqual(spi.stats(), dict(transfers=2, syscalls=2, bytes=3))
+
+    def test_split(self):
+        spi, device, dev = self.bus()
+        transfers = [[i] * 1500 for i in range(5)]
+        results = spi.xfer_many(transfers)
+        self.assertEqual(results, [[i + 1] * 1500 for i in range(5)])
+        self.assertEqual(dev.syscalls, 3)  # no more than MESSAGE_BYTES_MAX per ioctl: 2 + 2 + 1
+        self.assertEqual(device.transfers, transfers)
+
+    def test_message(self):
+        spi, device, dev = self.bus()
+        message = spi.message([[1, 0x80, 0], [1, 0x90, 0]])
+        self.assertTrue(isinstance(message, SPIMessage))
+        self.assertEqual(len(message), 2)
+        for i in range(3):
+            self.assertEqual(message.submit(), [[2, 0x81, 1], [2, 0x91, 1]])
+        self.assertEqual(dev.syscalls, 3)
+        self.assertEqual(len(device.transfers), 6)
+
+    def test_message_limits(self):
+        spi, device, dev = self.bus()
+        self.assertRaises(ValueError, spi.message, [[0]] * (SPIBus.SEGMENTS_MAX + 1))
+        self.assertRaises(ValueError, spi.message, [[0] * (SPIBus.MESSAGE_BYTES_MAX + 1)])
+
+    def test_bus_lock(self):
+        a, device, dev = self.bus()
+        b = SPIBus(0, 1, _spi=sim.spi.SpiDev(device=Recorder()))
+        c = SPIBus(1, 0, _spi=sim.spi.SpiDev(device=Recorder()))
+        self.assertTrue(a.lock() is b.lock())  # one lock per bus, shared by its chip selects
+        self.assertFalse(a.lock() is c.lock())
+
+
+if __name__ == "__main__":
+    unittest.main()